@@ -21,5 +21,9 @@ module load h5netcdf/1.2.0-foss-2023a
 
 #python water_withdrawal.py
 srun python -u water_withdrawal_yearly.py
+# 0.1° (--hires) or ensemble years that outlast the wall time: --checkpoint
+# commits every month, so a resubmitted job continues from the last one
+# (about twice the run time, so not for the 0.5° years above).
+#srun python -u water_withdrawal_yearly.py --hires --checkpoint
 #           
 
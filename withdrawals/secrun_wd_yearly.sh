@@ -14,7 +14,8 @@ module load  xarray/2023.9.0-gfbf-2023a
 module load  dask/2023.9.2-foss-2023a
 module load  h5netcdf/1.2.0-foss-2023a
 
-# Launch once per task (MPI) OR let dask-jobqueue start workers.
-# For pure MPI-style fan‑out:
-srun python -u water_withdrawal_yearly.py
+# Launch once per task: task r of n takes every n-th year (SLURM_PROCID /
+# SLURM_NTASKS), the tasks split the node's memory, and rank 0 writes
+# completion_report.json once all have finished.
+srun python -u water_withdrawal_yearly.py --start 1980 --end 2019
 
@@ -19,8 +19,8 @@ Key features
 * **Temperature clipping** – inputs are clipped to 15 ≤ T ≤ 35 °C.
 * **Named factor functions** built from your data (exact at 15 °C & 35 °C).
 * **Vectorised & Dask‑ready** – drop‑in for xarray / NumPy / Dask.
-* **Dotted‑line diagnostic plot** – quick visual sanity check.
-* **Stub for ``micropip``** so imports never fail outside Pyodide.
+* **Headless core** – no Matplotlib at import; the dotted‑line diagnostic
+  plot and the ``micropip`` notebook stub live in ``withdrawal_plots``.
 
 Quick usage
 -----------
@@ -40,43 +40,21 @@ Replace the density & temperature `xarray` objects with your own and run
 # default—and earlier versions can handle our type hints without the
 # future import—we simply removed it to avoid the SyntaxError you saw.
 
-from typing import Callable, Mapping, Union
+from typing import Callable, Mapping, Optional, Union
 
 # ---------------------------------------------------------------------------
-# Optional dependency shim – keeps notebooks happy if ``micropip`` is missing
-# ---------------------------------------------------------------------------
-
-import sys
-import types
-
-if "micropip" not in sys.modules:  # pragma: no cover – executed only if absent
-    micropip_stub = types.ModuleType("micropip")
-
-    def _unsupported(*_args, **_kwargs):  # noqa: D401, ANN001 – stub helper
-        """Raise helpful error guiding the user to install with pip."""
-        raise ModuleNotFoundError(
-            "The 'micropip' package is unavailable in this environment. "
-            "Install dependencies with pip (CPython) or load 'micropip' in Pyodide."
-        )
-
-    micropip_stub.install = _unsupported  # type: ignore[attr-defined]
-    sys.modules["micropip"] = micropip_stub
-
-# ---------------------------------------------------------------------------
-# Scientific stack
+# Scientific stack – compute only. Plotting and the notebook ``micropip``
+# shim live in ``withdrawal_plots`` and load on demand, so batch workers
+# never import Matplotlib.
 # ---------------------------------------------------------------------------
 
 import numpy as np  # type: ignore
 import xarray as xr  # type: ignore
-import os
-import sys
-import types
-import matplotlib.pyplot as plt
-from matplotlib.colors import to_rgb
+
+from withdrawal_kernels import RH_REF, fused_withdrawal, thi_temperature, total_withdrawal
 
 
 NumberArray = Union[float, np.ndarray]
-#os.makedirs(plots, exist_ok=True)
 
 # ---------------------------------------------------------------------------
 # Real withdrawal values provided by the user (litres / head / day)
@@ -118,34 +96,90 @@ FACTOR_FNS: Mapping[str, Callable[[NumberArray], NumberArray]] = {
     for animal, values in _WITHDRAWAL_DATA.items()
 }
 
+# ---------------------------------------------------------------------------
+# Piecewise three‑point curves – also honour the 25 °C measurement
+# (the straight 15–35 °C line misses it badly for pigs and horses).
+# Evaluated with np.interp over whole arrays, which clamps outside 15–35 °C.
+# ---------------------------------------------------------------------------
+
+_ANCHORS = (15.0, 25.0, 35.0)                 # temperatures behind _WITHDRAWAL_DATA
+_KNOTS   = {"linear": (15.0, 35.0), "piecewise": _ANCHORS}
+MODELS   = tuple(_KNOTS)
+
+
+def _make_piecewise_fn(values: np.ndarray) -> Callable[[NumberArray], NumberArray]:
+    """Return f(temp) through all three anchors, linear in between."""
+    knots = np.array(_ANCHORS)
+
+    def _fn(temp: NumberArray) -> NumberArray:  # noqa: D401 – internal helper
+        return np.interp(temp, knots, values)
+
+    _fn.__doc__ = ("Piecewise‑linear withdrawal factor through "
+                   + ", ".join(f"{k:g} °C ({v} L)" for k, v in zip(_ANCHORS, values)) + ".")
+    return _fn
+
+
+PIECEWISE_FNS: Mapping[str, Callable[[NumberArray], NumberArray]] = {
+    animal: _make_piecewise_fn(values)
+    for animal, values in _WITHDRAWAL_DATA.items()
+}
+
+_MODEL_FNS = {"linear": FACTOR_FNS, "piecewise": PIECEWISE_FNS}
+
+
+def _check_model(model: str) -> str:
+    model = model.strip().lower()
+    if model not in _KNOTS:
+        raise ValueError(f"Unknown model '{model}'. Choose from {list(MODELS)}.")
+    return model
+
 # ---------------------------------------------------------------------------
 # Public API.
 #Takes one temperature (or an array) → clips it to 15–35 °C → returns litres per head per day for that animal.
 # ---------------------------------------------------------------------------
 
-def withdrawal_factor(animal: str, temperature: NumberArray) -> NumberArray:
+def withdrawal_factor(animal: str, temperature: NumberArray, model: str = "linear") -> NumberArray:
     """Litres /head /day for *animal* at *temperature* (°C).
 
-    *temperature* is clipped to 15–35 °C, then passed through the
-    species‑specific linear factor function.
+    *temperature* is clipped to 15–35 °C, then passed through the
+    species‑specific factor function: the 15/35 °C straight line
+    (``model="linear"``) or the curve through all three measured anchors
+    (``model="piecewise"``).
     """
     animal=animal.strip().lower()
+    model=_check_model(model)
     if animal not in FACTOR_FNS:
         raise KeyError(f"Unknown animal '{animal}'. Choose from {list(FACTOR_FNS)}.")
 
     temp_clipped = np.clip(temperature, 15.0, 35.0)
-    return FACTOR_FNS[animal](temp_clipped)
+    return _MODEL_FNS[model][animal](temp_clipped)
 
 # looks up the litres/head/day for every grid cell and day using the line below
 # multiplies by the number of animals in that cell → litres/day for the whole cell (still per day).
 #The maths runs through xarray, so it can handle big NetCDF files and Dask chunks automatically.
 
+_METHODS = ("array", "vectorize")
+
+
 def withdrawal_by_gridcell(
     animal: str,
     temperature: xr.DataArray,
     density: xr.DataArray,
+    method: str = "array",
+    model: str = "linear",
 ) -> xr.DataArray:
-    """Water withdrawals per grid‑cell (litres per **cell** per day).
+    """Water withdrawals per grid‑cell (litres per **cell** per day).
+
+    Parameters
+    ----------
+    model
+        Factor curve, ``"linear"`` (default) or ``"piecewise"``; see
+        :pyfunc:`withdrawal_factor`.
+    method
+        ``"array"`` (default) evaluates the clip‑and‑scale model on whole
+        NumPy blocks – one call per Dask chunk instead of one per element.
+        ``"vectorize"`` is the original element‑by‑element path, kept as a
+        reference; both give bit‑identical results.
 
     Notes
     -----
@@ -157,54 +191,564 @@ def withdrawal_by_gridcell(
         argument 'animal'* when both routes were used.
     *   The adapter takes *temperature* as the first positional argument and
         *animal* only as a keyword, so there’s no clash.
+    *   In ``"array"`` mode the adapter casts back to the temperature dtype,
+        which is what ``np.vectorize`` does with ``output_dtypes`` – so the
+        two paths round identically.
     """
     animal=animal.strip().lower()
+    model=_check_model(model)
+    if method not in _METHODS:
+        raise ValueError(f"Unknown method '{method}'. Choose from {list(_METHODS)}.")
+
+    dtype = temperature.dtype
+
     # ---- tiny adapter so apply_ufunc sees the right signature ----
     def _vec(temp: NumberArray, *, animal: str) -> NumberArray:  # noqa: D401
-        return withdrawal_factor(animal, temp)
+        return withdrawal_factor(animal, temp, model)
+
+    def _block(temp: np.ndarray, *, animal: str) -> np.ndarray:  # noqa: D401
+        return np.asarray(withdrawal_factor(animal, temp, model)).astype(dtype, copy=False)
 
     factor = xr.apply_ufunc(
-        _vec,
+        _block if method == "array" else _vec,
         temperature,
         kwargs={"animal": animal},
-        vectorize=True,
+        vectorize=method == "vectorize",
         dask="parallelized",
-        output_dtypes=[temperature.dtype],
+        output_dtypes=[dtype],
     )
 
     return factor * density
 
 # ---------------------------------------------------------------------------
-# Diagnostic plot
+# Multi‑species fused evaluation
+# All species share one clipped temperature field, so we clip (and shift)
+# once per block and reuse it for every row of the coefficient stack.
 # ---------------------------------------------------------------------------
 
-def plot_withdrawal_curves(temperature_range: np.ndarray | None = None) -> None:  # noqa: D401
-    """Plot dotted lines of withdrawal vs temperature for every animal."""
+_UNITS = {"L": (1.0, "L cell-1 day-1"), "m3": (1000.0, "m3 cell-1 day-1")}
+
+
+def _coefficient_stack(animals, model: str = "linear",
+                       table: Optional[Mapping[str, np.ndarray]] = None) -> tuple:
+    """Return (base, slopes, knots) stacked along a species axis.
+
+    *base* is the value at the first knot, *slopes* has one column per
+    segment between knots – for ``"linear"`` that is (y35 − y15) / 20.
+    *table* replaces ``_WITHDRAWAL_DATA`` (values at 15/25/35 °C).
+    """
+    table  = _WITHDRAWAL_DATA if table is None else table
+    knots  = _KNOTS[model]
+    idx    = [_ANCHORS.index(k) for k in knots]
+    values = np.array([np.asarray(table[a], dtype=float)[idx] for a in animals])
+    slopes = np.diff(values, axis=1) / np.diff(knots)
+    return values[:, 0], slopes, knots
+
+
+def _present_species(density_ds: xr.Dataset, name_map: Mapping[str, str]) -> dict:
+    """Density var → animal for the *name_map* entries present in *density_ds*."""
+    present = {}
+    for var, animal in name_map.items():
+        animal = animal.strip().lower()
+        if animal not in FACTOR_FNS:
+            raise KeyError(f"Unknown animal '{animal}'. Choose from {list(FACTOR_FNS)}.")
+        if var not in density_ds:
+            print(f"   ⚠️  {var} missing – skipped", flush=True)
+            continue
+        present[var] = animal
+    return present
+
+
+def _day_weights(weight: np.ndarray, ndays: int) -> np.ndarray:
+    """Per‑day blend weights of one block; must vary along axis 0 only."""
+    w = weight.reshape(len(weight), -1)
+    if w.shape != (ndays, 1):
+        raise ValueError("density_weight must vary only along the leading (time) axis")
+    return w[:, 0]
+
+
+def _fused_block(
+    temp: np.ndarray,
+    dens: np.ndarray,
+    *extra: np.ndarray,
+    names: tuple = (),
+    base: np.ndarray,
+    slopes: np.ndarray,
+    knots: tuple,
+    divisor: float,
+    dtype: Optional[str],
+    backend: Optional[str],
+    rh_ref: float = RH_REF,
+) -> np.ndarray:
+    """Evaluate every species on one block; *dens* carries species last.
+
+    *extra* holds the optional operands listed in *names*: a dewpoint
+    block (``"dew"``) replaces temperature by its THI‑equivalent for this
+    block only; a density increment and per‑day weights (``"delta"``,
+    ``"weight"``) make each day's density ``dens + w·delta``, built one
+    map at a time.
+    """
+    extra = dict(zip(names, extra))
+    if "dew" in extra:
+        temp = thi_temperature(temp, extra["dew"], rh_ref=rh_ref)
+    if "delta" not in extra:
+        out = fused_withdrawal(temp, np.moveaxis(dens, -1, 0), base, slopes, knots=knots,
+                               divisor=divisor, dtype=dtype, backend=backend)
+        return np.moveaxis(out, 0, -1)
+
+    delta = extra["delta"]
+    w     = _day_weights(extra["weight"], temp.shape[0])
+    day   = np.empty(np.broadcast_shapes(dens.shape, delta.shape),
+                     dtype=np.result_type(dens.dtype, delta.dtype))
+    out   = np.empty((temp.shape[0], dens.shape[-1]) + np.broadcast_shapes(temp.shape[1:], day.shape[:-1]),
+                     dtype=np.result_type(temp.dtype, day.dtype))
+    for i in range(temp.shape[0]):
+        np.multiply(delta, w[i], out=day, casting="same_kind")
+        np.add(day, dens, out=day)
+        fused_withdrawal(temp[i], np.moveaxis(day, -1, 0), base, slopes, knots=knots,
+                         divisor=divisor, dtype=dtype, out=out[i], backend=backend)
+    return np.moveaxis(out, 1, -1)
 
-    import matplotlib.pyplot as plt  # postponed heavy import
 
-    if temperature_range is None:
-        temperature_range = np.linspace(15, 35, 400)
+# ---------------------------------------------------------------------------
+# Humidity‑aware (THI) mode
+# ``t2m`` and ``d2m`` travel through apply_ufunc together, so with dask
+# inputs each task converts only its own block and neither full‑year cube
+# is ever held twice. Formula and reference humidity: withdrawal_kernels.
+# ---------------------------------------------------------------------------
+
+def _thi_basis(rh_ref: float) -> str:
+    return f"THI-equivalent temperature (NRC 1971 THI, RH_ref={rh_ref:g}%)"
+
+
+def _dewpoint_operand(temperature: xr.DataArray, dewpoint: Optional[xr.DataArray]) -> list:
+    """``[("dew", dewpoint, [])]`` matched to *temperature*, or ``[]``.
+
+    Coordinates must already agree (apply_ufunc joins exactly); the yearly
+    driver pairs the two files by time before calling in.
+    """
+    if dewpoint is None:
+        return []
+    dewpoint = dewpoint.astype(temperature.dtype, copy=False)
+    return [("dew", _like_chunks(dewpoint, temperature), [])]
 
-    plt.figure(figsize=(7, 4))
-    for animal, fn in FACTOR_FNS.items():
-        plt.plot(
-            temperature_range,
-            fn(temperature_range),
-            linestyle=":",  # dotted
-            label=animal,
+
+def _like_chunks(x: xr.DataArray, temperature: xr.DataArray) -> xr.DataArray:
+    """Chunk *x* like *temperature* along their shared dims (if it is lazy)."""
+    if temperature.chunks is None or x.chunks is not None:
+        return x
+    return x.chunk({d: c for d, c in zip(temperature.dims, temperature.chunks) if d in x.dims})
+
+
+def thi_equivalent_temperature(
+    temperature: xr.DataArray,
+    dewpoint: xr.DataArray,
+    rh_ref: float = RH_REF,
+) -> xr.DataArray:
+    """Temperature (°C) with the same NRC THI at *rh_ref* % humidity.
+
+    Equals *temperature* where the relative humidity implied by *dewpoint*
+    is *rh_ref*; higher on humid days, lower on dry ones. Lazy on dask
+    inputs. Feeding the result to :pyfunc:`withdrawal_factor` reproduces
+    the THI mode of :pyfunc:`withdrawals_by_gridcell`.
+    """
+    dewpoint = _dewpoint_operand(temperature, dewpoint)[0][1]
+    return xr.apply_ufunc(
+        thi_temperature,
+        temperature,
+        dewpoint,
+        kwargs={"rh_ref": rh_ref},
+        dask="parallelized",
+        output_dtypes=[temperature.dtype],
+    ).assign_attrs(units="degC", long_name=_thi_basis(rh_ref))
+
+
+def withdrawals_by_gridcell(
+    temperature: xr.DataArray,
+    density_ds: xr.Dataset,
+    name_map: Mapping[str, str],
+    units: str = "L",
+    backend: Optional[str] = None,
+    model: str = "linear",
+    dtype: Optional[str] = None,
+    dewpoint: Optional[xr.DataArray] = None,
+    rh_ref: float = RH_REF,
+    density_delta: Optional[xr.Dataset] = None,
+    density_weight: Optional[xr.DataArray] = None,
+) -> xr.Dataset:
+    """Withdrawals per grid‑cell for **all** species in one pass.
+
+    *name_map* maps density variable → animal keyword (``{"CowPop":
+    "cattle", …}``); density variables absent from *density_ds* are
+    skipped with a warning. The result holds one ``<animal>_wd`` variable
+    per species, each bit‑identical to :pyfunc:`withdrawal_by_gridcell`
+    (divided by 1000 when ``units="m3"``), but temperature is read and
+    clipped once instead of once per species.
+
+    *model* selects the factor curve as in :pyfunc:`withdrawal_factor`.
+    *backend* picks the block kernel (``"numpy"``, ``"numexpr"``,
+    ``"numba"``); ``None`` uses :pyfunc:`withdrawal_kernels.get_backend`.
+    Only ``"numpy"`` is bit‑identical, see :pymod:`withdrawal_kernels`.
+    ``dtype="float32"`` runs the whole pass (inputs, coefficients, output)
+    in single precision, halving memory; ``None`` keeps the old promotion
+    to the density dtype.
+
+    Passing *dewpoint* (°C, same days and grid as *temperature*) switches
+    to the humidity‑aware THI mode: each block evaluates the curves at the
+    THI‑equivalent temperature, see :pyfunc:`thi_equivalent_temperature`.
+
+    *density_delta* and *density_weight* (``time``) interpolate density
+    day by day as ``density_ds + weight·density_delta`` without building
+    a (time, lat, lon) density cube; ``withdrawal_density.daily_density``
+    provides all three from the annual maps.
+    """
+    if units not in _UNITS:
+        raise ValueError(f"Unknown units '{units}'. Choose from {list(_UNITS)}.")
+    divisor, units_attr = _UNITS[units]
+
+    model   = _check_model(model)
+    present = _present_species(density_ds, name_map)
+    names   = [f"{a}_wd" for a in present.values()]
+    dens    = (density_ds[list(present)]
+               .to_array("species")
+               .assign_coords(species=names))
+    base, slopes, knots = _coefficient_stack(present.values(), model)
+    if dtype is not None:
+        temperature = temperature.astype(dtype, copy=False)
+        dens        = dens.astype(dtype, copy=False)
+    extra = _dewpoint_operand(temperature, dewpoint)
+    if density_delta is not None:
+        delta = (density_delta[list(present)]
+                 .to_array("species")
+                 .assign_coords(species=names))
+        extra += [("delta", delta.astype(dens.dtype, copy=False), ["species"]),
+                  ("weight", _like_chunks(density_weight, temperature), [])]
+
+    stacked = xr.apply_ufunc(
+        _fused_block,
+        temperature,
+        dens,
+        *[x for _, x, _ in extra],
+        input_core_dims=[[], ["species"]] + [core for _, _, core in extra],
+        output_core_dims=[["species"]],
+        kwargs={"base": base, "slopes": slopes, "knots": knots,
+                "divisor": divisor, "dtype": dtype, "backend": backend,
+                "rh_ref": rh_ref, "names": tuple(n for n, _, _ in extra)},
+        dask="parallelized",
+        output_dtypes=[np.result_type(temperature.dtype, dens.dtype)],
+        dask_gufunc_kwargs={"output_sizes": {"species": len(names)}},
+    ).assign_coords(species=names)
+
+    ds = stacked.to_dataset(dim="species")
+    for name, animal in zip(names, present.values()):
+        ds[name].attrs.update(
+            units=units_attr,
+            long_name=f"{animal} drinking-water withdrawal",
         )
+        if dewpoint is not None:
+            ds[name].attrs["temperature_basis"] = _thi_basis(rh_ref)
+    return ds
+
+# ---------------------------------------------------------------------------
+# Total‑only fast path
+# Every curve is base + Σ_k slope_k·(clip(T, x_k, x_k+1) − x_k), so the
+# all‑species sum is
+#   total(T) = A(lat,lon) + Σ_k B_k(lat,lon)·clip(T, x_k, x_k+1)
+# with A = Σ dens·(base − Σ_k slope_k·x_k) and B_k = Σ dens·slope_k, built
+# once per year. For the linear model that is A + B·clip(T, 15, 35).
+# ---------------------------------------------------------------------------
+
+def total_withdrawal_coefficients(
+    density_ds: xr.Dataset,
+    name_map: Mapping[str, str],
+    units: str = "L",
+    model: str = "linear",
+) -> xr.Dataset:
+    """Per‑cell intercept ``A`` and per‑segment slopes ``B`` of the total.
+
+    ``B`` carries a ``segment`` dimension (one entry for ``"linear"``, two
+    for ``"piecewise"``) and the knots in its attributes. NaN in any
+    species' density propagates to the cell, exactly as summing the
+    per‑species cubes does.
+    """
+    if units not in _UNITS:
+        raise ValueError(f"Unknown units '{units}'. Choose from {list(_UNITS)}.")
+    divisor, units_attr = _UNITS[units]
+
+    model   = _check_model(model)
+    present = _present_species(density_ds, name_map)
+    base, slopes, knots = _coefficient_stack(present.values(), model)
+    offset  = base - (slopes * np.array(knots[:-1])).sum(axis=1)
+
+    A = sum(density_ds[v] * offset[i] for i, v in enumerate(present))
+    B = xr.concat(
+        [sum(density_ds[v] * slopes[i, k] for i, v in enumerate(present))
+         for k in range(slopes.shape[1])],
+        dim="segment",
+    )
+
+    return xr.Dataset(
+        {
+            "A": (A / divisor).assign_attrs(units=units_attr),
+            "B": (B / divisor).assign_attrs(units=f"{units_attr} degC-1", knots=list(knots)),
+        }
+    )
+
+
+def _total_block(temp: np.ndarray, A: np.ndarray, B: np.ndarray,
+                 *extra: np.ndarray, names: tuple = (),
+                 knots: tuple, backend: Optional[str],
+                 rh_ref: float = RH_REF) -> np.ndarray:
+    """A + Σ B_k·clip_k(T) on one block; *B* carries segments last.
+
+    Optional operands as in :pyfunc:`_fused_block`; with ``"dA"``/``"dB"``
+    and ``"weight"`` the coefficients of day *i* are ``A + w_i·dA`` etc.
+    """
+    extra = dict(zip(names, extra))
+    if "dew" in extra:
+        temp = thi_temperature(temp, extra["dew"], rh_ref=rh_ref)
+    if "dA" not in extra:
+        return total_withdrawal(temp, A, np.moveaxis(B, -1, 0), knots=knots, backend=backend)
+
+    dA, dB = extra["dA"], extra["dB"]
+    w      = _day_weights(extra["weight"], temp.shape[0])
+    a_day  = np.empty(np.broadcast_shapes(A.shape, dA.shape), dtype=np.result_type(A, dA))
+    b_day  = np.empty(np.broadcast_shapes(B.shape, dB.shape), dtype=np.result_type(B, dB))
+    out    = np.empty(np.broadcast_shapes(temp.shape, (1,) + a_day.shape),
+                      dtype=np.result_type(temp.dtype, a_day.dtype))
+    for i in range(temp.shape[0]):
+        np.multiply(dA, w[i], out=a_day, casting="same_kind")
+        np.add(a_day, A, out=a_day)
+        np.multiply(dB, w[i], out=b_day, casting="same_kind")
+        np.add(b_day, B, out=b_day)
+        total_withdrawal(temp[i], a_day, np.moveaxis(b_day, -1, 0), knots=knots,
+                         out=out[i], backend=backend)
+    return out
+
+
+def total_withdrawal_by_gridcell(
+    temperature: xr.DataArray,
+    density_ds: xr.Dataset,
+    name_map: Mapping[str, str],
+    units: str = "L",
+    backend: Optional[str] = None,
+    model: str = "linear",
+    dtype: Optional[str] = None,
+    dewpoint: Optional[xr.DataArray] = None,
+    rh_ref: float = RH_REF,
+    density_delta: Optional[xr.Dataset] = None,
+    density_weight: Optional[xr.DataArray] = None,
+) -> xr.DataArray:
+    """All‑species total withdrawal per grid‑cell as ``total_wd``.
+
+    Equal to summing the ``<animal>_wd`` variables of
+    :pyfunc:`withdrawals_by_gridcell` up to floating‑point rounding, but
+    costs one multiply‑add per cell‑day instead of one cube per species.
+    (The per‑species path rounds factors to the temperature dtype, so with
+    float32 ``t2m`` the two agree to ~1e‑7 relative; with float64 to ~1e‑15.)
+    ``dtype="float32"`` evaluates in single precision. *dewpoint* selects
+    the THI mode and *density_delta*/*density_weight* the day‑by‑day
+    density interpolation as in :pyfunc:`withdrawals_by_gridcell`; the
+    coefficient maps are linear in density, so each day only blends
+    ``A``/``B`` with their increments.
+    """
+    coef = total_withdrawal_coefficients(density_ds, name_map, units=units, model=model)
+    A, B = coef["A"], coef["B"]
+    if dtype is not None:
+        temperature = temperature.astype(dtype, copy=False)
+        A, B        = A.astype(dtype, copy=False), B.astype(dtype, copy=False)
+    extra = _dewpoint_operand(temperature, dewpoint)
+    if density_delta is not None:
+        d_coef = total_withdrawal_coefficients(density_delta, name_map, units=units, model=model)
+        extra += [("dA", d_coef["A"].astype(A.dtype, copy=False), []),
+                  ("dB", d_coef["B"].astype(B.dtype, copy=False), ["segment"]),
+                  ("weight", _like_chunks(density_weight, temperature), [])]
+
+    total = xr.apply_ufunc(
+        _total_block,
+        temperature,
+        A,
+        B,
+        *[x for _, x, _ in extra],
+        input_core_dims=[[], [], ["segment"]] + [core for _, _, core in extra],
+        kwargs={"knots": tuple(B.attrs["knots"]), "backend": backend,
+                "rh_ref": rh_ref, "names": tuple(n for n, _, _ in extra)},
+        dask="parallelized",
+        output_dtypes=[np.result_type(temperature.dtype, A.dtype, B.dtype)],
+    )
+    total = total.rename("total_wd").assign_attrs(
+        units=A.attrs["units"],
+        long_name="total livestock drinking-water withdrawal",
+    )
+    if dewpoint is not None:
+        total.attrs["temperature_basis"] = _thi_basis(rh_ref)
+    return total
+
+# ---------------------------------------------------------------------------
+# Hourly input
+# Clipping is nonlinear, so f(daily‑mean T) ≠ daily mean of f(T_hour). The
+# curves are linear in the clipped segments, so the exact daily mean only
+# needs each day's mean of clip(T, x_k, x_k+1) per segment:
+#   mean_h f(T_h) = base − Σ_k slope_k·x_k + Σ_k slope_k·mean_h clip_k(T_h)
+# That reduction runs one day (24 slices) per dask task; the species are
+# then evaluated on daily‑sized maps only.
+# ---------------------------------------------------------------------------
+
+HOURS_PER_DAY = 24
+
+
+def daily_clip_means(temperature: xr.DataArray, model: str = "linear",
+                     time_chunk: Optional[int] = None) -> xr.DataArray:
+    """Per‑day mean of ``clip(T, x_k, x_k+1)`` of hourly *temperature*.
+
+    Lazy, with a trailing ``segment`` dim; an eager input is chunked one
+    day at a time first. Hours that are NaN are left out of the mean.
+    *time_chunk* regroups the (small) daily means into blocks of that many
+    days, so the outputs built on them come in blocks that size too.
+    """
+    knots = _KNOTS[_check_model(model)]
+    if temperature.chunks is None:
+        temperature = temperature.chunk(time=HOURS_PER_DAY)
+    means = xr.concat(
+        [temperature.clip(lo, hi).resample(time="1D").mean()
+         for lo, hi in zip(knots[:-1], knots[1:])],
+        dim="segment",
+    ).transpose(..., "segment")
+    return means if time_chunk is None else means.chunk(time=time_chunk)
 
-    plt.xlabel(" Temperature (°C)")
-    plt.ylabel("Water withdrawal (L/head/day)")
-    plt.title("Livestock water use intensity vs temperature )")
-    plt.legend(ncol=2, fontsize="small")
-    plt.tight_layout()
 
-    # ensure ./plots exists
-    os.makedirs("plots2", exist_ok=True)
-    plt.savefig("plots2/my_result.png", dpi=300, bbox_inches="tight")
-    plt.show()
+def _blend(dens: xr.DataArray, delta: Optional[xr.DataArray], weight: Optional[xr.DataArray]):
+    return dens if delta is None else dens + weight * delta
+
+
+def withdrawals_from_hourly(
+    temperature: xr.DataArray,
+    density_ds: xr.Dataset,
+    name_map: Mapping[str, str],
+    units: str = "L",
+    model: str = "linear",
+    dtype: Optional[str] = None,
+    density_delta: Optional[xr.Dataset] = None,
+    density_weight: Optional[xr.DataArray] = None,
+    time_chunk: Optional[int] = None,
+) -> xr.Dataset:
+    """Daily ``<animal>_wd`` from **hourly** temperature, lazily.
+
+    Same variables and units as :pyfunc:`withdrawals_by_gridcell`, but each
+    day's factor is the mean of the 24 hourly factors rather than the
+    factor of the daily mean. *density_delta*/*density_weight* blend the
+    density per day as there; *time_chunk* sets the output block length
+    in days (see :pyfunc:`daily_clip_means`).
+    """
+    if units not in _UNITS:
+        raise ValueError(f"Unknown units '{units}'. Choose from {list(_UNITS)}.")
+    divisor, units_attr = _UNITS[units]
+
+    model   = _check_model(model)
+    present = _present_species(density_ds, name_map)
+    base, slopes, knots = _coefficient_stack(present.values(), model)
+    offset  = base - (slopes * np.array(knots[:-1])).sum(axis=1)
+    means   = daily_clip_means(temperature, model, time_chunk)
+    if dtype is not None:
+        means = means.astype(dtype)
+
+    ds = xr.Dataset()
+    for i, (var, animal) in enumerate(present.items()):
+        factor = offset[i] + (means * slopes[i]).sum("segment")
+        dens   = _blend(density_ds[var],
+                        None if density_delta is None else density_delta[var], density_weight)
+        if dtype is not None:
+            dens = dens.astype(dtype)
+        wd = (factor * dens / divisor).transpose("time", ...)
+        wd.attrs = dict(units=units_attr, long_name=f"{animal} drinking-water withdrawal",
+                        temperature_basis="mean of hourly factors")
+        ds[f"{animal}_wd"] = wd
+    return ds
+
+
+def total_withdrawal_from_hourly(
+    temperature: xr.DataArray,
+    density_ds: xr.Dataset,
+    name_map: Mapping[str, str],
+    units: str = "L",
+    model: str = "linear",
+    dtype: Optional[str] = None,
+    density_delta: Optional[xr.Dataset] = None,
+    density_weight: Optional[xr.DataArray] = None,
+    time_chunk: Optional[int] = None,
+) -> xr.DataArray:
+    """Daily ``total_wd`` from hourly temperature: ``A + Σ_k B_k·mean clip_k``."""
+    coef  = total_withdrawal_coefficients(density_ds, name_map, units=units, model=model)
+    A, B  = coef["A"], coef["B"]
+    if density_delta is not None:
+        d_coef = total_withdrawal_coefficients(density_delta, name_map, units=units, model=model)
+        A, B   = _blend(A, d_coef["A"], density_weight), _blend(B, d_coef["B"], density_weight)
+    means = daily_clip_means(temperature, model, time_chunk)
+    if dtype is not None:
+        means, A, B = means.astype(dtype), A.astype(dtype), B.astype(dtype)
+
+    total = (A + (B * means).sum("segment")).transpose("time", ...)
+    total.attrs = dict(units=coef["A"].attrs["units"],
+                       long_name="total livestock drinking-water withdrawal",
+                       temperature_basis="mean of hourly factors")
+    return total.rename("total_wd")
+
+
+def withdrawal_bounds(
+    density_ds: xr.Dataset,
+    name_map: Mapping[str, str],
+    units: str = "L",
+    model: str = "linear",
+) -> dict:
+    """Value range ``{var: (lo, hi)}`` of every output variable.
+
+    Derived from the density maps and the factor values at the knots, so
+    no pass over temperature is needed – used to pick CF packing
+    parameters before the data exist. Covers each ``<animal>_wd`` and
+    ``total_wd``.
+    """
+    divisor, _ = _UNITS[units]
+    model      = _check_model(model)
+    present    = _present_species(density_ds, name_map)
+    base, slopes, knots = _coefficient_stack(present.values(), model)
+    at_knots   = np.column_stack([base, base[:, None] + np.cumsum(slopes * np.diff(knots), axis=1)])
+
+    bounds = {}
+    for i, (var, animal) in enumerate(present.items()):
+        d = density_ds[var]
+        products = np.outer([float(d.min()), float(d.max())], [at_knots[i].min(), at_knots[i].max()])
+        bounds[f"{animal}_wd"] = (products.min() / divisor, products.max() / divisor)
+
+    coef  = total_withdrawal_coefficients(density_ds, name_map, units=units, model=model)
+    lo_hi = [coef["A"] + sum(coef["B"].isel(segment=k) * np.clip(x, knots[k], knots[k + 1])
+                             for k in range(len(knots) - 1))
+             for x in knots]
+    bounds["total_wd"] = (min(float(v.min()) for v in lo_hi), max(float(v.max()) for v in lo_hi))
+    return bounds
+
+
+def coefficients_version() -> str:
+    """Short hash of the withdrawal table, knots and unit scales.
+
+    Changes whenever a value behind the factor curves does; the yearly
+    driver records it per output so reruns redo years built on old values.
+    """
+    import hashlib
+    import json
+
+    spec = dict(table={a: np.asarray(v, dtype=float).tolist() for a, v in sorted(_WITHDRAWAL_DATA.items())},
+                anchors=_ANCHORS, knots=_KNOTS, units={u: s for u, (s, _) in _UNITS.items()})
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()[:12]
+
+# ---------------------------------------------------------------------------
+# Diagnostic plot – lives in withdrawal_plots; loaded on first access
+# ---------------------------------------------------------------------------
+
+def __getattr__(name: str):
+    if name == "plot_withdrawal_curves":
+        from withdrawal_plots import plot_withdrawal_curves
+        return plot_withdrawal_curves
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 # ---------------------------------------------------------------------------
@@ -219,6 +763,8 @@ def _self_tests() -> None:  # pragma: no cover – light runtime checks
         assert np.isclose(withdrawal_factor(animal, 35), y35), f"{animal} 35 °C mismatch"
         assert np.isclose(withdrawal_factor(animal, 10), y15), f"{animal} clip‑low failed"
         assert np.isclose(withdrawal_factor(animal, 40), y35), f"{animal} clip‑high failed"
+        for t, y in zip(_ANCHORS, values):
+            assert np.isclose(withdrawal_factor(animal, t, "piecewise"), y), f"{animal} piecewise {t} °C mismatch"
 
     # Quick grid‑cell shape check
     temps = xr.DataArray([15, 25, 35], dims="time")
@@ -226,22 +772,158 @@ def _self_tests() -> None:  # pragma: no cover – light runtime checks
     res   = withdrawal_by_gridcell("cattle", temps, dens)
     assert res.shape == (3,), "Grid‑cell multiplication failed"
 
+    # Whole‑array path must match the element‑wise reference bit for bit
+    rng   = np.random.default_rng(0)
+    dims  = ("time", "lat", "lon")
+    dens  = xr.DataArray(rng.uniform(0, 500, (6, 8)), dims=dims[1:])
+    for dtype in ("float32", "float64"):
+        temps = xr.DataArray(rng.uniform(0, 50, (5, 6, 8)).astype(dtype), dims=dims)
+        for animal in _WITHDRAWAL_DATA:
+            ref = withdrawal_by_gridcell(animal, temps, dens, method="vectorize")
+            new = withdrawal_by_gridcell(animal, temps, dens, method="array")
+            assert ref.dtype == new.dtype, f"{animal} {dtype} dtype drift"
+            assert np.array_equal(ref.values, new.values), f"{animal} {dtype} array path differs"
+
+    # Fused multi‑species path must match the per‑species path bit for bit
+    dens_ds = xr.Dataset({a: dens * (i + 1) for i, a in enumerate(_WITHDRAWAL_DATA)})
+    fused   = withdrawals_by_gridcell(temps, dens_ds, {a: a for a in _WITHDRAWAL_DATA}, units="m3")
+    for i, animal in enumerate(_WITHDRAWAL_DATA):
+        ref = withdrawal_by_gridcell(animal, temps, dens_ds[animal]) / 1000.0
+        assert np.array_equal(ref.values, fused[f"{animal}_wd"].values), f"{animal} fused path differs"
+
+    # Total‑only path must agree with the sum of the species variables
+    total = total_withdrawal_by_gridcell(temps, dens_ds, {a: a for a in _WITHDRAWAL_DATA}, units="m3")
+    assert np.allclose(total.values, sum(fused[v] for v in fused).values, rtol=1e-12), "total_wd mismatch"
+
+    # Compiled backends (when installed) agree to float rounding
+    from withdrawal_kernels import available_backends
+    for backend in available_backends():
+        alt = withdrawals_by_gridcell(temps, dens_ds, {a: a for a in _WITHDRAWAL_DATA},
+                                      units="m3", backend=backend)
+        alt_total = total_withdrawal_by_gridcell(temps, dens_ds, {a: a for a in _WITHDRAWAL_DATA},
+                                                 units="m3", backend=backend)
+        assert all(np.allclose(alt[v].values, fused[v].values, rtol=1e-6) for v in fused), backend
+        assert np.allclose(alt_total.values, total.values, rtol=1e-6), backend
+
+    # Piecewise model through the fused, total and compiled paths
+    for backend in available_backends():
+        pw = withdrawals_by_gridcell(temps, dens_ds, {a: a for a in _WITHDRAWAL_DATA},
+                                     backend=backend, model="piecewise")
+        for animal in _WITHDRAWAL_DATA:
+            ref = withdrawal_by_gridcell(animal, temps, dens_ds[animal], model="piecewise")
+            assert np.allclose(pw[f"{animal}_wd"].values, ref.values, rtol=1e-12), f"{animal} piecewise {backend}"
+        pw_total = total_withdrawal_by_gridcell(temps, dens_ds, {a: a for a in _WITHDRAWAL_DATA},
+                                                backend=backend, model="piecewise")
+        assert np.allclose(pw_total.values, sum(pw[v] for v in pw).values, rtol=1e-12), f"piecewise total {backend}"
+
+    # Analytic bounds must enclose the data
+    for model in MODELS:
+        nm     = {a: a for a in _WITHDRAWAL_DATA}
+        bounds = withdrawal_bounds(dens_ds, nm, units="m3", model=model)
+        out    = withdrawals_by_gridcell(temps, dens_ds, nm, units="m3", model=model)
+        out["total_wd"] = total_withdrawal_by_gridcell(temps, dens_ds, nm, units="m3", model=model)
+        for v, (lo, hi) in bounds.items():
+            tol = 1e-9 * max(abs(lo), abs(hi))
+            assert lo - tol <= float(out[v].min()) and float(out[v].max()) <= hi + tol, f"{v} {model} bounds"
+
+    # THI mode: no‑op at the reference humidity, hotter when humid, and the
+    # fused, total and dask‑chunked paths agree with converting up front
+    nm  = {a: a for a in _WITHDRAWAL_DATA}
+    t64 = temps.astype("float64")
+    ref_dew = t64 - 9.0                                  # RH ≠ RH_ref almost everywhere
+    g   = np.log(RH_REF / 100.0) + 17.625 * t64 / (243.04 + t64)
+    at_ref = thi_equivalent_temperature(t64, 243.04 * g / (17.625 - g))
+    assert np.allclose(at_ref.values, t64.values, atol=1e-9), "THI not neutral at RH_ref"
+    warm = t64.where(t64 > 15.0)                         # THI ordering flips below 14.4 °C
+    assert bool((thi_equivalent_temperature(warm, warm) >= warm - 1e-9).where(warm.notnull(), True).all()), \
+        "THI saturated"
+    teq = thi_equivalent_temperature(t64, ref_dew)
+    thi = withdrawals_by_gridcell(t64, dens_ds, nm, units="m3", dewpoint=ref_dew)
+    ref = withdrawals_by_gridcell(teq, dens_ds, nm, units="m3")
+    assert all(np.array_equal(thi[v].values, ref[v].values) for v in ref), "THI fused path differs"
+    lazy = total_withdrawal_by_gridcell(t64.chunk(time=2), dens_ds, nm, units="m3", dewpoint=ref_dew)
+    assert lazy.chunks is not None, "THI total not lazy"
+    assert np.allclose(lazy.values, sum(ref[v] for v in ref).values, rtol=1e-12), "THI total differs"
+
+    # Day‑by‑day density blend equals an explicit (time, lat, lon) cube
+    delta  = dens_ds * 0.25
+    weight = xr.DataArray(np.linspace(0, 0.9, t64.sizes["time"]), dims="time")
+    blend  = withdrawals_by_gridcell(t64, dens_ds, nm, density_delta=delta, density_weight=weight)
+    cube   = withdrawals_by_gridcell(t64, dens_ds + weight * delta, nm)
+    assert all(np.allclose(blend[v].values, cube[v].transpose(*blend[v].dims).values, rtol=1e-12)
+               for v in cube), "density blend differs"
+    blend_total = total_withdrawal_by_gridcell(t64.chunk(time=2), dens_ds, nm, density_delta=delta,
+                                               density_weight=weight)
+    assert np.allclose(blend_total.values, sum(blend[v] for v in blend).values, rtol=1e-12), "blend total"
+
+    # Hourly mode: daily mean of hourly factors, not factor of the daily mean
+    hours = xr.DataArray(rng.uniform(0, 45, (48, 6, 8)), dims=dims,
+                         coords={"time": np.arange("2019-01-01T00", "2019-01-03T00", dtype="datetime64[h]")})
+    for model in MODELS:
+        per_hour = withdrawals_by_gridcell(hours, dens_ds, nm, model=model).resample(time="1D").mean()
+        hourly   = withdrawals_from_hourly(hours, dens_ds, nm, model=model, time_chunk=2).compute()
+        assert all(np.allclose(hourly[v].values, per_hour[v].values, rtol=1e-12) for v in hourly), f"hourly {model}"
+        hourly_total = total_withdrawal_from_hourly(hours, dens_ds, nm, model=model)
+        assert np.allclose(hourly_total.values, sum(hourly[v] for v in hourly).values, rtol=1e-12), "hourly total"
+
     print("✅ All self‑tests passed.")
 
+
+def _test_inputs(ntime: int = 5, seed: int = 0) -> tuple:  # pragma: no cover
+    """``(temperature, density dataset, name map)`` on a random 6 × 8 grid.
+
+    Daily temperatures from 2019‑01‑30 and one map per species; the
+    self‑tests of the sibling modules run on these.
+    """
+    rng  = np.random.default_rng(seed)
+    nm   = {a: a for a in _WITHDRAWAL_DATA}
+    dens = xr.DataArray(rng.uniform(0, 500, (6, 8)), dims=("lat", "lon"))
+    temp = xr.DataArray(rng.uniform(0, 50, (ntime, 6, 8)), dims=("time", "lat", "lon"),
+                        coords={"time": np.datetime64("2019-01-30", "D") + np.arange(ntime)})
+    return temp, xr.Dataset({a: dens * (i + 1) for i, a in enumerate(nm)}), nm
+
+
+def _benchmark(shape: tuple = (366, 360, 720), animal: str = "cattle") -> None:  # pragma: no cover
+    """Time both evaluation methods on one synthetic year of daily data.
+
+    The element‑wise path is timed on a 10‑day slice and scaled up – a full
+    year takes several minutes per species.
+    """
+    import time
+
+    rng  = np.random.default_rng(0)
+    dims = ("time", "lat", "lon")
+    temp = xr.DataArray(rng.uniform(-30, 45, shape).astype("float32"), dims=dims)
+    dens = xr.DataArray(rng.uniform(0, 500, shape[1:]), dims=dims[1:])
+
+    for method, ndays in (("vectorize", 10), ("array", shape[0])):
+        t0 = time.perf_counter()
+        withdrawal_by_gridcell(animal, temp.isel(time=slice(0, ndays)), dens, method=method)
+        secs = (time.perf_counter() - t0) * shape[0] / ndays
+        print(f"{method:>9}: {secs:8.2f} s per year ({animal}, {shape})")
+
+
 if __name__ == "__main__":  # pragma: no cover
     _self_tests()
     # Uncomment to display the dotted‑line plot (requires Matplotlib)
+    from withdrawal_plots import plot_withdrawal_curves
     plot_withdrawal_curves()
 
 
 __all__ = [
     "withdrawal_factor",
     "withdrawal_by_gridcell",
+    "withdrawals_by_gridcell",
+    "total_withdrawal_coefficients",
+    "total_withdrawal_by_gridcell",
+    "withdrawal_bounds",
+    "coefficients_version",
+    "thi_equivalent_temperature",
+    "daily_clip_means",
+    "withdrawals_from_hourly",
+    "total_withdrawal_from_hourly",
     "plot_withdrawal_curves",
     "FACTOR_FNS",
+    "PIECEWISE_FNS",
+    "MODELS",
 ]
-
-
-#plot_withdrawal_curves()
-
-
@@ -4,31 +4,118 @@ Create ONE NetCDF per year (1980-2019) containing daily water-withdrawal
 maps for all livestock species.
 
 • temperature file      : $VSC_SCRATCH/era5land_daily/t2m_1980_2019.nc
+• dewpoint file (--thi) : $VSC_SCRATCH/era5land_daily/d2m_1980_2019.nc
+• hourly t2m (--hourly) : $VSC_SCRATCH/era5land_hourly/t2m_<year>*.nc
+• native t2m (--hires)  : $VSC_SCRATCH/era5land_daily/t2m_1980_2019_0p1.nc (d2m_… with --thi)
 • density file          : $VSC_HOME/GLWD/liv_density/Liv_Pop_1980_2019_regrid_con.nc
+• countries (--iso)     : $VSC_HOME/GLWD/ne_110m_admin_0_countries/ne_110m_admin_0_countries.shp
 • output directory      : $VSC_SCRATCH/liv_wd_yearly/
+
+Modes
+-----
+default        one ``<animal>_wd`` variable per species → Liv_WD_<year>.nc
+--total-only   only the all-species ``total_wd`` (release product), built
+               from per-cell A + B·clip(T) coefficient maps
+               → …_total/Liv_WD_total_<year>.nc (own directory, so the
+               analysis globs over Liv_WD_*.nc never see it next to the species)
+--precision    float64 (default) | float32 | int16 | int32 – compute dtype
+               and on-disk storage, see withdrawal_io.py for error bounds
+--no-shuffle   drop the HDF5 shuffle filter (on by default, as before)
+--density      step (default: 1-Jan map all year) | linear (blend the
+               1-Jan maps of yr and yr+1 day by day, no density cube)
+--bbox W S E N | --iso ISO3 … [--shapefile] | --mask FILE
+               regional run: only the window of t2m/density is read and
+               written, NaN outside the region → …_<region>/
+--density-source NAME=PATH (repeatable) adds FAO/GLW products next to the
+               Utrecht counts; every variable gets a ``density_source``
+               axis from one read and clip of t2m → …_sources/
+--thi          humidity-aware factors: t2m + d2m → THI-equivalent
+               temperature, streamed STREAM_DAYS (31) days at a time
+               → $VSC_SCRATCH/liv_wd_yearly_regrid_thi/
+--hourly       hourly ERA5-Land t2m: each day is the mean of its 24 hourly
+               factors (not the factor of the daily mean), reduced one
+               day per task → $VSC_SCRATCH/liv_wd_yearly_regrid_hourly/
+--hires        0.1° ERA5-Land grid: density counts split over the land
+               cells of each FAO cell, run tile by tile (--tile, default
+               361 × 720 cells) → …_0p1/Liv_WD_<year>/tile_lat*_lon*.nc
+--chunks T LAT dask chunk of t2m (default 31 days × 90 rows, all longitudes);
+               every mode is a lazy graph computed and written chunk by chunk
+--threads N    dask threads (default $SLURM_CPUS_PER_TASK, else every core);
+               numexpr/numba kernels run single-threaded inside each task
+--mem-budget GB  memory to plan for (default 80 % of $SLURM_MEM_PER_NODE or
+               the cgroup limit): chunks and threads not given explicitly
+               shrink until the predicted peak fits, see withdrawal_memory.py
+--workers N    years in parallel on N local processes (0 = one per CPU)
+               sharing the density maps; threads and memory are split
+               between them, files land in year order (withdrawal_pool.py)
+
+Under ``srun`` with several tasks each task takes every n-th year
+(SLURM_PROCID / SLURM_NTASKS, or mpi4py), or every n-th tile with
+--hires, and splits the node's cores and memory with the other tasks on
+its node; rank 0 waits for all and writes completion_report.json
+(withdrawal_ranks.py). A task that dies stops its heartbeat and is listed
+as missing within minutes instead of being waited for.
+--report-timeout SECONDS  longest rank 0 waits for the other tasks'
+               reports (default: until shortly before the job's time limit)
+
+Every output is written under a hidden .part name, renamed into place
+when complete, and recorded in <out_dir>/manifest.json with its input
+fingerprints, coefficient version, options and checksum. Reruns skip
+exactly the outputs whose record still matches (withdrawal_manifest.py);
+--verify re-hashes them first, --force recomputes everything.
+--checkpoint   commit each month of a year as it is done; a job killed by
+               the wall time resumes from the last committed month, and
+               the year file is identical to a single pass
+               (withdrawal_checkpoint.py)
+
+Usage
+-----
+python water_withdrawal_yearly.py --start 1980 --end 2019 [--total-only] [--model piecewise] [--backend numba]
 """
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from pathlib import Path
+from typing import Optional
+import argparse
 import os
+import time
+import dask
+import numpy as np
 import xarray as xr
-from water_withdrawal import withdrawal_by_gridcell
+from water_withdrawal import (
+    HOURS_PER_DAY,
+    MODELS,
+    withdrawal_by_gridcell,
+    withdrawals_by_gridcell,
+    withdrawals_from_hourly,
+    total_withdrawal_by_gridcell,
+    total_withdrawal_from_hourly,
+    withdrawal_bounds,
+    coefficients_version,
+)
+from withdrawal_density import DENSITY_MODES, daily_density, open_density_source, stack_density_sources
+from withdrawal_io import COMPUTE_DTYPE, PRECISIONS, output_encoding, precision_error_bound
+from withdrawal_kernels import BACKENDS, RH_REF, default_threads, get_backend, set_backend, set_num_threads
+from withdrawal_checkpoint import Checkpoint, discard_blocks, write_in_blocks
+from withdrawal_manifest import RunManifest, part_path
+from withdrawal_memory import BUDGET_FRACTION, memory_limit, peak_rss, plan_chunks, set_hdf5_cache
+from withdrawal_pool import run_years_pool
+from withdrawal_ranks import (collect_reports, local_tasks, my_share, print_report, report_ok,
+                              start_heartbeat, task_rank, write_rank_report)
+from withdrawal_regions import clip_to_region, region_from_bbox, region_from_iso, region_from_mask
+from withdrawal_tiles import TILE, coarse_index, disaggregate, fine_counts, tile_name, tile_slices
 
-SCRATCH = Path(os.environ["VSC_SCRATCH"])
-HOME    = Path(os.environ["VSC_HOME"])
+SCRATCH = Path(os.environ.get("VSC_SCRATCH", "."))
+HOME    = Path(os.environ.get("VSC_HOME", "."))
 
 T2M_FILE  = SCRATCH / "era5land_daily" / "t2m_1980_2019.nc"
-DENS_FILE = HOME    / "GLWD" / "liv_density" / "Liv_Pop_1980_2019_counts_faoGrid.nc"      
+T2M_NATIVE_FILE = SCRATCH / "era5land_daily" / "t2m_1980_2019_0p1.nc"
+D2M_NATIVE_FILE = SCRATCH / "era5land_daily" / "d2m_1980_2019_0p1.nc"
+D2M_FILE  = SCRATCH / "era5land_daily" / "d2m_1980_2019.nc"
+HOURLY_DIR = SCRATCH / "era5land_hourly"
+DENS_FILE = HOME    / "GLWD" / "liv_density" / "Liv_Pop_1980_2019_counts_faoGrid.nc"
+COUNTRY_SHP = HOME  / "GLWD" / "ne_110m_admin_0_countries" / "ne_110m_admin_0_countries.shp"
 OUT_DIR   = SCRATCH / "liv_wd_yearly_regrid"
-OUT_DIR.mkdir(exist_ok=True)
-
-# ── open temperature once (Kelvin→°C, rename dim) ───────────────────────────
-t2m_all = xr.open_dataset(T2M_FILE, decode_times=True)
-t2m_all = t2m_all.rename({"valid_time": "time"})
-t2m_all = t2m_all["t2m"] #= t2m_all.t2m - 273.15   # °C
-
-# ── open density file (annual steps) ────────────────────────────────────────
-dens_ds = xr.open_dataset(DENS_FILE)
-dens_ds = dens_ds.rename({"time": "year"})
-dens_ds["year"] = dens_ds.year.astype("datetime64[ns]")
 
 NAME_MAP = {                       # density var  →  animal keyword
     "CowPop":     "cattle",
@@ -43,60 +130,164 @@ NAME_MAP = {                       # density var  →  animal keyword
 
 compression = dict(zlib=True, complevel=4)
 
-for yr in range(2019, 2020):
-    print(f"🔹 Year {yr}",flush=True)
-    outfile = OUT_DIR/ f"Liv2_WD_{yr}.nc"
-    if outfile.exists():
-        print(f"Year {yr} - output already exists, skipping.", flush=True)
-        continue
-    #t2m = t2m_all.t2m.sel(time=str(yr))
-
-    t2m = t2m_all.sel(time=slice(f"{yr}-01-01", f"{yr}-12-31"))
-
-    data_vars = []
-    for var, animal in NAME_MAP.items():
-        if var not in dens_ds:
-            print(f"   ⚠️  {var} missing – skipped"); continue
-
-        # 2) grab the 1-Jan map for this year and squeeze away the time dim
-        dens_1jan = (dens_ds[var]
-                     .sel(year=str(yr))               # picks that one time
-                     .squeeze("year", drop=True))        # now dims=(lat,lon)
-
-        # 3) broadcast to every day of the year
-        dens_daily = dens_1jan.expand_dims(time=t2m.time)
-
-        # 4) compute litres·cell⁻¹·day⁻¹ → convert to m³
-        lpd = withdrawal_by_gridcell(animal, t2m, dens_daily)
-        m3  = (lpd / 1000.0).rename(f"{animal.lower()}_wd")
-        m3.attrs.update(
-            units="m3 cell-1 day-1",
-            long_name=f"{animal} drinking-water withdrawal",
-        )
-
-        """        
-        dens_yearly = dens_ds[var].sel(year=slice("1980","2019"))
-
-        # convert 'year' (1-Jan each year) → a *real* daily time axis
-        dens_days = dens_yearly.interp(
-            year=("time", t2m.time.dt.year)   # match each day’s calendar year
-        ).drop_vars("year")                   # remove the leftover coordinate
-        dens_days = dens_days.chunk({"time": 365, "lat": 180})
-
-        m3 = (withdrawal_by_gridcell(animal, t2m, dens_daily) / 1000.0
-            ).rename(f"{animal.lower()}_wd")
-        m3.attrs.update(units="m3 cell-1 day-1",
-                        long_name=f"{animal} drinking-water withdrawal")
-        """
-        
-        data_vars.append(m3)
-
-    ds_year = xr.merge(data_vars)
-    out_file = OUT_DIR / f"Liv_WD_{yr}.nc"
+STREAM_DAYS = 31        # days per write block in the streamed (--thi/--hourly/--hires) modes
+STREAM_TILE = {"time": STREAM_DAYS, "lat": 90, "lon": 180,   # on-disk chunks, aligned
+               "density_source": 1}
+CHUNKS = {"time": STREAM_DAYS, "lat": STREAM_TILE["lat"]}  # dask blocks of t2m/d2m, all longitudes
 
-    enc = {v: {"zlib": True, "complevel": 4} for v in ds_year.data_vars}
+
+def configure_threads(n: Optional[int] = None) -> int:
+    """Run dask graphs on *n* threads (default: $SLURM_CPUS_PER_TASK, else every core).
+
+    Each worker pins the compiled kernels to one thread, so dask's
+    parallelism is not multiplied by numexpr's or numba's.
+    """
+    n = n or default_threads()
+    dask.config.set(scheduler="threads",
+                    pool=ThreadPoolExecutor(n, initializer=set_num_threads, initargs=(1,)))
+    return n
+
+
+# ── inputs ─────────────────────────────────────────────────────────────────
+
+def open_temperature(path: Path = T2M_FILE) -> xr.DataArray:
+    """Open temperature once (rename dim; conversion to °C left disabled)."""
+    t2m_all = xr.open_dataset(path, decode_times=True)
+    t2m_all = t2m_all.rename({"valid_time": "time"})
+    return t2m_all["t2m"] #= t2m_all.t2m - 273.15   # °C
+
+
+def open_dewpoint(path: Path = D2M_FILE) -> xr.DataArray:
+    """Open 2 m dewpoint once, same conventions (and units) as t2m."""
+    d2m_all = xr.open_dataset(path, decode_times=True)
+    d2m_all = d2m_all.rename({"valid_time": "time"})
+    return d2m_all["d2m"]
+
+
+def open_hourly_temperature(yr: int, hourly_dir: Path = HOURLY_DIR,
+                            rows: Optional[int] = None) -> xr.DataArray:
+    """Hourly t2m of *yr* (°C), lazily chunked one day (24 slices) – and
+    *rows* latitudes, default all – per task.
+
+    Raw ERA5-Land hourly files are in kelvin and are converted here.
+    """
+    files = sorted(hourly_dir.glob(f"t2m_{yr}*.nc"))
+    if not files:
+        raise FileNotFoundError(f"no hourly t2m files for {yr} in {hourly_dir}")
+    # chunk at open: a whole-file chunk would be read in full for every day
+    day = {"valid_time": HOURS_PER_DAY, "time": HOURS_PER_DAY, **({"lat": rows} if rows else {})}
+    t2m = xr.open_mfdataset(files, combine="by_coords", chunks=day)
+    if "valid_time" in t2m.dims:
+        t2m = t2m.rename({"valid_time": "time"})
+    t2m = t2m["t2m"].sel(time=slice(f"{yr}-01-01", f"{yr}-12-31"))
+    if t2m.attrs.get("units") == "K":
+        t2m = (t2m - 273.15).assign_attrs(units="degC")
+    return t2m
+
+
+def pair_by_time(t2m: xr.DataArray, d2m: xr.DataArray, yr: int,
+                 chunk: int = STREAM_DAYS) -> tuple:
+    """Days of *yr* present in both inputs, chunked *chunk* days at a time.
+
+    Both stay lazy, so writing the year streams one chunk of each through
+    the THI conversion instead of loading two full-year cubes. Inputs that
+    are already chunked (``--chunks``) keep their blocks.
+    """
+    n_t2m = t2m.sizes["time"]
+    t2m, d2m = xr.align(t2m, d2m.sel(time=slice(f"{yr}-01-01", f"{yr}-12-31")),
+                        join="inner", exclude=[d for d in t2m.dims if d != "time"])
+    d2m = d2m.assign_coords({d: t2m[d] for d in t2m.dims if d != "time"})
+    if t2m.sizes["time"] < n_t2m:
+        print(f"   ⚠️  {n_t2m - t2m.sizes['time']} day(s) without d2m – skipped", flush=True)
+    if t2m.chunks is None:
+        t2m, d2m = t2m.chunk(time=chunk), d2m.chunk(time=chunk)
+    return t2m, d2m
+
+
+def open_density(path: Path = DENS_FILE) -> xr.Dataset:
+    """Open density file (annual steps on a ``year`` axis)."""
+    dens_ds = xr.open_dataset(path)
+    dens_ds = dens_ds.rename({"time": "year"})
+    dens_ds["year"] = dens_ds.year.astype("datetime64[ns]")
+    return dens_ds
+
+
+def density_for_year(dens_ds: xr.Dataset, yr: int) -> xr.Dataset:
+    """1-Jan density maps for *yr*, dims=(lat,lon) – broadcast over days."""
+    return (dens_ds
+            .sel(year=str(yr))
+            .squeeze("year", drop=True))
+
+
+# ── one year ───────────────────────────────────────────────────────────────
+
+def output_name(yr: int, total_only: bool = False) -> str:
+    """File name of one year: ``Liv_WD_<year>.nc`` or ``Liv_WD_total_<year>.nc``."""
+    return f"Liv_WD_total_{yr}.nc" if total_only else f"Liv_WD_{yr}.nc"
+
+
+def year_dataset(yr: int, t2m_all: xr.DataArray, dens_ds: xr.Dataset,
+                 total_only: bool = False, model: str = "linear",
+                 precision: str = "float64", d2m_all: Optional[xr.DataArray] = None,
+                 rh_ref: float = RH_REF, density: str = "step",
+                 hourly: bool = False, chunks: Optional[dict] = None) -> tuple:
+    """The lazy year :pyfunc:`run_year` writes, and how to store it.
+
+    Returns ``(ds_year, bounds, disk)``: the dataset, the value range of
+    every variable for the packed precisions (else None) and the HDF5
+    chunking for ``output_encoding`` (dim → length, or None). Dims of
+    *t2m_all* after ``time`` other than lat/lon (the ``scenario`` axis of
+    withdrawal_scenarios.py) are carried through to every variable.
+    """
+    d2m       = None
+    if hourly:
+        chunks = chunks or {"time": STREAM_DAYS, "lat": dens_ds.sizes["lat"]}
+        t2m  = open_hourly_temperature(yr, rows=chunks["lat"])
+        days = np.unique(t2m.time.dt.floor("D").values)
+        days = xr.DataArray(days, dims="time", coords={"time": days})
+    else:
+        t2m  = t2m_all.sel(time=slice(f"{yr}-01-01", f"{yr}-12-31"))
+        if d2m_all is not None:
+            t2m, d2m = pair_by_time(t2m, d2m_all, yr)
+        days = t2m.time
+    dens_year = density_for_year(dens_ds, yr)
+    dtype     = "float32" if COMPUTE_DTYPE[precision] == "float32" else None
+    interp    = {}
+    if density == "linear":
+        daily     = daily_density(dens_ds, days, yr)
+        dens_year = daily.base
+        interp    = dict(density_delta=daily.delta, density_weight=daily.weight)
+
+    if hourly:
+        # per-day means of the clipped hourly segments → daily maps, written
+        # chunks["time"] days at a time
+        fn       = total_withdrawal_from_hourly if total_only else withdrawals_from_hourly
+        ds_year  = fn(t2m, dens_year, NAME_MAP, units="m3", model=model, dtype=dtype,
+                      time_chunk=chunks["time"], **interp)
+        ds_year  = ds_year.to_dataset() if total_only else ds_year
+    elif total_only:
+        # one fused multiply-add per cell-day → m³ cell⁻¹ day⁻¹
+        ds_year  = total_withdrawal_by_gridcell(t2m, dens_year, NAME_MAP, units="m3",
+                                                model=model, dtype=dtype,
+                                                dewpoint=d2m, rh_ref=rh_ref, **interp).to_dataset()
+    else:
+        # all species from one read + clip of t2m → m³ cell⁻¹ day⁻¹
+        ds_year  = withdrawals_by_gridcell(t2m, dens_year, NAME_MAP, units="m3",
+                                           model=model, dtype=dtype,
+                                           dewpoint=d2m, rh_ref=rh_ref, **interp)
 
     """
+    dens_yearly = dens_ds[var].sel(year=slice("1980","2019"))
+
+    # convert 'year' (1-Jan each year) → a *real* daily time axis
+    dens_days = dens_yearly.interp(
+        year=("time", t2m.time.dt.year)   # match each day’s calendar year
+    ).drop_vars("year")                   # remove the leftover coordinate
+    dens_days = dens_days.chunk({"time": 365, "lat": 180})
+    """
+
+    """
+    enc = {v: {"zlib": True, "complevel": 4} for v in ds_year.data_vars}
     ds_year.to_netcdf(
         out_file,
         engine="netcdf4",          # or engine="h5netcdf"
@@ -105,31 +296,398 @@ for yr in range(2019, 2020):
     )
 
     """
-    ds_year.to_netcdf(out_file,
-                      encoding={v: compression for v in ds_year.data_vars})
+    if interp:
+        ds_year.attrs["density"] = "linear between 1-Jan maps of consecutive years"
+    if "density_source" in ds_year.dims:
+        # one source per HDF5 chunk; interleaved sources compress and read badly
+        ds_year = ds_year.transpose("density_source", "time", ...)
+        ds_year.attrs.update({k: v for k, v in dens_ds.attrs.items() if k == "missing_species"})
+
+    bounds = None
+    if precision != "float64":
+        # every day's density lies between the two snapshots, and so do the bounds
+        snaps  = daily.bounds_pair() if interp else (dens_year,)
+        each   = [withdrawal_bounds(d, NAME_MAP, units="m3", model=model) for d in snaps]
+        bounds = {v: (min(b[v][0] for b in each), max(b[v][1] for b in each)) for v in each[0]}
+        for v in ds_year.data_vars:
+            ds_year[v].attrs["precision_error_bound"] = precision_error_bound(*bounds[v], precision)
+        print(f"   ℹ️  {precision}: max abs error ≤ "
+              f"{max(ds_year[v].attrs['precision_error_bound'] for v in ds_year.data_vars):.3g} m3",
+              flush=True)
+
+    disk = None
+    if hourly:
+        # whole dask blocks per HDF5 chunk, as below
+        rows = STREAM_TILE["lat"] if chunks["lat"] % STREAM_TILE["lat"] == 0 else chunks["lat"]
+        disk = {**STREAM_TILE, "time": chunks["time"], "lat": rows}
+    elif t2m.chunks:
+        # one HDF5 chunk per dask block, also when the memory plan shrank them:
+        # a block that splits a compressed chunk makes HDF5 rewrite it
+        disk = {**STREAM_TILE, "time": t2m.chunks[0][0], "lat": t2m.chunks[t2m.get_axis_num("lat")][0]}
+    return ds_year, bounds, disk
+
+
+def run_year(yr: int, t2m_all: xr.DataArray, dens_ds: xr.Dataset,
+             out_dir: Path = OUT_DIR, total_only: bool = False,
+             model: str = "linear", precision: str = "float64",
+             shuffle: bool = True, d2m_all: Optional[xr.DataArray] = None,
+             rh_ref: float = RH_REF, density: str = "step",
+             hourly: bool = False, out_file: Optional[Path] = None,
+             atomic: bool = True, checkpoint: Optional[Checkpoint] = None,
+             chunks: Optional[dict] = None) -> Path:
+    """Compute and write one year; return the output path.
+
+    With *d2m_all* the factors use the THI-equivalent temperature;
+    ``density="linear"`` interpolates density between 1-Jan maps;
+    *hourly* reads hourly t2m instead of *t2m_all* and writes it in the
+    *chunks* of the memory plan (default STREAM_DAYS days × all rows; the
+    daily inputs come chunked already). *out_file* overrides
+    the default ``Liv_WD[_total]_<year>.nc`` in *out_dir*; it is written
+    under a ``.part`` name and renamed when complete unless *atomic* is
+    False. With a *checkpoint* the year is committed month by month
+    (see withdrawal_checkpoint.py).
+    """
+    ds_year, bounds, disk = year_dataset(yr, t2m_all, dens_ds, total_only, model, precision,
+                                         d2m_all, rh_ref, density, hourly, chunks)
+    out_file = out_file or out_dir / output_name(yr, total_only)
+    # a killed job leaves a .part file behind, never a truncated out_file
+    target   = part_path(out_file) if atomic else out_file
+    encoding = output_encoding(ds_year, precision, bounds, complevel=compression["complevel"],
+                               shuffle=shuffle, chunksizes=disk)
+    try:
+        if checkpoint is None:
+            ds_year.to_netcdf(target, encoding=encoding)
+        else:
+            write_in_blocks(ds_year, target, encoding, checkpoint)
+    except BaseException:
+        Path(target).unlink(missing_ok=True)
+        raise
+    if atomic:
+        os.replace(target, out_file)
+        if checkpoint is not None:
+            discard_blocks(checkpoint.output)
     print(f"   ✔  written → {out_file}", flush=True)
+    return out_file
+
+
+def run_year_tiled(yr: int, t2m_all: xr.DataArray, dens_ds: xr.Dataset,
+                   out_dir: Path = OUT_DIR, tile: dict = TILE,
+                   d2m_all: Optional[xr.DataArray] = None,
+                   chunks: Optional[dict] = None, share: tuple = (0, 1),
+                   manifest: Optional[RunManifest] = None, inputs: tuple = (),
+                   checkpoint: bool = False, **kwargs) -> Path:
+    """:pyfunc:`run_year` on the native grid of *t2m_all*, one tile at a time.
+
+    Density counts are split over the land cells (valid t2m on the first
+    day) of each density cell; only one tile's density, t2m and output
+    are ever in memory, streamed in dask *chunks* (default STREAM_DAYS
+    days) counted from the tile's corner. With *share* ``(rank, size)``
+    only every size-th tile is written. Each tile is an entry of
+    *manifest* (input files *inputs*); tiles it still holds are skipped,
+    and with *checkpoint* each tile is committed month by month.
+    Returns the directory of tile files.
+    """
+    t2m_yr = t2m_all.sel(time=slice(f"{yr}-01-01", f"{yr}-12-31"))
+    # yr (+ yr+1 for --density linear), held in memory: indexing the file
+    # lazily with the repeated fine → coarse indices is a read per cell
+    dens   = dens_ds.sel(year=slice(str(yr), str(yr + 1))).load()
+    ilat   = coarse_index(t2m_yr.lat.values, dens.lat.values)
+    ilon   = coarse_index(t2m_yr.lon.values, dens.lon.values, period=360)
+    land   = t2m_yr.isel(time=0).notnull().values
+    counts = fine_counts(ilat, ilon, (dens.sizes["lat"], dens.sizes["lon"]), mask=land)
+
+    tile_dir = out_dir / f"Liv_WD_{yr}"
+    tile_dir.mkdir(exist_ok=True)
+    for i, (la, lo) in enumerate(tile_slices(t2m_yr.sizes, tile)):
+        out = tile_dir / tile_name(la, lo)
+        if i % share[1] != share[0] or (manifest and manifest.is_valid(out, inputs)):
+            continue
+        t2m = t2m_yr.isel(lat=la, lon=lo).chunk(chunks or {"time": STREAM_DAYS})
+        d2m = None if d2m_all is None else d2m_all.isel(lat=la, lon=lo)
+        fine = disaggregate(dens, t2m.lat, t2m.lon, ilat[la], ilon[lo], counts)
+        with manifest.recording(out, inputs) if manifest else nullcontext():
+            run_year(yr, t2m, fine, tile_dir, d2m_all=d2m, out_file=out,
+                     checkpoint=Checkpoint(manifest, out) if manifest and checkpoint else None,
+                     **kwargs)
+    return tile_dir
+
+
+# ── quick sanity prints ────────────────────────────────────────────────────
+
+def diagnostics(yr: int, out_file: Path, t2m_all: xr.DataArray, dens_ds: xr.Dataset) -> None:
+    """Spot checks on inputs and the last written year."""
+    t2m       = t2m_all.sel(time=slice(f"{yr}-01-01", f"{yr}-12-31"))
+    dens_year = density_for_year(dens_ds, yr)
+    ds_year   = xr.open_dataset(out_file)
+
+    # 1. Are we skipping species?
+    for k in NAME_MAP:
+        print(k, k in dens_ds)
+
+    # 2. Units & magnitudes
+    print(dens_ds["CowPop"].attrs)          # look for 'units'
+    print(float(dens_ds["CowPop"].mean()))  # typical heads/km² ?
+    print(dens_ds["CowPop"].isel(lat=dens_ds.sizes["lat"] // 2,
+                                 lon=dens_ds.sizes["lon"] // 2))  # spot check
+
+    # 3. Temperature stats
+    print(float(t2m.mean()), float(t2m.min()), float(t2m.max()))
+
+    # 4. Final values range
+    print(ds_year.to_array().max().item(), ds_year.to_array().mean().item())
+
+    # 5. Compare LHS and RHS
+    test = withdrawal_by_gridcell("cattle", t2m.isel(time=0), dens_year["CowPop"])
+    print(test.sum().item())
+
+
+# ── driver ─────────────────────────────────────────────────────────────────
+
+def parse_args() -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="Yearly livestock water-withdrawal generator")
+    p.add_argument("--start", type=int, default=2019, help="first year (inclusive)")
+    p.add_argument("--end",   type=int, default=2019, help="last year (inclusive)")
+    p.add_argument("--out-dir", type=Path, default=None,
+                   help=f"output directory (default {OUT_DIR}, …_thi / …_hourly / …_total)")
+    p.add_argument("--total-only", action="store_true",
+                   help="write only total_wd (A + B·clip(T) fast path)")
+    p.add_argument("--model", choices=MODELS, default="linear",
+                   help="factor curve: 15/35 °C line or piecewise through 15/25/35 °C")
+    p.add_argument("--density", choices=DENSITY_MODES, default="step",
+                   help="hold the 1-Jan density map, or interpolate linearly to the next year's")
+    p.add_argument("--density-source", action="append", default=[], metavar="NAME=PATH",
+                   help="extra density product (file, or dir of fao_<animal>_<year>.nc); repeatable")
+    region = p.add_mutually_exclusive_group()
+    region.add_argument("--bbox", type=float, nargs=4, metavar=("W", "S", "E", "N"),
+                        help="regional run: box in degrees (W > E crosses the date line)")
+    region.add_argument("--iso", nargs="+", metavar="ISO3",
+                        help="regional run: ISO-3 country codes (needs geopandas + regionmask)")
+    region.add_argument("--mask", type=Path, metavar="FILE",
+                        help="regional run: NetCDF mask on the density grid, non-zero inside")
+    p.add_argument("--shapefile", type=Path, default=COUNTRY_SHP,
+                   help="country polygons with an ISO-3 column for --iso")
+    p.add_argument("--hourly", action="store_true",
+                   help="read hourly t2m and average the hourly factors per day")
+    p.add_argument("--hires", action="store_true",
+                   help="0.1° native ERA5-Land grid, written as tiles")
+    p.add_argument("--tile", type=int, nargs=2, metavar=("LAT", "LON"),
+                   default=(TILE["lat"], TILE["lon"]), help="cells per tile in --hires mode")
+    p.add_argument("--thi", action="store_true",
+                   help="temperature-humidity index mode (reads d2m as well)")
+    p.add_argument("--rh-ref", type=float, default=RH_REF,
+                   help="relative humidity (%%) at which THI mode equals plain t2m")
+    p.add_argument("--precision", choices=PRECISIONS, default="float64",
+                   help="compute/storage precision (int16/int32 = CF-packed)")
+    p.add_argument("--no-shuffle", dest="shuffle", action="store_false",
+                   help="disable the HDF5 shuffle filter")
+    p.add_argument("--chunks", type=int, nargs=2, metavar=("TIME", "LAT"), default=None,
+                   help="dask chunk of t2m/d2m: days × latitude rows, all longitudes "
+                        f"(default: {CHUNKS['time']} × {CHUNKS['lat']}, smaller if memory is short)")
+    p.add_argument("--threads", type=int, default=None,
+                   help="dask threads (default: $SLURM_CPUS_PER_TASK, else every core, "
+                        "fewer if memory is short)")
+    p.add_argument("--mem-budget", type=float, default=None, metavar="GB",
+                   help="memory to plan for (default: 80%% of the SLURM/cgroup limit)")
+    p.add_argument("--workers", type=int, default=1,
+                   help="run years in parallel on this many processes (0: one per CPU)")
+    p.add_argument("--backend", choices=BACKENDS, default=None,
+                   help="block kernel (default: $LIVWD_KERNEL or numpy; "
+                        "falls back to numpy if not installed)")
+    p.add_argument("--verify", action="store_true",
+                   help="re-hash finished outputs against the manifest before skipping them")
+    p.add_argument("--force", action="store_true",
+                   help="recompute every output, whatever the manifest says")
+    p.add_argument("--checkpoint", action="store_true",
+                   help="commit each month as it is done; a restarted job resumes mid-year")
+    p.add_argument("--report-timeout", type=float, default=None, metavar="SECONDS",
+                   help="under srun: longest rank 0 waits for the other tasks' reports "
+                        "(default: until shortly before the job's time limit)")
+    p.add_argument("--diagnostics", action="store_true",
+                   help="print spot checks for the last year written")
+    args = p.parse_args()
+    if args.hourly and args.thi:
+        p.error("--hourly and --thi cannot be combined (no hourly d2m path)")
+    if args.hires and args.hourly:
+        p.error("--hires and --hourly cannot be combined")
+    if (args.bbox or args.iso or args.mask) and (args.hires or args.hourly):
+        p.error("regional runs work on the daily density grid (not with --hires/--hourly)")
+    if args.workers != 1 and args.hires:
+        p.error("--workers runs whole years; --hires writes tile directories")
+    return args
+
+
+def run_options(args: argparse.Namespace) -> dict:
+    """The options recorded with (and compared against) every output in the manifest.
+
+    Threads, chunks, workers and the kernel backend change how a year is
+    computed, not what is written, and are left out.
+    """
+    return dict(total_only=args.total_only, model=args.model, density=args.density,
+                precision=args.precision, shuffle=args.shuffle, thi=args.thi,
+                rh_ref=args.rh_ref if args.thi else None, hourly=args.hourly,
+                hires=args.hires, tile=list(args.tile) if args.hires else None,
+                bbox=args.bbox, iso=args.iso, mask=args.mask,
+                density_source=args.density_source)
+
+
+def year_inputs(args: argparse.Namespace, yr: int) -> list:
+    """Input files behind the outputs of *yr*."""
+    files = (sorted(HOURLY_DIR.glob(f"t2m_{yr}*.nc")) if args.hourly else
+             [T2M_NATIVE_FILE if args.hires else T2M_FILE])
+    if args.thi:
+        files.append(D2M_NATIVE_FILE if args.hires else D2M_FILE)
+    files.append(DENS_FILE)
+    files += [Path(spec.rpartition("=")[2]) for spec in args.density_source]
+    files += [args.mask] if args.mask else [args.shapefile] if args.iso else []
+    return files
+
+
+def main() -> None:
+    args = parse_args()
+    if args.out_dir is None:
+        suffix = ("_0p1" if args.hires else "") + ("_thi" if args.thi else "_hourly" if args.hourly else "")
+        suffix += "_sources" if args.density_source else ""
+        suffix += "_total" if args.total_only else ""
+        suffix += "_" + "_".join(args.iso) if args.iso else "_bbox" if args.bbox else \
+                  f"_{args.mask.stem}" if args.mask else ""
+        args.out_dir = OUT_DIR.with_name(OUT_DIR.name + suffix)
+    args.out_dir.mkdir(exist_ok=True)
+    # --backend, else $LIVWD_KERNEL – chosen here, so the fallback warning
+    # comes once, before any work, and not from a dask thread
+    backend = set_backend(args.backend) if args.backend else get_backend()
+    if args.backend or "LIVWD_KERNEL" in os.environ:
+        print(f"⚙️  kernel backend: {backend}", flush=True)
+    rank, size = task_rank()
+    local      = local_tasks() if size > 1 else 1
+    if size > 1:
+        print(f"🧩 task {rank} of {size} ({local} on this node)", flush=True)
+        start_heartbeat(args.out_dir, rank)    # stops with the process: rank 0 sees a dead task
 
-print("🎉  All 40 files done:", OUT_DIR)
+    t2m_all = None if args.hourly else open_temperature(T2M_NATIVE_FILE if args.hires else T2M_FILE)
+    dens_ds = open_density()
+    d2m_all = open_dewpoint(D2M_NATIVE_FILE if args.hires else D2M_FILE) if args.thi else None
+    sources = {"utrecht": dens_ds}
+    for spec in args.density_source:
+        name, _, path = spec.rpartition("=")
+        sources[name or Path(path).stem] = open_density_source(Path(path))
+    if args.bbox or args.iso or args.mask:
+        region = (region_from_bbox(dens_ds, args.bbox) if args.bbox else
+                  region_from_iso(dens_ds, args.iso, args.shapefile) if args.iso else
+                  region_from_mask(dens_ds, args.mask))
+        print(f"🗺️  region {region.name}: {region.ncells} cells in a "
+              f"{region.mask.sizes['lat']} × {region.mask.sizes['lon']} window", flush=True)
+        t2m_all = clip_to_region(t2m_all, region)
+        d2m_all = None if d2m_all is None else clip_to_region(d2m_all, region)
+        sources = {name: clip_to_region(ds, region, mask=True) for name, ds in sources.items()}
+        dens_ds = sources["utrecht"]
+    # this task's years (all of them with --hires, which shares tiles instead),
+    # less those whose output is still valid (--hires checks tile by tile)
+    manifest = RunManifest(args.out_dir, run_options(args), coefficients_version(),
+                           verify=args.verify, force=args.force)
 
+    def outfile(yr: int) -> Path:
+        return args.out_dir / output_name(yr, args.total_only)
 
+    mine    = list(range(args.start, args.end + 1))
+    mine    = mine if args.hires else my_share(mine, rank, size)
+    years   = [yr for yr in mine
+               if args.hires or not manifest.is_valid(outfile(yr), year_inputs(args, yr))]
 
+    # chunks, threads and HDF5 caches whose predicted peak fits the allocation
+    # (per task on the node, then per worker: both split cores and budget)
+    cores   = args.threads or (default_threads() if "SLURM_CPUS_PER_TASK" in os.environ
+                               else max((os.cpu_count() or 1) // local, 1))
+    workers = min(args.workers or cores, max(len(years), 1))
+    budget  = (args.mem_budget * 2**30 if args.mem_budget else
+               memory_limit() * BUDGET_FRACTION / local)
+    grid    = (dens_ds if args.hourly else t2m_all).sizes
+    sizes   = {d: min(grid[d], n) if args.hires else grid[d] for d, n in zip(("lat", "lon"), args.tile)}
+    present = sum(v in dens_ds for v in NAME_MAP)
+    plan    = plan_chunks(
+        sizes, 1 if args.total_only else present, max(cores // workers, 1),
+        # --hourly: the block run_year writes, all rows (split rows made it hold the year)
+        dict(time=args.chunks[0], lat=args.chunks[1]) if args.chunks else
+        {**CHUNKS, "lat": sizes["lat"]} if args.hourly else CHUNKS,
+        budget=budget / workers,
+        fixed_threads=args.threads is not None, fixed_chunks=bool(args.chunks),
+        fixed_rows=args.hourly,
+        nspecies=present, nsources=len(sources), n_inputs=2 if args.thi else 1,
+        hours=HOURS_PER_DAY if args.hourly else 1,
+        in_itemsize=4 if t2m_all is None else t2m_all.dtype.itemsize,
+        out_itemsize=np.dtype(COMPUTE_DTYPE[args.precision]).itemsize,
+        density_maps=2 if args.density == "linear" else 1)
+    print(f"⚙️  {plan.describe()}", flush=True)
+    if plan.predicted > plan.budget:
+        print("   ⚠️  predicted peak exceeds the budget even at the smallest chunks", flush=True)
+    configure_threads(plan.threads)
+    set_hdf5_cache(plan.cache)
 
-# 1. Are we skipping species?
-for k in NAME_MAP:
-    print(k, k in dens_ds)
+    # lazy from here on: each task reads one block of t2m (and d2m), and
+    # to_netcdf computes and writes the year chunk by chunk
+    # (--hires chunks each tile from its own corner, see run_year_tiled)
+    chunks  = plan.chunks
+    if not args.hires:
+        t2m_all = None if t2m_all is None else t2m_all.chunk(chunks)
+        d2m_all = None if d2m_all is None else d2m_all.chunk(chunks)
 
-# 2. Units & magnitudes
-print(dens_ds["CowPop"].attrs)          # look for 'units'
-print(float(dens_ds["CowPop"].mean()))  # typical heads/km² ?
-print(dens_ds["CowPop"].isel(lat=..., lon=...))  # spot check
+    options = dict(total_only=args.total_only, model=args.model,
+                   precision=args.precision, shuffle=args.shuffle,
+                   d2m_all=d2m_all, rh_ref=args.rh_ref, density=args.density)
+    tile    = dict(lat=args.tile[0], lon=args.tile[1])
+    t0      = time.perf_counter()
+    last    = report = None
+    try:
+        if workers > 1:
+            # the maps of every year of the run (+ the next for --density linear), read once
+            span = [*years, years[-1] + 1]
+            dens = (stack_density_sources(sources, span) if len(sources) > 1 else
+                    dens_ds.sel(year=slice(str(span[0]), str(span[-1]))))
+            run_years_pool(years, t2m_all, dens, args.out_dir, workers, threads=plan.threads,
+                           cache=plan.cache, backend=args.backend, manifest=manifest,
+                           inputs=lambda yr: year_inputs(args, yr), checkpoint=args.checkpoint,
+                           hourly=args.hourly, chunks=chunks, **options)
+        else:
+            for yr in mine:
+                print(f"🔹 Year {yr}",flush=True)
+                if yr not in years:
+                    print(f"Year {yr} - output still valid, skipping.", flush=True)
+                    continue
 
-# 3. Temperature stats
-print(float(t2m.mean()), float(t2m.min()), float(t2m.max()))
+                # all products on a density_source axis: yr (+ yr+1 for --density linear)
+                dens = stack_density_sources(sources, [yr, yr + 1]) if len(sources) > 1 else dens_ds
+                if args.hires:
+                    run_year_tiled(yr, t2m_all, dens, args.out_dir, tile=tile, chunks=chunks,
+                                   share=(rank, size), manifest=manifest,
+                                   inputs=year_inputs(args, yr), checkpoint=args.checkpoint, **options)
+                else:
+                    checkpoint = Checkpoint(manifest, outfile(yr)) if args.checkpoint else None
+                    with manifest.recording(outfile(yr), year_inputs(args, yr)):
+                        last = (yr, run_year(yr, t2m_all, dens, args.out_dir, hourly=args.hourly,
+                                             chunks=chunks, checkpoint=checkpoint, **options))
+                print(f"   📊 peak RSS {peak_rss() / 2**30:.2f} GB "
+                      f"(predicted {plan.predicted / 2**30:.2f} GB)", flush=True)
+        print("🎉  All files done:", args.out_dir)
+    finally:
+        if size > 1:
+            # done = this task's file, or all of its tiles, is recorded done
+            def done(yr: int) -> bool:
+                if not args.hires:
+                    return manifest.status(outfile(yr)) == "done"
+                names = [tile_name(la, lo) for i, (la, lo) in enumerate(tile_slices(grid, tile))
+                         if i % size == rank]
+                return all(manifest.status(args.out_dir / f"Liv_WD_{yr}" / n) == "done" for n in names)
+            write_rank_report(args.out_dir, rank, size,
+                              [dict(year=yr, status="done" if done(yr) else "failed") for yr in mine],
+                              time.perf_counter() - t0, peak_rss())
+            if rank == 0:                 # also when its own years failed
+                report = collect_reports(args.out_dir, size, timeout=args.report_timeout)
+                print_report(report)
+    if report is not None and not report_ok(report):
+        raise SystemExit(1)
 
-# 4. Final values range
-print(ds_year.to_array().max().item(), ds_year.to_array().mean().item())
+    if args.diagnostics and last is not None and t2m_all is not None:
+        diagnostics(*last, t2m_all, dens_ds)
 
-# 5. Compare LHS and RHS
-test = withdrawal_by_gridcell("cattle", t2m.isel(time=0), dens_daily.isel(time=0))
-print(test.sum().item())
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""A year written month by month, so a killed job restarts mid‑year.
+
+A 0.1° year (or an ensemble of them) can outlast the 24 h wall time of
+``run_wd_yearly.sh``, and a restarted job used to begin again at 1 January.
+With ``--checkpoint`` the driver writes the year's lazy dataset one
+calendar month at a time into ``.<name>.blocks/<YYYY-MM>.nc`` next to the
+output (:pyfunc:`write_in_blocks`). Each block is renamed into place when
+complete and recorded in the run manifest (``blocks`` of the output's
+entry), so a restarted job skips the committed months and computes only
+the rest.
+
+When all months are in, they are read back and written as the year file
+with the encoding, chunking and attributes an uninterrupted run uses.
+Blocks hold the compute dtype losslessly (light zlib, no packing), so the
+final file is identical to one written in a single pass. The block
+directory is removed once the year file is in place.
+"""
+
+import os
+import shutil
+from pathlib import Path
+from typing import Mapping, NamedTuple
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from withdrawal_manifest import RunManifest, part_path
+
+BLOCK_COMPLEVEL = 1                # blocks are temporary: cheap compression
+
+
+class Checkpoint(NamedTuple):
+    """Where progress of one output is recorded: *manifest* and its entry *output*."""
+
+    manifest: RunManifest
+    output: Path
+
+
+def block_dir(output: Path) -> Path:
+    """Hidden directory holding the committed months of *output*."""
+    output = Path(output)
+    return output.with_name(f".{output.name}.blocks")
+
+
+def month_blocks(times) -> list:
+    """``[(label, slice)]`` of consecutive time steps per calendar month."""
+    months = pd.DatetimeIndex(np.asarray(times)).strftime("%Y-%m")
+    starts = [0] + [i for i in range(1, len(months)) if months[i] != months[i - 1]]
+    return [(months[a], slice(a, b)) for a, b in zip(starts, starts[1:] + [len(months)])]
+
+
+def _write_block(block: xr.Dataset, path: Path) -> None:
+    block = block.copy()
+    for var in block.variables.values():
+        var.encoding = {}                  # source chunking may not fit a month
+    tmp = part_path(path)
+    block.to_netcdf(tmp, encoding={v: dict(zlib=True, complevel=BLOCK_COMPLEVEL)
+                                   for v in block.data_vars})
+    os.replace(tmp, path)
+
+
+def write_in_blocks(ds_year: xr.Dataset, out_file: Path, encoding: Mapping[str, dict],
+                    checkpoint: Checkpoint) -> Path:
+    """Compute *ds_year* month by month, then write it to *out_file* with *encoding*.
+
+    Months already committed for ``checkpoint.output`` are not computed
+    again. The blocks stay on disk until :pyfunc:`discard_blocks` – the
+    caller's job once *out_file* is in place.
+    """
+    folder = block_dir(checkpoint.output)
+    folder.mkdir(exist_ok=True)
+    done   = set(checkpoint.manifest.blocks(checkpoint.output))
+    months = month_blocks(ds_year.time.values)
+    if done:
+        print(f"   ↩️  resuming: {len(done)} of {len(months)} months already committed", flush=True)
+    for label, steps in months:
+        path = folder / f"{label}.nc"
+        if label in done and path.exists():
+            continue
+        _write_block(ds_year.isel(time=steps), path)
+        checkpoint.manifest.block_done(checkpoint.output, label)
+        print(f"   🧩 {label} committed", flush=True)
+
+    # read back as one year, laid out, attributed and encoded like a single pass
+    parts  = [xr.open_dataset(folder / f"{label}.nc", chunks={}) for label, _ in months]
+    merged = xr.concat(parts, "time", data_vars="minimal", coords="minimal", compat="override")
+    merged = merged.chunk(dict(ds_year.chunks)) if ds_year.chunks else merged
+    merged.attrs = dict(ds_year.attrs)
+    for name, var in merged.variables.items():
+        var.attrs    = dict(ds_year[name].attrs)
+        var.encoding = dict(ds_year[name].encoding)
+    try:
+        merged.to_netcdf(out_file, encoding=dict(encoding))
+    finally:
+        for p in parts:
+            p.close()
+    return Path(out_file)
+
+
+def discard_blocks(output: Path) -> None:
+    """Remove the block directory of a finished *output*."""
+    shutil.rmtree(block_dir(output), ignore_errors=True)
+
+
+def _self_tests() -> None:  # pragma: no cover – light runtime checks
+    """A resumed year equals one written in a single pass; stale blocks are dropped."""
+    import tempfile
+
+    from water_withdrawal import _test_inputs, withdrawals_by_gridcell
+    from withdrawal_io import output_encoding
+
+    write, written = _write_block, []
+
+    class Killed(Exception):
+        pass
+
+    def counted(block, path, kill_at=None):
+        if len(written) == kill_at:
+            raise Killed(path.name)
+        written.append(path.stem)
+        write(block, path)
+
+    temp, dens_ds, nm = _test_inputs(ntime=70)                  # 30 Jan – 9 Apr: 4 months
+    ds  = withdrawals_by_gridcell(temp.chunk(time=10), dens_ds, nm, units="m3")
+    enc = output_encoding(ds, complevel=4, chunksizes={"time": 10, "lat": 6, "lon": 8})
+
+    def run(tmp, data, options, kill_at=None):
+        """One ``--checkpoint`` attempt on ``out.nc``; returns the months it computed."""
+        global _write_block
+        out, man = tmp / "out.nc", RunManifest(tmp, options, "c0")
+        written.clear()
+        _write_block = lambda block, path: counted(block, path, kill_at)
+        try:
+            with man.recording(out, [tmp / "in.nc"]):
+                write_in_blocks(data, part_path(out), enc, Checkpoint(man, out))
+                os.replace(part_path(out), out)
+            discard_blocks(out)
+        except Killed:
+            pass
+        finally:
+            _write_block = write
+        return list(written)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        (tmp / "in.nc").write_bytes(b"t2m" * 1000)
+        ds.to_netcdf(tmp / "ref.nc", encoding=enc)
+
+        assert run(tmp, ds, {"model": "linear"}, kill_at=2) == ["2019-01", "2019-02"], "killed run"
+        assert not (tmp / "out.nc").exists() and (block_dir(tmp / "out.nc") / "2019-02.nc").exists()
+        assert run(tmp, ds, {"model": "linear"}) == ["2019-03", "2019-04"], "resume skips committed months"
+        assert not block_dir(tmp / "out.nc").exists(), "blocks removed"
+        with xr.open_dataset(tmp / "out.nc") as a, xr.open_dataset(tmp / "ref.nc") as b:
+            assert a.identical(b), "resumed != single pass"
+
+        # committed months of other options or inputs are not reused
+        (tmp / "out.nc").unlink()
+        twice = ds * 2
+        twice.to_netcdf(tmp / "ref2.nc", encoding=enc)
+        run(tmp, ds, {"model": "linear"}, kill_at=2)
+        assert len(run(tmp, twice, {"model": "piecewise"})) == 4, "options changed: all months again"
+        with xr.open_dataset(tmp / "out.nc") as a, xr.open_dataset(tmp / "ref2.nc") as b:
+            assert a.identical(b), "blocks of other options reused"
+        (tmp / "out.nc").unlink()
+        run(tmp, ds, {"model": "linear"}, kill_at=3)
+        (tmp / "in.nc").write_bytes(b"T2M" * 1000)
+        assert len(run(tmp, ds, {"model": "linear"})) == 4, "inputs changed: all months again"
+    print("✅ checkpoint self‑tests passed.")
+
+
+__all__ = [
+    "Checkpoint",
+    "block_dir",
+    "month_blocks",
+    "write_in_blocks",
+    "discard_blocks",
+]
+
+
+if __name__ == "__main__":  # pragma: no cover
+    _self_tests()
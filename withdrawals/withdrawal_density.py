@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""Day‑by‑day livestock density between the annual 1‑Jan snapshots.
+
+The density file holds one map per year (1 Jan). Instead of holding that
+map for the whole year (a step function), each day takes the linear
+blend of the two surrounding snapshots,
+
+    dens(day) = dens(1 Jan yr) + w(day) · (dens(1 Jan yr+1) − dens(1 Jan yr))
+    w(day)    = (day − 1 Jan yr) / (1 Jan yr+1 − 1 Jan yr)
+
+:pyfunc:`daily_density` returns only the two maps and the per‑day weights;
+``water_withdrawal`` blends one day's map at a time inside its block
+kernels, so no (time, lat, lon) density array is ever built. For the last
+year on file there is no next snapshot and the map is held, as before.
+
+Several density products (Utrecht counts, FAO GLW 2010/2015/2020) can be
+stacked on a ``density_source`` axis with :pyfunc:`stack_density_sources`;
+the kernels broadcast over it, so one clip of t2m serves every source.
+"""
+
+from pathlib import Path
+from typing import Mapping, NamedTuple, Sequence
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+DENSITY_MODES = ("step", "linear")
+
+FAO_VAR_MAP = {                    # FAO/GLW species name → Utrecht variable
+    "cattle":  "CowPop",
+    "buffalo": "BufalloPop",
+    "goat":    "GoatPop",
+    "sheep":   "SheepPop",
+    "pig":     "PigPop",
+    "chicken": "ChickenPop",
+    "duck":    "DuckPop",
+    "horse":   "HorsePop",
+}
+
+
+class DailyDensity(NamedTuple):
+    """Annual map ``base``, increment ``delta`` and per‑day ``weight``."""
+
+    base: xr.Dataset
+    delta: xr.Dataset
+    weight: xr.DataArray
+
+    def at(self, day) -> xr.Dataset:
+        """Interpolated density maps of one *day* (for checks and plots)."""
+        return self.base + float(self.weight.sel(time=day)) * self.delta
+
+    def bounds_pair(self) -> tuple:
+        """The two snapshots bracketing the year; every day lies between."""
+        return self.base, self.base + self.delta
+
+
+def _snapshot(dens_ds: xr.Dataset, yr: int) -> xr.Dataset:
+    return dens_ds.sel(year=str(yr)).squeeze("year", drop=True)
+
+
+def day_weights(time: xr.DataArray, yr: int) -> xr.DataArray:
+    """Fraction of the year from 1 Jan *yr* to each day of *time* (``[0, 1)``)."""
+    start = pd.Timestamp(f"{yr}-01-01")
+    span  = (pd.Timestamp(f"{yr + 1}-01-01") - start) / np.timedelta64(1, "D")
+    days  = (time - np.datetime64(start)) / np.timedelta64(1, "D")
+    return (days / span).astype("float64").rename("density_weight")
+
+
+def daily_density(dens_ds: xr.Dataset, time: xr.DataArray, yr: int) -> DailyDensity:
+    """Interpolation pieces for the days *time* of year *yr*.
+
+    *dens_ds* carries annual 1‑Jan maps on a ``year`` axis, as opened by
+    ``water_withdrawal_yearly.open_density``.
+    """
+    base = _snapshot(dens_ds, yr)
+    if (dens_ds.year.dt.year == yr + 1).any():
+        delta = _snapshot(dens_ds, yr + 1) - base
+    else:
+        print(f"   ⚠️  no {yr + 1} density – holding {yr} maps", flush=True)
+        delta = xr.zeros_like(base)
+    return DailyDensity(base, delta, day_weights(time, yr))
+
+
+# ── several density products ──────────────────────────────────────────────
+
+def open_density_source(path: Path) -> xr.Dataset:
+    """One density product with Utrecht variable names.
+
+    *path* is a NetCDF file (Utrecht counts with a ``time`` axis, or a
+    merged snapshot such as ``livestock_counts_2020.nc`` with one variable
+    per species) or a directory of ``fao_<animal>_<year>.nc`` files from
+    ``liv_density/rename_fao20xx.sh`` (``population_density`` each).
+    Snapshots have no ``year`` axis and are used for every year.
+    """
+    path = Path(path)
+    if path.is_dir():
+        parts = [xr.open_dataset(f)["population_density"].rename(FAO_VAR_MAP[f.stem.split("_")[1]])
+                 for f in sorted(path.glob("fao_*_*.nc")) if f.stem.split("_")[1] in FAO_VAR_MAP]
+        if not parts:
+            raise FileNotFoundError(f"no fao_<animal>_<year>.nc files in {path}")
+        ds = xr.merge(parts, compat="override")
+    else:
+        ds = xr.open_dataset(path)
+    ds = ds.rename({k: v for k, v in FAO_VAR_MAP.items() if k in ds.data_vars})
+    if "time" in ds.dims:
+        ds = ds.rename({"time": "year"})
+        ds["year"] = ds.year.astype("datetime64[ns]")
+    return ds[[v for v in ds.data_vars if v in FAO_VAR_MAP.values()]]
+
+
+def stack_density_sources(sources: Mapping[str, xr.Dataset], years: Sequence[int]) -> xr.Dataset:
+    """Maps of *years* from every source on a ``density_source`` axis.
+
+    Sources with a ``year`` axis contribute their own maps; a year missing
+    from any of them is left out (so ``daily_density`` holds the map when
+    yr+1 is absent). Snapshots repeat. Grids must match the first source.
+    Species a source lacks are zero for it and listed in the
+    ``missing_species`` attribute, so totals compare the species covered.
+    """
+    names = list(sources)
+    ref   = sources[names[0]]
+    keep  = [yr for yr in years
+             if all((ds.year.dt.year == yr).any() for ds in sources.values() if "year" in ds.dims)]
+    if not keep:
+        raise ValueError(f"no density source covers {list(years)}")
+    stamps  = pd.to_datetime([f"{yr}-01-01" for yr in keep])
+    species = list(dict.fromkeys(v for ds in sources.values() for v in ds.data_vars))
+
+    maps, missing = [], []
+    for name, ds in sources.items():
+        if (ds.sizes["lat"], ds.sizes["lon"]) != (ref.sizes["lat"], ref.sizes["lon"]):
+            raise ValueError(f"density source '{name}' is not on the grid of '{names[0]}'")
+        ds = ds.assign_coords(lat=ref.lat.values, lon=ref.lon.values)
+        if "year" in ds.dims:
+            ds = ds.sel(year=ds.year.dt.year.isin(keep)).assign_coords(year=stamps)
+        else:
+            ds = ds.expand_dims(year=stamps)
+        absent = [v for v in species if v not in ds]
+        if absent:
+            print(f"   ⚠️  {name}: no {', '.join(absent)} – set to 0", flush=True)
+            missing.append(f"{name}: {' '.join(absent)}")
+            ds = ds.assign({v: xr.zeros_like(ds[next(iter(ds.data_vars))]) for v in absent})
+        maps.append(ds[species].transpose("year", "lat", "lon"))
+
+    out = xr.concat(maps, dim=pd.Index(names, name="density_source"),
+                    coords="minimal", compat="override", combine_attrs="drop")
+    if missing:
+        out.attrs["missing_species"] = "; ".join(missing)
+    return out
+
+
+def _self_tests() -> None:  # pragma: no cover – light runtime checks
+    """Products stacked on density_source evaluate like separate runs."""
+    from water_withdrawal import _test_inputs, total_withdrawal_by_gridcell, withdrawals_by_gridcell
+
+    temp, dens_ds, nm = _test_inputs()
+    snap  = dens_ds.drop_vars("horses") * 0.5
+    multi = stack_density_sources({"a": dens_ds, "b": snap}, [2019]).isel(year=0)
+    both  = withdrawals_by_gridcell(temp, multi, nm)
+    one   = withdrawals_by_gridcell(temp, dens_ds, nm)
+    assert all(np.array_equal(both[v].sel(density_source="a").values, one[v].values) for v in one), "source a"
+    assert np.allclose(both["cattle_wd"].sel(density_source="b").values, 0.5 * one["cattle_wd"].values,
+                       rtol=1e-12), "source b"
+    assert float(abs(both["horses_wd"].sel(density_source="b")).max()) == 0.0, "missing species not zero"
+    multi_total = total_withdrawal_by_gridcell(temp.chunk(time=2), multi, nm)
+    assert np.allclose(multi_total.values, sum(both[v] for v in both).values, rtol=1e-12), "sources total"
+    print("✅ density self‑tests passed.")
+
+
+__all__ = [
+    "DENSITY_MODES",
+    "FAO_VAR_MAP",
+    "DailyDensity",
+    "day_weights",
+    "daily_density",
+    "open_density_source",
+    "stack_density_sources",
+]
+
+
+if __name__ == "__main__":  # pragma: no cover
+    _self_tests()
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""Monte Carlo bands for annual withdrawals from the coefficient uncertainty.
+
+Each ensemble member is one coefficient table (values at 15/25/35 °C per
+species). Members are drawn by :pyfunc:`sample_coefficients`:
+
+* one log‑normal factor per member and species (``rel_sd``) scales all
+  three anchors together, as they come from the same study;
+* an optional independent factor per anchor (``anchor_sd``);
+* where a species has more than one published table (horses: ``water.py``
+  has 40.33/48.6 L at 25/35 °C, ``water_withdrawal.py`` 55.51/90.84 L)
+  each member first picks one at random.
+
+Totals are evaluated on the monthly statistics of ``withdrawal_stats``,
+where they are linear in the coefficients:
+
+    total_m = Σ_s dens_s·(ndays·base_ms + Σ_k slope_msk·S_k)
+
+so all N members come from one pass over the cached sums. Nothing daily is
+held, and the ``member`` axis only exists inside one block of latitude
+rows at a time. Global totals use the per‑species grid sums and cost
+nothing extra.
+
+Usage
+-----
+python withdrawal_ensemble.py --start 1980 --end 2019 --members 1000 [--model piecewise]
+"""
+
+import argparse
+from pathlib import Path
+from typing import Mapping, Optional, Sequence, Union
+
+import numpy as np
+import xarray as xr
+
+from water_withdrawal import (
+    _ANCHORS,
+    _KNOTS,
+    _UNITS,
+    _WITHDRAWAL_DATA,
+    _check_model,
+    _coefficient_stack,
+    _present_species,
+)
+from withdrawal_stats import FREQS, _density_by_time, _model_segments
+
+# Other published tables (values at 15/25/35 °C); see water.py
+ALTERNATIVE_DATA = {
+    "horses": [np.array([31.81, 40.33, 48.6])],
+}
+
+QUANTILES = (0.05, 0.5, 0.95)
+
+LAT_BLOCK = 20          # latitude rows per block in the per‑cell pass
+
+
+# ── sampling ──────────────────────────────────────────────────────────────
+
+def sample_coefficients(
+    n: int,
+    rel_sd: Union[float, Mapping[str, float]] = 0.1,
+    anchor_sd: float = 0.0,
+    alternatives: Optional[Mapping[str, Sequence[np.ndarray]]] = ALTERNATIVE_DATA,
+    seed: Optional[int] = None,
+) -> xr.DataArray:
+    """Draw *n* coefficient tables as ``coefficients(member, species, anchor)``.
+
+    *rel_sd* is the log‑scale standard deviation of the per‑species factor
+    (≈ relative error), a scalar or a mapping by animal. Member 0 is
+    always the unperturbed ``_WITHDRAWAL_DATA`` so runs stay comparable.
+    """
+    rng     = np.random.default_rng(seed)
+    animals = list(_WITHDRAWAL_DATA)
+    out     = np.empty((n, len(animals), len(_ANCHORS)))
+
+    for j, animal in enumerate(animals):
+        sources = [_WITHDRAWAL_DATA[animal], *((alternatives or {}).get(animal, []))]
+        pick    = rng.integers(len(sources), size=n)
+        sd      = rel_sd.get(animal, 0.0) if isinstance(rel_sd, Mapping) else rel_sd
+        common  = rng.normal(0.0, sd, size=(n, 1))
+        own     = rng.normal(0.0, anchor_sd, size=(n, len(_ANCHORS)))
+        out[:, j] = np.asarray(sources, dtype=float)[pick] * np.exp(common + own)
+        out[0, j] = _WITHDRAWAL_DATA[animal]
+
+    return xr.DataArray(
+        out,
+        dims=("member", "species", "anchor"),
+        coords={"member": np.arange(n), "species": animals, "anchor": list(_ANCHORS)},
+        attrs={"units": "L head-1 day-1", "rel_sd": str(rel_sd), "anchor_sd": anchor_sd},
+        name="coefficients",
+    )
+
+
+def _member_stack(coefficients: xr.DataArray, animals, model: str) -> tuple:
+    """(base[species, member], slopes[species, segment, member]) for *animals*."""
+    stacks = [
+        _coefficient_stack(animals, model, dict(zip(coefficients.species.values, table)))
+        for table in coefficients.values
+    ]
+    base   = np.stack([b for b, _, _ in stacks], axis=-1)
+    slopes = np.stack([s for _, s, _ in stacks], axis=-1)
+    return base, slopes
+
+
+# ── evaluation ────────────────────────────────────────────────────────────
+
+def _band_block(dens, nd, seg, *, base, slopes, divisor, quantiles):
+    """Member totals on one block → (mean, quantiles last)."""
+    tot  = np.einsum("...s,sm->...m", dens * nd[..., None], base)
+    tot += np.einsum("...s,...k,skm->...m", dens, seg, slopes)
+    tot /= divisor
+    return tot.mean(axis=-1), np.moveaxis(np.quantile(tot, quantiles, axis=-1), 0, -1)
+
+
+def ensemble_annual_totals(
+    stats: xr.Dataset,
+    density_ds: xr.Dataset,
+    name_map: Mapping[str, str],
+    coefficients: xr.DataArray,
+    model: str = "linear",
+    units: str = "m3",
+    quantiles: Sequence[float] = QUANTILES,
+    lat_block: int = LAT_BLOCK,
+) -> xr.Dataset:
+    """Per‑cell and global ensemble bands of the annual all‑species total.
+
+    Returns ``total_wd_mean``/``total_wd_quantile`` per cell and year,
+    ``global_total(member, time)`` and its mean/quantiles. The per‑cell
+    pass runs lazily in blocks of *lat_block* rows; call ``.compute()`` or
+    ``to_netcdf`` to evaluate.
+    """
+    if units not in _UNITS:
+        raise ValueError(f"Unknown units '{units}'. Choose from {list(_UNITS)}.")
+    divisor, units_attr = _UNITS[units]
+    units_attr = units_attr.replace("day-1", "year-1")
+
+    model   = _check_model(model)
+    present = _present_species(density_ds, name_map)
+    base, slopes = _member_stack(coefficients, present.values(), model)
+
+    annual = stats.resample(time=FREQS["year"]).sum()
+    nd     = annual["ndays"].astype("float64")
+    seg    = xr.concat(_model_segments(annual["clip_sum"], _KNOTS[model]), dim="segment")
+    dens   = xr.concat([_density_by_time(density_ds[v], annual.time) for v in present],
+                       dim="species").transpose(..., "species")
+
+    # per‑cell bands, member axis only inside _band_block
+    q = list(quantiles)
+    mean, band = xr.apply_ufunc(
+        _band_block,
+        dens.chunk(lat=lat_block, species=-1),
+        nd.chunk(lat=lat_block),
+        seg.chunk(lat=lat_block, segment=-1),
+        input_core_dims=[["species"], [], ["segment"]],
+        output_core_dims=[[], ["quantile"]],
+        kwargs={"base": base, "slopes": slopes, "divisor": divisor, "quantiles": q},
+        dask="parallelized",
+        output_dtypes=[float, float],
+        dask_gufunc_kwargs={"output_sizes": {"quantile": len(q)}},
+    )
+
+    # global totals: grid sums per species, then one small matmul; cells
+    # whose total is NaN in the per‑cell maps are left out for every species
+    dens  = dens.where(dens.notnull().all("species"))
+    g_nd  = (dens * nd).sum(("lat", "lon")).transpose("time", "species").values
+    g_seg = (dens * seg).sum(("lat", "lon")).transpose("time", "species", "segment").values
+    g_tot = (g_nd @ base + np.einsum("tsk,skm->tm", g_seg, slopes)) / divisor
+    g_tot = xr.DataArray(g_tot.T, dims=("member", "time"),
+                         coords={"member": coefficients.member, "time": annual.time})
+
+    return xr.Dataset(
+        {
+            "total_wd_mean": mean.transpose("time", ...).assign_attrs(units=units_attr),
+            "total_wd_quantile": band.assign_coords(quantile=q)
+                                     .transpose("quantile", "time", ...)
+                                     .assign_attrs(units=units_attr),
+            "global_total": g_tot.assign_attrs(units=units_attr.replace("cell-1 ", "")),
+            "global_mean": g_tot.mean("member").assign_attrs(units=units_attr.replace("cell-1 ", "")),
+            "global_quantile": g_tot.quantile(q, dim="member")
+                                    .assign_attrs(units=units_attr.replace("cell-1 ", "")),
+            "coefficients": coefficients,
+        },
+        attrs={"model": model, "members": coefficients.sizes["member"]},
+    )
+
+
+# ── driver ────────────────────────────────────────────────────────────────
+
+def main() -> None:
+    from water_withdrawal_yearly import NAME_MAP, SCRATCH, open_density
+    from withdrawal_stats import open_stats
+
+    p = argparse.ArgumentParser(description="Monte Carlo bands of annual livestock withdrawals")
+    p.add_argument("--start", type=int, default=1980, help="first year (inclusive)")
+    p.add_argument("--end",   type=int, default=2019, help="last year (inclusive)")
+    p.add_argument("--members", type=int, default=1000, help="ensemble size")
+    p.add_argument("--rel-sd", type=float, default=0.1, help="per-species log-normal sd")
+    p.add_argument("--anchor-sd", type=float, default=0.0, help="extra per-anchor sd")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--model", choices=tuple(_KNOTS), default="linear")
+    p.add_argument("--stats-dir", type=Path, default=SCRATCH / "liv_wd_stats",
+                   help="output of withdrawal_stats.py")
+    p.add_argument("--out", type=Path, default=None, help="output file")
+    args = p.parse_args()
+    out = args.out or SCRATCH / f"Liv_WD_ensemble_{args.start}_{args.end}.nc"
+
+    coef = sample_coefficients(args.members, rel_sd=args.rel_sd,
+                               anchor_sd=args.anchor_sd, seed=args.seed)
+    ds = ensemble_annual_totals(open_stats(args.stats_dir, args.start, args.end),
+                                open_density(), NAME_MAP, coef, model=args.model)
+    ds.to_netcdf(out, encoding={v: dict(zlib=True, complevel=4) for v in ds.data_vars
+                                if v != "coefficients"})
+    print(f"🎉  ensemble of {args.members} written → {out}", flush=True)
+
+
+def _self_tests() -> None:  # pragma: no cover – light runtime checks
+    """Members with no spread evaluate exactly like a single table."""
+    from water_withdrawal import _test_inputs
+    from withdrawal_stats import clip_stats, withdrawal_from_stats
+
+    temp, dens_ds, nm = _test_inputs()
+    stats = clip_stats(temp)
+    coef  = sample_coefficients(3, rel_sd=0.0, alternatives=None)
+    ens   = ensemble_annual_totals(stats, dens_ds, nm, coef, model="piecewise").compute()
+    one   = withdrawal_from_stats(stats, dens_ds, nm, model="piecewise", freq="year")
+    one   = sum(one[v] for v in one)
+    assert np.allclose(ens["total_wd_quantile"].values, one.values[None], rtol=1e-12), "ensemble bands"
+    assert np.allclose(ens["global_mean"].values, one.sum(("lat", "lon")).values, rtol=1e-12), "ensemble global"
+    print("✅ ensemble self‑tests passed.")
+
+
+__all__ = [
+    "ALTERNATIVE_DATA",
+    "QUANTILES",
+    "sample_coefficients",
+    "ensemble_annual_totals",
+]
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,450 @@
+#!/usr/bin/env python3
+"""Fused clip → factor → × density kernels with swappable backends.
+
+``water_withdrawal`` evaluates its blocks through this module so the same
+maths can run on plain NumPy or on an optional compiled backend:
+
+* ``numpy``   – always available; in‑place ufuncs, a fixed number of
+                scratch buffers per call (not per species).
+* ``numexpr`` – one multithreaded pass per species, no temporaries.
+* ``numba``   – one parallel pass over the cells for *all* species.
+
+Curves are piecewise linear between ``knots`` and evaluated segment by
+segment, ``base + Σ_k slope_k·(clip(T, x_k, x_k+1) − x_k)``; the default
+two knots (15, 35 °C) give the original linear model.
+
+Pick a backend with :pyfunc:`set_backend` or the ``LIVWD_KERNEL``
+environment variable, read on the first kernel call (importing this
+module never imports numba or numexpr). A backend that is not installed falls back to
+``numpy`` with a warning, so job scripts never fail on a missing package;
+so does an unknown ``LIVWD_KERNEL`` value.
+Thread count follows ``SLURM_CPUS_PER_TASK`` (else every core).
+
+:pyfunc:`thi_temperature` turns a 2 m temperature / dewpoint pair into the
+THI‑equivalent temperature used by the humidity‑aware mode.
+
+Only the ``numpy`` backend reproduces ``withdrawal_by_gridcell`` bit for
+bit; the compiled backends skip the intermediate cast to the temperature
+dtype and agree to float rounding (~1e‑7 relative for float32 ``t2m``).
+"""
+
+import importlib.util
+import os
+from typing import List, Optional
+
+import numpy as np
+
+T_LOW, T_HIGH = 15.0, 35.0
+
+BACKENDS = ("numpy", "numexpr", "numba")
+
+_active: Optional[str] = None     # None: LIVWD_KERNEL on the first kernel call
+_nb_kernels = None
+
+
+# ──────────────────────────── backend selection ──────────────────────────
+def default_threads() -> int:
+    """``SLURM_CPUS_PER_TASK``, else every core."""
+    return int(os.environ.get("SLURM_CPUS_PER_TASK", os.cpu_count() or 1))
+
+
+def available_backends() -> List[str]:
+    """Backends whose packages are installed (found, not imported)."""
+    return [name for name in BACKENDS
+            if name == "numpy" or importlib.util.find_spec(name) is not None]
+
+
+def set_num_threads(n: Optional[int] = None) -> int:
+    """Set the thread count of the compiled backends (default: all cores)."""
+    n       = n or default_threads()
+    backend = get_backend()
+    if backend == "numexpr":
+        import numexpr as ne
+        ne.set_num_threads(n)
+    elif backend == "numba":
+        import numba
+        numba.set_num_threads(min(n, numba.config.NUMBA_NUM_THREADS))
+    return n
+
+
+def set_backend(name: str, threads: Optional[int] = None) -> str:
+    """Select the kernel backend; returns the backend actually in use."""
+    global _active
+    name = name.strip().lower()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend '{name}'. Choose from {list(BACKENDS)}.")
+    if name not in available_backends():
+        print(f"   ⚠️  kernel backend '{name}' not installed – using numpy", flush=True)
+        name = "numpy"
+    _active = name
+    set_num_threads(threads)
+    return _active
+
+
+def get_backend() -> str:
+    """Backend in use; the first call selects ``$LIVWD_KERNEL`` (default numpy)."""
+    if _active is None:
+        name = os.environ.get("LIVWD_KERNEL") or "numpy"
+        if name.strip().lower() not in BACKENDS:
+            print(f"   ⚠️  LIVWD_KERNEL='{name}' is not one of {list(BACKENDS)} – using numpy",
+                  flush=True)
+            name = "numpy"
+        set_backend(name)
+    return _active
+
+
+# ──────────────────────────── shape helpers ──────────────────────────────
+def _check_out(out: Optional[np.ndarray], shape: tuple, dtype) -> np.ndarray:
+    if out is None:
+        return np.empty(shape, dtype=dtype)
+    if out.shape != shape or out.dtype != dtype:
+        raise ValueError(f"out must have shape {shape} and dtype {np.dtype(dtype)}, "
+                         f"got {out.shape} {out.dtype}")
+    return out
+
+
+def _outer_inner(temp: np.ndarray, dens: np.ndarray, shape: tuple):
+    """Collapse *temp* to (outer, inner) with *dens* varying only over inner.
+
+    Density maps are normally (lat, lon) against a (time, lat, lon) block,
+    so ``inner`` is the spatial part. Returns ``None`` when the layout does
+    not split that way.
+    """
+    dshape = (1,) * (len(shape) - dens.ndim + 1) + dens.shape[1:]
+    k = 0
+    while k < len(shape) and dshape[k] == 1 and shape[k] != 1:
+        k += 1
+    if dshape[k:] != shape[k:] or temp.shape != shape:
+        return None
+    outer = int(np.prod(shape[:k], dtype=np.int64))
+    return (np.ascontiguousarray(temp).reshape(outer, -1),
+            np.ascontiguousarray(dens).reshape(dens.shape[0], -1))
+
+
+# ──────────────────────────── numpy backend ──────────────────────────────
+# A factor curve through knots x0 < x1 < … is evaluated segment by segment:
+#   f(T) = base + Σ_k slope_k · (clip(T, x_k, x_k+1) − x_k)
+# With the default two knots this is exactly y15 + slope·(clip(T) − 15).
+def _segments(temp, knots):
+    """``clip(T, x_k, x_k+1) − x_k`` per segment, in the temperature dtype."""
+    segs = []
+    for lo, hi in zip(knots[:-1], knots[1:]):
+        x = np.clip(temp, lo, hi)
+        np.subtract(x, lo, out=x)
+        segs.append(x)
+    return segs
+
+
+def _fused_numpy(temp, dens, base, slopes, knots, divisor, out):
+    segs = _segments(temp, knots)
+
+    work = np.empty(temp.shape, dtype=np.result_type(temp.dtype, base.dtype))
+    cast = work if work.dtype == temp.dtype else np.empty(temp.shape, dtype=temp.dtype)
+    scratch = np.empty_like(work) if len(segs) > 1 else None
+
+    for s in range(len(base)):
+        np.multiply(segs[0], slopes[s, 0], out=work)
+        for k in range(1, len(segs)):
+            np.multiply(segs[k], slopes[s, k], out=scratch)
+            np.add(work, scratch, out=work)
+        np.add(work, base[s], out=work)
+        if cast is not work:
+            np.copyto(cast, work, casting="same_kind")
+        np.multiply(cast, dens[s], out=out[s])
+        if divisor != 1.0:
+            np.divide(out[s], divisor, out=out[s])
+    return out
+
+
+def _total_numpy(temp, A, B, knots, out):
+    scratch = np.empty_like(out) if len(B) > 1 else None
+    for k, (lo, hi) in enumerate(zip(knots[:-1], knots[1:])):
+        dst = out if k == 0 else scratch
+        np.clip(temp, lo, hi, out=dst, casting="same_kind")
+        np.multiply(dst, B[k], out=dst)
+        if k:
+            np.add(out, dst, out=out)
+    np.add(out, A, out=out)
+    return out
+
+
+# ──────────────────────────── numexpr backend ────────────────────────────
+def _ne_clip(lo: float, hi: float) -> str:
+    lo, hi = float(lo), float(hi)
+    return f"where(t < {lo!r}, {lo!r}, where(t > {hi!r}, {hi!r}, t))"
+
+
+def _fused_numexpr(temp, dens, base, slopes, knots, divisor, out):
+    import numexpr as ne
+
+    terms = " + ".join(f"b{k} * ({_ne_clip(lo, hi)} - {float(lo)!r})"
+                       for k, (lo, hi) in enumerate(zip(knots[:-1], knots[1:])))
+    for s in range(len(base)):
+        local = {"t": temp, "d": dens[s], "a": base[s], "k": divisor}
+        local.update({f"b{k}": slopes[s, k] for k in range(slopes.shape[1])})
+        ne.evaluate(f"(a + {terms}) * d / k", local_dict=local,
+                    out=out[s], casting="same_kind")
+    return out
+
+
+def _total_numexpr(temp, A, B, knots, out):
+    import numexpr as ne
+
+    terms = " + ".join(f"B{k} * {_ne_clip(lo, hi)}"
+                       for k, (lo, hi) in enumerate(zip(knots[:-1], knots[1:])))
+    local = {"t": temp, "A": A}
+    local.update({f"B{k}": B[k] for k in range(len(B))})
+    ne.evaluate(f"A + {terms}", local_dict=local, out=out, casting="same_kind")
+    return out
+
+
+# ──────────────────────────── numba backend ──────────────────────────────
+def _numba_kernels():
+    """Compile (once, cached on disk) the numba kernels."""
+    global _nb_kernels
+    if _nb_kernels is not None:
+        return _nb_kernels
+
+    import numba
+
+    @numba.njit(parallel=True, cache=True)
+    def fused(t2, d2, base, slopes, knots, divisor, out3):
+        ns, nk = slopes.shape
+        no, ni = t2.shape
+        for i in numba.prange(no):
+            x = np.empty(nk)
+            for j in range(ni):
+                t = t2[i, j]
+                for k in range(nk):
+                    v = t
+                    if v < knots[k]:        # NaN fails both tests and stays NaN
+                        v = knots[k]
+                    elif v > knots[k + 1]:
+                        v = knots[k + 1]
+                    x[k] = v - knots[k]
+                for s in range(ns):
+                    f = base[s]
+                    for k in range(nk):
+                        f += slopes[s, k] * x[k]
+                    out3[s, i, j] = f * d2[s, j] / divisor
+
+    @numba.njit(parallel=True, cache=True)
+    def total(t2, AB, knots, out2):
+        nk = AB.shape[0] - 1
+        no, ni = t2.shape
+        for i in numba.prange(no):
+            for j in range(ni):
+                t = t2[i, j]
+                acc = AB[0, j]
+                for k in range(nk):
+                    v = t
+                    if v < knots[k]:
+                        v = knots[k]
+                    elif v > knots[k + 1]:
+                        v = knots[k + 1]
+                    acc += AB[k + 1, j] * v
+                out2[i, j] = acc
+
+    _nb_kernels = (fused, total)
+    return _nb_kernels
+
+
+def _fused_numba(temp, dens, base, slopes, knots, divisor, out):
+    split = _outer_inner(temp, dens, out.shape[1:])
+    if split is None or not out.flags.c_contiguous:
+        return _fused_numpy(temp, dens, base, slopes, knots, divisor, out)
+    t2, d2 = split
+    _numba_kernels()[0](t2, d2, base, slopes, knots, divisor,
+                        out.reshape(len(base), *t2.shape))
+    return out
+
+
+def _total_numba(temp, A, B, knots, out):
+    split = _outer_inner(temp, np.stack(np.broadcast_arrays(A, *B)), out.shape)
+    if split is None or not out.flags.c_contiguous:
+        return _total_numpy(temp, A, B, knots, out)
+    t2, AB = split
+    _numba_kernels()[1](t2, AB, knots, out.reshape(t2.shape))
+    return out
+
+
+_FUSED = {"numpy": _fused_numpy, "numexpr": _fused_numexpr, "numba": _fused_numba}
+_TOTAL = {"numpy": _total_numpy, "numexpr": _total_numexpr, "numba": _total_numba}
+
+
+# ──────────────────────────── public kernels ─────────────────────────────
+def fused_withdrawal(
+    temp: np.ndarray,
+    dens: np.ndarray,
+    base: np.ndarray,
+    slopes: np.ndarray,
+    *,
+    knots: tuple = (T_LOW, T_HIGH),
+    divisor: float = 1.0,
+    dtype: Optional[str] = None,
+    out: Optional[np.ndarray] = None,
+    backend: Optional[str] = None,
+) -> np.ndarray:
+    """Clip, evaluate and multiply by density for every species in one call.
+
+    *base* is each species' value at ``knots[0]`` and *slopes* its slope on
+    every segment between *knots*, shape ``(species, len(knots) - 1)`` (a
+    1‑D array is accepted for the two‑knot linear model). *dens* carries
+    species on axis 0 and broadcasts against *temp* on the rest; the result
+    has shape ``(species,) + broadcast(temp, dens[0])``. Pass a
+    preallocated *out* of that shape and dtype to reuse buffers.
+
+    Coefficients are applied in float64 unless *dtype* (e.g. ``"float32"``)
+    is given; pass float32 *temp*/*dens* too for an all‑float32 pass.
+    """
+    base   = np.asarray(base, dtype=dtype or float)
+    slopes = np.asarray(slopes, dtype=dtype or float).reshape(len(base), -1)
+    knots  = np.asarray(knots, dtype=float)
+    if slopes.shape[1] != len(knots) - 1:
+        raise ValueError(f"{len(knots)} knots need {len(knots) - 1} slopes per species")
+
+    shape = (len(base),) + np.broadcast_shapes(temp.shape, dens.shape[1:])
+    out   = _check_out(out, shape, np.result_type(temp.dtype, dens.dtype))
+    return _FUSED[backend or get_backend()](temp, dens, base, slopes, knots, float(divisor), out)
+
+
+def total_withdrawal(
+    temp: np.ndarray,
+    A: np.ndarray,
+    B: np.ndarray,
+    *,
+    knots: tuple = (T_LOW, T_HIGH),
+    out: Optional[np.ndarray] = None,
+    backend: Optional[str] = None,
+) -> np.ndarray:
+    """``A + Σ_k B_k·clip(T, x_k, x_k+1)`` in one pass.
+
+    *B* carries one map per segment on axis 0 (a single map is accepted for
+    the two‑knot model); written into *out* when given.
+    """
+    knots = np.asarray(knots, dtype=float)
+    B     = B[None] if B.ndim == A.ndim else B
+    if len(B) != len(knots) - 1:
+        raise ValueError(f"{len(knots)} knots need {len(knots) - 1} slope maps")
+    shape = np.broadcast_shapes(temp.shape, A.shape, B.shape[1:])
+    out   = _check_out(out, shape, np.result_type(temp.dtype, A.dtype, B.dtype))
+    return _TOTAL[backend or get_backend()](temp, A, B, knots, out)
+
+
+# ──────────────────────────── humidity (THI) ─────────────────────────────
+# NRC (1971) temperature‑humidity index, T in °C and RH in %:
+#   THI = (1.8·T + 32) − (0.55 − 0.0055·RH)·(1.8·T − 26)
+# RH from the dewpoint with the Magnus form (Alduchov & Eskridge 1996).
+# The factor curves are anchored in temperature, so THI is mapped back to
+# the temperature giving the same THI at a reference humidity:
+#   T_eq = (THI − 32 − 26·c) / (1.8·(1 − c)),   c = 0.55 − 0.0055·RH_ref
+# T_eq == T wherever RH == RH_ref; humid days read hotter, dry days cooler.
+RH_REF = 50.0
+
+_MAGNUS_B, _MAGNUS_C = 17.625, 243.04
+
+
+def _thi_slab(t, td, rh_ref, out):
+    c0 = 0.55 - 0.0055 * rh_ref
+    # RH / 100 = e_s(Td) / e_s(T), capped at saturation
+    rh = np.exp(_MAGNUS_B * td / (_MAGNUS_C + td) - _MAGNUS_B * t / (_MAGNUS_C + t))
+    rh = np.minimum(rh, 1.0)
+    # 1 − c = 0.45 + 0.55·RH/100
+    thi = 1.8 * t + 32.0 - (1.0 - (0.45 + 0.55 * rh)) * (1.8 * t - 26.0)
+    np.copyto(out, (thi - 32.0 - 26.0 * c0) / (1.8 * (1.0 - c0)), casting="same_kind")
+
+
+def thi_temperature(
+    temp: np.ndarray,
+    dew: np.ndarray,
+    *,
+    rh_ref: float = RH_REF,
+    out: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """THI‑equivalent temperature (°C) from 2 m temperature and dewpoint.
+
+    Works one slab of the leading axis at a time, so the float64
+    temporaries stay the size of one day rather than the whole block.
+    *out* may be *temp* itself to convert in place; the result keeps the
+    temperature dtype. NaN in either input gives NaN.
+    """
+    if temp.shape != dew.shape:
+        raise ValueError(f"temperature {temp.shape} and dewpoint {dew.shape} differ in shape")
+    out = _check_out(out, temp.shape, temp.dtype)
+    if temp.ndim == 0:
+        _thi_slab(np.float64(temp), np.float64(dew), rh_ref, out)
+        return out
+    for i in range(temp.shape[0]):
+        _thi_slab(temp[i].astype(float), dew[i].astype(float), rh_ref, out[i])
+    return out
+
+
+def _self_tests() -> None:  # pragma: no cover – light runtime checks
+    """Every installed backend fills the passed *out*; bad LIVWD_KERNEL values fall back."""
+    global _active, available_backends
+
+    rng    = np.random.default_rng(0)
+    temp   = rng.uniform(0, 50, (4, 6, 8))
+    temp[0, 0, :3] = np.nan
+    dens   = rng.uniform(0, 500, (3, 6, 8))
+    knots  = (15.0, 25.0, 35.0)
+    base   = rng.uniform(10, 60, 3)
+    slopes = rng.uniform(0, 2, (3, 2))
+    segs   = [np.clip(temp, lo, hi) - lo for lo, hi in zip(knots[:-1], knots[1:])]
+    ref    = np.stack([(base[s] + sum(slopes[s, k] * segs[k] for k in range(2))) * dens[s] / 1e3
+                       for s in range(3)])
+    A, B   = rng.uniform(0, 100, (6, 8)), rng.uniform(0, 5, (2, 6, 8))
+    ref_t  = A + sum(B[k] * np.clip(temp, lo, hi) for k, (lo, hi) in enumerate(zip(knots[:-1], knots[1:])))
+
+    for backend in available_backends():
+        for dtype in ("float64", "float32"):
+            t, d = temp.astype(dtype), dens.astype(dtype)
+            out  = np.full(ref.shape, -1.0, dtype=dtype)
+            res  = fused_withdrawal(t, d, base, slopes, knots=knots, divisor=1e3, out=out, backend=backend)
+            assert res is out, f"{backend}: fused result is not the passed out"
+            assert np.allclose(out, ref, rtol=1e-5, equal_nan=True), f"{backend} {dtype}: fused values"
+            assert np.isnan(out[:, 0, 0, :3]).all() and not np.isnan(out[:, 1:]).any(), f"{backend}: NaN"
+            out  = np.full(ref_t.shape, -1.0, dtype=dtype)
+            res  = total_withdrawal(t, A.astype(dtype), B.astype(dtype), knots=knots, out=out, backend=backend)
+            assert res is out, f"{backend}: total result is not the passed out"
+            assert np.allclose(out, ref_t, rtol=1e-5, equal_nan=True), f"{backend} {dtype}: total values"
+
+    env, active, available = os.environ.get("LIVWD_KERNEL"), _active, available_backends
+    try:
+        for value in ("cuda", "", "NumPy "):
+            _active, os.environ["LIVWD_KERNEL"] = None, value
+            assert get_backend() == "numpy", f"LIVWD_KERNEL={value!r}"
+        available_backends = lambda: ["numpy"]            # numba and numexpr not installed
+        for value in ("numba", "numexpr"):
+            _active, os.environ["LIVWD_KERNEL"] = None, value
+            assert get_backend() == "numpy", f"LIVWD_KERNEL={value!r} without the package"
+        try:
+            set_backend("cuda")
+            raise AssertionError("unknown --backend accepted")
+        except ValueError:
+            pass
+    finally:
+        available_backends, _active = available, active
+        if env is None:
+            os.environ.pop("LIVWD_KERNEL", None)
+        else:
+            os.environ["LIVWD_KERNEL"] = env
+    print("✅ kernels self‑tests passed.")
+
+
+__all__ = [
+    "BACKENDS",
+    "available_backends",
+    "set_backend",
+    "get_backend",
+    "default_threads",
+    "set_num_threads",
+    "fused_withdrawal",
+    "total_withdrawal",
+    "thi_temperature",
+    "RH_REF",
+]
+
+
+if __name__ == "__main__":  # pragma: no cover
+    _self_tests()
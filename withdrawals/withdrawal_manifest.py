@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""Run manifest of the yearly driver: what was written, from what, and is it still valid.
+
+Skipping a year because its file exists is not enough: a job killed
+mid‑write leaves a truncated file that looks complete, and a file built
+from an older t2m file, density product or withdrawal table looks the
+same as a current one. ``<out_dir>/manifest.json`` records every output
+(a year file, or one tile with ``--hires``):
+
+* ``status`` – ``running`` while it is written, then ``done`` or
+  ``failed`` (an entry left ``running`` is a killed job);
+* ``inputs`` – a fingerprint of each input file (:pyfunc:`file_fingerprint`:
+  size and SHA‑256 of the whole file; the t2m cubes are tens of GB, so
+  the digest is cached by size and mtime and re‑read only after a change);
+* ``coefficients`` – ``water_withdrawal.coefficients_version()``;
+* ``options`` – the run options that change the numbers or the encoding;
+* ``bytes`` / ``sha256`` of the finished file;
+* ``blocks`` – while it runs with ``--checkpoint``, the months already
+  committed (:pyfunc:`RunManifest.block_done`, see withdrawal_checkpoint.py).
+
+:pyfunc:`RunManifest.is_valid` skips exactly the outputs whose record
+matches the current inputs, coefficients and options and whose file is
+still the one recorded (size; also the hash with ``verify=True``).
+Outputs are written under a hidden ``.<name>.part`` name and renamed into
+place (:pyfunc:`part_path`), so a file under its final name is complete.
+
+Several ``srun`` tasks share one manifest: each update re‑reads it under
+an exclusive ``flock`` and replaces it atomically. Inputs are hashed
+under that lock too, so on a first run one task reads the t2m cube while
+the others wait and then take its digest from the cache, instead of
+every task reading tens of GB at once.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import socket
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterable, Iterator, Mapping, Optional
+
+MANIFEST_FILE = "manifest.json"
+LOCK_FILE     = ".manifest.lock"
+
+
+def part_path(path: Path) -> Path:
+    """Hidden name an output is written under before it is renamed to *path*."""
+    path = Path(path)
+    return path.with_name(f".{path.name}.part")
+
+
+def file_sha256(path: Path, block: int = 16 * 2**20) -> str:
+    """SHA‑256 of the whole file."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(block):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def file_fingerprint(path: Path, cache: Optional[Mapping[str, dict]] = None) -> dict:
+    """``{"bytes", "mtime_ns", "sha256"}`` of an input file (a directory: of its files).
+
+    A file whose size and mtime match its *cache* entry is not re‑read;
+    any other file is hashed in full, so an in‑place edit of the same size
+    is still seen.
+    """
+    path = Path(path)
+    if path.is_dir():
+        files = {p.name: file_fingerprint(p, cache) for p in sorted(path.iterdir()) if p.is_file()}
+        digest = hashlib.sha256(json.dumps(files, sort_keys=True).encode()).hexdigest()
+        return dict(bytes=sum(f["bytes"] for f in files.values()), mtime_ns=0, sha256=digest)
+    st  = path.stat()
+    old = (cache or {}).get(str(path))
+    if old and "sha256" in old and old["bytes"] == st.st_size and old["mtime_ns"] == st.st_mtime_ns:
+        return dict(old)
+    return dict(bytes=st.st_size, mtime_ns=st.st_mtime_ns, sha256=file_sha256(path))
+
+
+def fingerprint_paths(paths: Iterable[Path], cache: Optional[Mapping[str, dict]] = None) -> tuple:
+    """``(fingerprints, files)`` of *paths* (files or directories).
+
+    *files* holds the fingerprint of every regular file read on the way,
+    for the caller to keep as the *cache* of the next call.
+    """
+    paths = [Path(p) for p in paths]
+    files = [f for p in paths for f in (sorted(p.iterdir()) if p.is_dir() else [p]) if f.is_file()]
+    seen  = {str(f): file_fingerprint(f, cache) for f in files}
+    found = {str(p): file_fingerprint(p, {**(cache or {}), **seen}) for p in paths}
+    return found, seen
+
+
+class RunManifest:
+    """The ``manifest.json`` of one output directory.
+
+    *options* and *coefficients* are those of the current run; every
+    record is compared against them. *verify* re‑hashes finished outputs
+    before skipping them; *force* recomputes everything (still recorded).
+    """
+
+    def __init__(self, out_dir: Path, options: Mapping, coefficients: str,
+                 verify: bool = False, force: bool = False):
+        self.out_dir      = Path(out_dir)
+        self.path         = self.out_dir / MANIFEST_FILE
+        self.options      = json.loads(json.dumps(dict(options), default=str))
+        self.coefficients = coefficients
+        self.verify       = verify
+        self.force        = force
+        self._inputs: dict = {}
+
+    # ── storage ───────────────────────────────────────────────────────────
+    def read(self) -> dict:
+        try:
+            return json.loads(self.path.read_text())
+        except FileNotFoundError:
+            return {"outputs": {}, "fingerprints": {}}
+
+    @contextmanager
+    def _update(self) -> Iterator[dict]:
+        """Read, modify and atomically replace the manifest under an exclusive lock."""
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        with open(self.out_dir / LOCK_FILE, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                data = self.read()
+                yield data
+                tmp = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+                tmp.write_text(json.dumps(data, indent=1, sort_keys=True))
+                os.replace(tmp, self.path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    # ── inputs ────────────────────────────────────────────────────────────
+    def fingerprint(self, paths: Iterable[Path]) -> dict:
+        """Fingerprints of *paths*, hashed at most once per run (and per file change).
+
+        Hashed under the manifest lock: tasks sharing the manifest wait for
+        the first one and reuse its cached digests.
+        """
+        paths = [str(p) for p in paths]
+        new   = [p for p in paths if p not in self._inputs]
+        if new:
+            with self._update() as data:
+                found, seen = fingerprint_paths(new, data.get("fingerprints", {}))
+                data.setdefault("fingerprints", {}).update(seen)
+            self._inputs.update(found)
+        return {p: self._inputs[p] for p in paths}
+
+    # ── records ───────────────────────────────────────────────────────────
+    def _name(self, output: Path) -> str:
+        return str(Path(output).relative_to(self.out_dir))
+
+    def status(self, output: Path) -> Optional[str]:
+        rec = self.read()["outputs"].get(self._name(output))
+        return rec and rec["status"]
+
+    def _key_change(self, rec: dict, fingerprints: Mapping[str, dict]) -> Optional[str]:
+        """What differs between *rec* and this run (coefficients, options, inputs), if anything."""
+        if rec.get("coefficients") != self.coefficients:
+            return "withdrawal coefficients changed"
+        if rec.get("options") != self.options:
+            old     = rec.get("options") or {}
+            changed = sorted(k for k in {**old, **self.options} if old.get(k) != self.options.get(k))
+            return f"options changed ({', '.join(changed)})"
+        if {p: f.get("sha256") for p, f in rec.get("inputs", {}).items()} != \
+           {p: f["sha256"] for p, f in fingerprints.items()}:
+            return "inputs changed"
+        return None
+
+    def stale_reason(self, output: Path, inputs: Iterable[Path] = ()) -> Optional[str]:
+        """Why *output* has to be (re)computed, or None if its record is still valid."""
+        if self.force:
+            return "forced"
+        rec = self.read()["outputs"].get(self._name(output))
+        if rec is None:
+            return "not in manifest"
+        if rec["status"] != "done":
+            blocks = len(rec.get("blocks", []))
+            return f"status {rec['status']}" + (f", {blocks} block(s) committed" if blocks else "")
+        changed = self._key_change(rec, self.fingerprint(inputs))
+        if changed:
+            return changed
+        output = Path(output)
+        if not output.exists() or output.stat().st_size != rec["bytes"]:
+            return "output missing or changed"
+        if self.verify and file_sha256(output) != rec["sha256"]:
+            return "output checksum mismatch"
+        return None
+
+    def is_valid(self, output: Path, inputs: Iterable[Path] = ()) -> bool:
+        """True if *output* can be skipped; says why not when it has a stale record."""
+        reason = self.stale_reason(output, inputs)
+        if reason not in (None, "not in manifest", "forced"):
+            print(f"   ℹ️  {self._name(output)}: {reason} – recomputing", flush=True)
+        return reason is None
+
+    def start(self, output: Path, inputs: Iterable[Path] = ()) -> None:
+        """Mark *output* ``running``; committed blocks of an unfinished run with
+        the same coefficients, options and inputs are kept (not with *force*)."""
+        fingerprints = self.fingerprint(inputs)
+        with self._update() as data:
+            old    = data["outputs"].get(self._name(output)) or {}
+            blocks = [] if self.force or old.get("status") == "done" or \
+                     self._key_change(old, fingerprints) else old.get("blocks", [])
+            data["outputs"][self._name(output)] = dict(
+                status="running", inputs=fingerprints, coefficients=self.coefficients,
+                options=self.options, host=socket.gethostname(), pid=os.getpid(),
+                started=time.strftime("%Y-%m-%dT%H:%M:%S"), blocks=blocks)
+
+    def blocks(self, output: Path) -> list:
+        """Blocks of *output* committed so far (resumable after a restart)."""
+        rec = self.read()["outputs"].get(self._name(output)) or {}
+        return list(rec.get("blocks", []))
+
+    def block_done(self, output: Path, label: str) -> None:
+        with self._update() as data:
+            rec = data["outputs"][self._name(output)]
+            rec["blocks"] = sorted({*rec.get("blocks", []), label})
+
+    def done(self, output: Path) -> None:
+        output = Path(output)
+        digest = file_sha256(output)
+        with self._update() as data:
+            rec = data["outputs"][self._name(output)]
+            rec.pop("blocks", None)
+            rec.update(status="done", bytes=output.stat().st_size, sha256=digest,
+                       finished=time.strftime("%Y-%m-%dT%H:%M:%S"))
+
+    def failed(self, output: Path, error: BaseException) -> None:
+        with self._update() as data:
+            data["outputs"].setdefault(self._name(output), {}).update(
+                status="failed", error=repr(error), finished=time.strftime("%Y-%m-%dT%H:%M:%S"))
+
+    @contextmanager
+    def recording(self, output: Path, inputs: Iterable[Path] = ()) -> Iterator[None]:
+        """``running`` on entry, then ``done`` – or ``failed`` if the block raises."""
+        self.start(output, inputs)
+        try:
+            yield
+        except BaseException as exc:
+            self.failed(output, exc)
+            raise
+        self.done(output)
+
+
+def _self_tests() -> None:  # pragma: no cover – light runtime checks
+    """A record is valid until its output, inputs or options change."""
+    import tempfile
+    from concurrent.futures import ThreadPoolExecutor
+
+    with tempfile.TemporaryDirectory() as tmp:
+        src, out = Path(tmp) / "in.nc", Path(tmp) / "out.nc"
+        src.write_bytes(b"t2m" * 2**20)
+        man = RunManifest(Path(tmp), {"model": "linear"}, "c0")
+        with man.recording(out, [src]):
+            out.write_bytes(b"wd" * 1000)
+        assert man.is_valid(out, [src]), "manifest: done"
+        assert not RunManifest(Path(tmp), {"model": "piecewise"}, "c0").is_valid(out, [src]), "options"
+        assert not RunManifest(Path(tmp), {"model": "linear"}, "c1").is_valid(out, [src]), "coefficients"
+        data = bytearray(src.read_bytes())
+        data[2**20 + 7] ^= 1                         # same size, away from head and tail
+        src.write_bytes(bytes(data))
+        assert not RunManifest(Path(tmp), {"model": "linear"}, "c0").is_valid(out, [src]), "in-place edit"
+        man = RunManifest(Path(tmp), {"model": "linear"}, "c0")     # inputs are hashed once per run
+        with man.recording(out, [src]):
+            out.write_bytes(b"wd" * 1000)
+        out.write_bytes(b"wd")
+        assert man.stale_reason(out, [src]) == "output missing or changed", "truncated output"
+
+        # tasks starting together hash a new input once, the others wait for it
+        global file_sha256
+        sha, calls = file_sha256, []
+        file_sha256 = lambda path, *a: calls.append(path) or sha(path, *a)
+        try:
+            src.write_bytes(b"T2M" * 2**20)
+            tasks = [RunManifest(Path(tmp), {"model": "linear"}, "c0") for _ in range(4)]
+            with ThreadPoolExecutor(4) as pool:
+                prints = list(pool.map(lambda m: m.fingerprint([src]), tasks))
+        finally:
+            file_sha256 = sha
+        assert len(calls) == 1, f"input hashed {len(calls)} times"
+        assert all(p == prints[0] for p in prints), "tasks disagree on the fingerprint"
+    print("✅ manifest self‑tests passed.")
+
+
+__all__ = [
+    "MANIFEST_FILE",
+    "part_path",
+    "file_sha256",
+    "file_fingerprint",
+    "fingerprint_paths",
+    "RunManifest",
+]
+
+
+if __name__ == "__main__":  # pragma: no cover
+    _self_tests()
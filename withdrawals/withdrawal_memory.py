@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""Memory budget → dask chunks and thread count for the yearly driver.
+
+The job scripts ask for 32–64 GB by trial and error. Here the budget is
+read from the allocation (:pyfunc:`memory_limit`: ``SLURM_MEM_PER_NODE``,
+``SLURM_MEM_PER_CPU`` × CPUs, the cgroup limit, else physical memory)
+and the peak of one run is predicted from the shapes and dtypes:
+
+    peak ≈ baseline + density maps + HDF5 chunk caches + threads · per_task
+
+``per_task`` is one dask block of the inputs (t2m, d2m; in ``--hourly``
+the one day of 24 hours a task reduces to daily means), kernel scratch,
+and the stacked output block of every
+variable (× density sources) plus the copy written to HDF5; see
+:pyfunc:`predict_peak`. The chunk cache term is the surprise: netCDF‑C
+gives every variable a 64 MB cache, so eight species held ~0.5 GB of
+already‑compressed output whatever the chunking. :pyfunc:`plan_chunks`
+sizes it to one dask block per variable instead (:pyfunc:`set_hdf5_cache`),
+which is all a write ever touches.
+
+The default block (31 days × 90 rows) and all threads are kept when
+they fit. Otherwise threads go first – the run is bound by the
+compressed write, which holds a lock anyway – and only on one thread do
+rows, then days shrink (the output is then chunked on disk like the
+blocks, so each HDF5 chunk is still written once). The driver logs
+the prediction next to the measured peak RSS (:pyfunc:`peak_rss`) after
+every year.
+
+:pyfunc:`_self_tests` runs a 1° cube in a fresh process and requires the
+measured peak to stay within ``PEAK_TOLERANCE`` above the prediction;
+with ``BUDGET_FRACTION`` that keeps a planned run inside its allocation.
+Small grids, where libraries and the dask graph outweigh the blocks, can
+miss by more (~30 % on a 36 × 72 test grid).
+"""
+
+import os
+import resource
+from pathlib import Path
+from typing import Mapping, NamedTuple, Optional
+
+
+BUDGET_FRACTION = 0.8             # of the allocation; the rest is HDF5/dask slack
+TASK_OVERHEAD   = 1.25            # dask copies / views around each block (fitted)
+KERNEL_SCRATCH  = 2               # compute-dtype buffers per block (fused_withdrawal)
+PEAK_TOLERANCE  = 0.25            # measured peak ≤ (1 + this) × predicted (_self_tests)
+
+_CGROUP_LIMITS = (Path("/sys/fs/cgroup/memory.max"),                     # v2
+                  Path("/sys/fs/cgroup/memory/memory.limit_in_bytes"))   # v1
+
+
+def _physical_memory() -> int:
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+
+def memory_limit() -> int:
+    """Bytes available to this job.
+
+    ``SLURM_MEM_PER_NODE`` (MB), else ``SLURM_MEM_PER_CPU`` × CPUs per
+    task, else the cgroup limit, else physical memory; never more than
+    physical memory.
+    """
+    phys = _physical_memory()
+    if os.environ.get("SLURM_MEM_PER_NODE"):
+        return min(int(os.environ["SLURM_MEM_PER_NODE"]) * 2**20, phys)
+    if os.environ.get("SLURM_MEM_PER_CPU"):
+        cpus = int(os.environ.get("SLURM_CPUS_PER_TASK", 1))
+        return min(int(os.environ["SLURM_MEM_PER_CPU"]) * cpus * 2**20, phys)
+    for path in _CGROUP_LIMITS:
+        try:
+            text = path.read_text().strip()
+        except OSError:
+            continue
+        if text.isdigit():                # "max" (v2) means unlimited
+            return min(int(text), phys)
+    return phys
+
+
+def peak_rss() -> int:
+    """Peak resident set size of this process so far, in bytes (Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def current_rss() -> int:
+    """Resident set size now, in bytes (falls back to the peak)."""
+    try:
+        pages = int(Path("/proc/self/statm").read_text().split()[1])
+    except (OSError, IndexError, ValueError):
+        return peak_rss()
+    return pages * os.sysconf("SC_PAGE_SIZE")
+
+
+def set_hdf5_cache(nbytes: int) -> None:
+    """Chunk cache (bytes) of every netCDF variable created from now on.
+
+    Only the netCDF4 engine has a process‑wide setting; without netCDF4
+    xarray writes through h5netcdf with h5py's own (1 MB) cache.
+    """
+    try:
+        import netCDF4
+    except ImportError:
+        return
+    size, nelems, preemption = netCDF4.get_chunk_cache()
+    netCDF4.set_chunk_cache(int(nbytes), nelems, preemption)
+
+
+class Plan(NamedTuple):
+    """Dask chunks, threads and HDF5 cache per variable; predicted peak and budget (bytes)."""
+
+    chunks: dict
+    threads: int
+    cache: int
+    predicted: int
+    budget: int
+
+    def describe(self) -> str:
+        return (f"{self.threads} threads, chunks of {self.chunks['time']} days × "
+                f"{self.chunks['lat']} rows, {self.cache / 2**20:.0f} MB HDF5 cache per variable "
+                f"→ predicted peak {self.predicted / 2**30:.2f} GB of {self.budget / 2**30:.2f} GB")
+
+
+def predict_peak(
+    chunks: Mapping[str, int],
+    threads: int,
+    sizes: Mapping[str, int],
+    nvars: int,
+    nspecies: int = 8,
+    in_itemsize: int = 4,
+    out_itemsize: int = 8,
+    n_inputs: int = 1,
+    hours: int = 1,
+    nsources: int = 1,
+    density_maps: int = 1,
+    cache: int = 0,
+    baseline: int = 0,
+) -> int:
+    """Predicted peak RSS (bytes) of one year.
+
+    *sizes* are the grid sizes (``lat``, ``lon``); *nvars* output variables
+    (1 for ``--total-only``) on *nsources* density sources, *n_inputs*
+    input fields (2 with d2m) of *hours* steps a day; with ``hours > 1``
+    a task reads one day of them at a time. *density_maps* is 2
+    for ``--density linear``. *cache* is the HDF5 chunk cache of each
+    output variable and *baseline* the RSS before the run.
+    """
+    cells   = min(chunks["lat"], sizes["lat"]) * sizes["lon"]
+    block   = chunks["time"] * cells
+    inputs  = n_inputs * in_itemsize * (hours * cells if hours > 1 else block)
+    task    = inputs + block * (KERNEL_SCRATCH + nvars * nsources + 1) * out_itemsize
+    density = nspecies * nsources * density_maps * sizes["lat"] * sizes["lon"] * 8
+    return int(baseline + density + nvars * cache + threads * TASK_OVERHEAD * task)
+
+
+def _aligned_rows(nlat: int, step: int) -> list:
+    """Row counts to try, largest first: divisors of *step* up to *nlat*."""
+    rows = [r for r in range(step, 0, -1) if step % r == 0]
+    return [r for r in rows if r <= nlat] or [nlat]
+
+
+def plan_chunks(
+    sizes: Mapping[str, int],
+    nvars: int,
+    threads: int,
+    chunks: Mapping[str, int],
+    budget: Optional[int] = None,
+    fixed_threads: bool = False,
+    fixed_chunks: bool = False,
+    fixed_rows: bool = False,
+    **shape,
+) -> Plan:
+    """Largest chunks ≤ *chunks* and most threads ≤ *threads* that fit *budget*.
+
+    The HDF5 cache of each variable holds one block. *budget* defaults
+    to :pyfunc:`memory_limit` × ``BUDGET_FRACTION``. Threads shrink
+    first, then – on one thread – rows (through divisors of *chunks*)
+    and days. *fixed_chunks* and *fixed_threads* keep what the user
+    asked for; *fixed_rows* shrinks days only. If nothing fits, the
+    smallest plan is returned and its prediction shows by how much it
+    overshoots. *shape* is passed to :pyfunc:`predict_peak`.
+    """
+    budget = int(memory_limit() * BUDGET_FRACTION) if budget is None else int(budget)
+    shape.setdefault("baseline", current_rss())
+    days   = [chunks["time"]] if fixed_chunks else \
+             [d for d in (chunks["time"], 16, 8, 4, 2, 1) if d <= chunks["time"]]
+    rows   = [chunks["lat"]] if fixed_chunks or fixed_rows else _aligned_rows(sizes["lat"], chunks["lat"])
+    counts = [threads] if fixed_threads else list(range(threads, 0, -1))
+    plan   = None
+    for n, d, r in [(n, days[0], rows[0]) for n in counts] + \
+                   [(counts[-1], d, r) for d in days for r in rows][1:]:
+        c     = {"time": d, "lat": r}
+        cache = d * min(r, sizes["lat"]) * sizes["lon"] * shape.get("out_itemsize", 8) * shape.get("nsources", 1)
+        plan  = Plan(c, n, cache, predict_peak(c, n, sizes, nvars, cache=cache, **shape), budget)
+        if plan.predicted <= budget:
+            return plan
+    return plan
+
+
+def _measure(path: str, out_dir: str, threads: int, tight: bool) -> None:  # pragma: no cover
+    """Plan and write one year of the t2m cube at *path*, print plan and peak as JSON.
+
+    Run by :pyfunc:`_self_tests` in a fresh process, so :pyfunc:`peak_rss`
+    is this run's. *tight* sets the budget just above one thread on half
+    the default rows.
+    """
+    import json
+
+    import numpy as np
+    import xarray as xr
+    from water_withdrawal_yearly import CHUNKS, NAME_MAP, configure_threads, run_year
+
+    t2m   = xr.open_dataarray(path)
+    rng   = np.random.default_rng(0)
+    dens  = xr.Dataset({v: (("year", "lat", "lon"), rng.uniform(0, 500, (1, *t2m.shape[1:])))
+                        for v in NAME_MAP},
+                       coords={"year": np.array(["2019-01-01"], dtype="datetime64[ns]"),
+                               "lat": t2m.lat, "lon": t2m.lon})
+    sizes = {"lat": t2m.sizes["lat"], "lon": t2m.sizes["lon"]}
+    shape = dict(nspecies=len(NAME_MAP), in_itemsize=t2m.dtype.itemsize, baseline=current_rss())
+    half  = {"time": CHUNKS["time"], "lat": CHUNKS["lat"] // 2}
+    cache = half["time"] * half["lat"] * sizes["lon"] * 8
+    plan  = plan_chunks(sizes, len(NAME_MAP), threads, CHUNKS,
+                        budget=predict_peak(half, 1, sizes, len(NAME_MAP), cache=cache, **shape) + 1
+                        if tight else 2**40, **shape)
+    configure_threads(plan.threads)
+    set_hdf5_cache(plan.cache)
+    run_year(2019, t2m.chunk(plan.chunks), dens, out_dir=Path(out_dir))
+    print(json.dumps(dict(plan._asdict(), peak=peak_rss())))
+
+
+def _self_tests() -> None:  # pragma: no cover – light runtime checks
+    """Threads, then rows, then days shrink to fit; measured peaks stay near the prediction."""
+    import json
+    import subprocess
+    import sys
+    import tempfile
+
+    import numpy as np
+    import xarray as xr
+
+    sizes = {"lat": 180, "lon": 360}
+    shape = dict(nspecies=8, baseline=0)
+    full  = {"time": 31, "lat": 90}
+
+    def peak(chunks, threads):
+        cache = chunks["time"] * chunks["lat"] * sizes["lon"] * 8
+        return predict_peak(chunks, threads, sizes, 8, cache=cache, **shape)
+
+    def plan(budget, **kwargs):
+        p = plan_chunks(sizes, 8, 4, full, budget=budget, **shape, **kwargs)
+        return p.threads, p.chunks["time"], p.chunks["lat"]
+
+    assert plan(2**40) == (4, 31, 90), "room for everything"
+    assert plan(peak(full, 3)) == (3, 31, 90), "threads go first"
+    assert plan(peak(full, 1) - 1) == (1, 31, 45), "then rows, by divisors"
+    assert plan(peak({"time": 16, "lat": 90}, 1), fixed_rows=True) == (1, 16, 90), "fixed rows: days"
+    assert plan(peak(full, 1) - 1, fixed_threads=True)[0] == 4, "fixed threads"
+    small = plan_chunks(sizes, 8, 4, full, budget=1, **shape)
+    assert (small.threads, small.chunks) == (1, {"time": 1, "lat": 1}) and small.predicted > 1, "nothing fits"
+    for budget in (peak(full, 2), peak(full, 1) // 2, peak({"time": 4, "lat": 9}, 1)):
+        assert plan_chunks(sizes, 8, 4, full, budget=budget, **shape).predicted <= budget, "within budget"
+
+    # measured against predicted, each run in its own process
+    with tempfile.TemporaryDirectory() as tmp:
+        rng  = np.random.default_rng(0)
+        days = np.arange("2019-01-01", "2019-03-04", dtype="datetime64[D]").astype("datetime64[ns]")
+        xr.DataArray(rng.uniform(-10, 45, (days.size, 180, 360)).astype("float32"),
+                     dims=("time", "lat", "lon"), name="t2m",
+                     coords={"time": days, "lat": np.arange(89.5, -90, -1.0),
+                             "lon": np.arange(-179.5, 180, 1.0)}).to_netcdf(f"{tmp}/t2m.nc")
+        for threads, tight in ((2, False), (2, True)):
+            out = subprocess.run([sys.executable, "-c", "import withdrawal_memory as m; "
+                                  f"m._measure({tmp + '/t2m.nc'!r}, {tmp!r}, {threads}, {tight})"],
+                                 cwd=Path(__file__).resolve().parent, capture_output=True, text=True)
+            assert out.returncode == 0, out.stderr
+            run = json.loads(out.stdout.splitlines()[-1])
+            if tight:
+                assert (run["threads"], run["chunks"]["lat"]) == (1, 45), f"tight plan {run}"
+            print(f"   {run['threads']} threads, {run['chunks']}: predicted "
+                  f"{run['predicted'] / 2**30:.3f} GB, measured {run['peak'] / 2**30:.3f} GB")
+            assert run["peak"] <= (1 + PEAK_TOLERANCE) * run["predicted"], "peak above the prediction"
+            assert run["peak"] <= run["budget"] / BUDGET_FRACTION, "peak above the allocation"
+    print("✅ memory self‑tests passed.")
+
+
+__all__ = [
+    "BUDGET_FRACTION",
+    "memory_limit",
+    "peak_rss",
+    "current_rss",
+    "set_hdf5_cache",
+    "Plan",
+    "predict_peak",
+    "plan_chunks",
+]
+
+
+if __name__ == "__main__":  # pragma: no cover
+    _self_tests()
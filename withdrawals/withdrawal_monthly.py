@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""Monthly withdrawals from ERA5‑Land monthly‑mean t2m (1971–1979 backfill).
+
+``ERA5_temp/download_era5.py`` fetches monthly means for 1971–2020, but the
+daily files start in 1980. The curves are piecewise linear, so a month is
+exactly described by its valid days and the monthly sums of
+``clip(T, x_k, x_k+1) − x_k`` (see ``withdrawal_stats``). From a monthly
+mean ``Tm`` alone those sums are approximated as
+
+    clip_sum_k ≈ ndays · clamp(clip(Tm, x_k, x_k+1) − x_k + off_k, 0, x_k+1 − x_k)
+
+where ``off_k(month, lat, lon)`` is the average gap between the daily
+mean clip and the clip of the monthly mean over 1980–2019
+(:pyfunc:`learn_offsets`, from the statistics cache and the monthly means
+of the same years). Without offsets the day‑to‑day spread around the
+knots is ignored. :pyfunc:`monthly_stats` builds a statistics dataset,
+and ``withdrawal_from_stats`` turns it into the usual ``<animal>_wd`` maps,
+one step per month (m³ cell⁻¹ month⁻¹), 12 steps a year instead of 365.
+
+Output files are named and laid out like the daily ones
+(``Liv_WD_<year>.nc``, ``<animal>_wd``) and go to the same directory,
+``liv_wd_yearly_regrid`` by default. In both, a time step holds the
+volume withdrawn over that step (a day there, a month here), so the
+analysis scripts get monthly and annual totals by summing over ``time``
+for either kind of file. A file without ``time_resolution="monthly"`` (a
+daily year) is never overwritten. Writes go through ``.part`` names and
+the run manifest, as in the yearly driver.
+
+The monthly means must be on the grid of the statistics (regridded like
+the daily t2m).
+
+Usage
+-----
+python withdrawal_monthly.py --learn 1980 2019     # offsets from the stats cache
+python withdrawal_monthly.py --start 1971 --end 1979
+"""
+
+import argparse
+import os
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import xarray as xr
+
+from withdrawal_manifest import RunManifest, part_path
+from withdrawal_stats import STATS_KNOTS, withdrawal_from_stats
+
+MONTHLY_RESOLUTION = "monthly"      # ``time_resolution`` attribute of the files written here
+
+
+# ── inputs ────────────────────────────────────────────────────────────────
+
+def open_monthly_means(path: Path) -> xr.DataArray:
+    """Monthly‑mean t2m (°C) on month‑start time stamps."""
+    t2m = xr.open_dataset(path)
+    if "valid_time" in t2m.dims:
+        t2m = t2m.rename({"valid_time": "time"})
+    t2m = t2m["t2m"]
+    t2m = t2m.assign_coords(time=t2m.time.values.astype("datetime64[M]").astype("datetime64[ns]"))
+    if t2m.attrs.get("units") == "K":
+        t2m = (t2m - 273.15).assign_attrs(units="degC")
+    return t2m
+
+
+def _monthly_clip(tm: xr.DataArray) -> xr.DataArray:
+    """``clip(Tm, x_k, x_k+1) − x_k`` per stats segment, ``(time, segment, …)``."""
+    segs = [(tm.clip(lo, hi) - lo).astype("float64") for lo, hi in zip(STATS_KNOTS[:-1], STATS_KNOTS[1:])]
+    return xr.concat(segs, dim="segment").transpose("time", "segment", ...)
+
+
+# ── correction ────────────────────────────────────────────────────────────
+
+def learn_offsets(stats: xr.Dataset, tm: xr.DataArray) -> xr.DataArray:
+    """Mean daily‑clip minus clip‑of‑mean per calendar month, segment and cell.
+
+    *stats* are daily statistics (``withdrawal_stats.clip_stats``) and *tm*
+    the monthly means of the same months; only months present in both and
+    with at least one valid day count.
+    """
+    if tm.sizes["lat"] != stats.sizes["lat"] or tm.sizes["lon"] != stats.sizes["lon"]:
+        raise ValueError("monthly means and statistics are on different grids")
+    tm = tm.assign_coords(lat=stats.lat, lon=stats.lon)
+    stats, tm = xr.align(stats, tm, join="inner", exclude=["lat", "lon"])
+    if not stats.sizes["time"]:
+        raise ValueError("no month in common between statistics and monthly means")
+
+    ndays = stats["ndays"].where(stats["ndays"] > 0)
+    gap   = stats["clip_sum"] / ndays - _monthly_clip(tm)
+    off   = gap.groupby("time.month").mean("time").fillna(0.0)
+    off.attrs = dict(units="degC", long_name="mean daily clip minus clip of monthly mean",
+                     knots=list(STATS_KNOTS),
+                     period=f"{int(stats.time.dt.year.min())}-{int(stats.time.dt.year.max())}")
+    return off.rename("clip_offset")
+
+
+def monthly_stats(tm: xr.DataArray, offsets: Optional[xr.DataArray] = None) -> xr.Dataset:
+    """Statistics dataset (``ndays``, ``clip_sum``) approximated from monthly means."""
+    ndays = (tm.time.dt.days_in_month * tm.notnull()).astype("int16")
+    clip  = _monthly_clip(tm)
+    if offsets is not None:
+        width = xr.DataArray(np.diff(STATS_KNOTS), dims="segment")
+        clip  = (clip + offsets.sel(month=tm.time.dt.month).drop_vars("month")).clip(0.0, width)
+    return xr.Dataset({"ndays": ndays, "clip_sum": (ndays * clip).transpose("time", "segment", ...)})
+
+
+def monthly_withdrawals(
+    tm: xr.DataArray,
+    density_ds: xr.Dataset,
+    name_map,
+    offsets: Optional[xr.DataArray] = None,
+    model: str = "linear",
+    units: str = "m3",
+) -> xr.Dataset:
+    """``<animal>_wd`` per month (m³ cell⁻¹ month⁻¹) from monthly means *tm*."""
+    ds = withdrawal_from_stats(monthly_stats(tm, offsets), density_ds, name_map,
+                               model=model, units=units, freq="month")
+    ds = ds.where(tm.notnull())                 # sea stays NaN, as in the daily files
+    ds.attrs = dict(time_resolution=MONTHLY_RESOLUTION, model=model,
+                    source="ERA5-Land monthly means",
+                    correction="clip offsets " + offsets.attrs.get("period", "") if offsets is not None
+                    else "none")
+    return ds
+
+
+# ── driver ────────────────────────────────────────────────────────────────
+
+def is_monthly_file(path: Path) -> bool:
+    """True if *path* was written by this module (not a daily year)."""
+    with xr.open_dataset(path) as ds:
+        return ds.attrs.get("time_resolution") == MONTHLY_RESOLUTION
+
+
+def main() -> None:
+    from water_withdrawal import MODELS, coefficients_version
+    from water_withdrawal_yearly import (DENS_FILE, NAME_MAP, OUT_DIR, SCRATCH, compression,
+                                         density_for_year, open_density)
+    from withdrawal_stats import open_stats
+
+    p = argparse.ArgumentParser(description="Monthly livestock withdrawals from monthly-mean t2m")
+    p.add_argument("--start", type=int, default=1971, help="first year (inclusive)")
+    p.add_argument("--end",   type=int, default=1979, help="last year (inclusive)")
+    p.add_argument("--t2m", type=Path, default=SCRATCH / "era5land_monthly" / "t2m_1971_2020.nc",
+                   help="monthly-mean t2m on the density grid")
+    p.add_argument("--stats-dir", type=Path, default=SCRATCH / "liv_wd_stats")
+    p.add_argument("--learn", type=int, nargs=2, metavar=("START", "END"), default=None,
+                   help="learn the offsets from the stats of these years and save them")
+    p.add_argument("--no-correction", dest="correct", action="store_false",
+                   help="use the plain monthly means")
+    p.add_argument("--model", choices=MODELS, default="linear")
+    p.add_argument("--out-dir", type=Path, default=OUT_DIR,
+                   help=f"output directory (default {OUT_DIR}, next to the daily years)")
+    p.add_argument("--verify", action="store_true",
+                   help="re-hash finished outputs against the manifest before skipping them")
+    p.add_argument("--force", action="store_true",
+                   help="recompute every output, whatever the manifest says")
+    args = p.parse_args()
+    tm_all   = open_monthly_means(args.t2m)
+    off_file = args.stats_dir / "clip_offsets.nc"
+
+    if args.learn:
+        off = learn_offsets(open_stats(args.stats_dir, *args.learn), tm_all)
+        off.to_netcdf(off_file, encoding={off.name: compression})
+        print(f"   ✔  offsets {off.attrs['period']} written → {off_file}", flush=True)
+        return
+
+    years   = range(args.start, args.end + 1)
+    daily   = [f for yr in years if (f := args.out_dir / f"Liv_WD_{yr}.nc").exists()
+               and not is_monthly_file(f)]
+    if daily:
+        raise SystemExit(f"❌  refusing to overwrite daily output(s): {', '.join(map(str, daily))} – "
+                         "check --start/--end or choose another --out-dir")
+
+    offsets  = xr.open_dataarray(off_file) if args.correct else None
+    inputs   = [args.t2m, DENS_FILE] + ([off_file] if args.correct else [])
+    manifest = RunManifest(args.out_dir, dict(time_resolution=MONTHLY_RESOLUTION, model=args.model,
+                                              correct=args.correct),
+                           coefficients_version(), verify=args.verify, force=args.force)
+    dens_ds = open_density()
+    first   = int(dens_ds.year.dt.year.min())
+    args.out_dir.mkdir(parents=True, exist_ok=True)
+    for yr in years:
+        out_file = args.out_dir / f"Liv_WD_{yr}.nc"
+        print(f"🔹 Year {yr}", flush=True)
+        if manifest.is_valid(out_file, inputs):
+            print(f"Year {yr} - output still valid, skipping.", flush=True)
+            continue
+        if yr < first:
+            print(f"   ⚠️  no {yr} density – using {first} maps", flush=True)
+        tm = tm_all.sel(time=slice(f"{yr}-01-01", f"{yr}-12-31"))
+        ds = monthly_withdrawals(tm, density_for_year(dens_ds, max(yr, first)), NAME_MAP,
+                                 offsets=offsets, model=args.model)
+        part = part_path(out_file)
+        with manifest.recording(out_file, inputs):
+            try:
+                ds.to_netcdf(part, encoding={v: compression for v in ds.data_vars})
+            except BaseException:
+                part.unlink(missing_ok=True)
+                raise
+            os.replace(part, out_file)
+        print(f"   ✔  written → {out_file}", flush=True)
+    print("🎉  All files done:", args.out_dir)
+
+
+def _self_tests() -> None:  # pragma: no cover – light runtime checks
+    """Monthly means + offsets learned on the same months reproduce the daily sums."""
+    from water_withdrawal import MODELS, _test_inputs
+    from withdrawal_stats import clip_stats
+
+    full, dens_ds, nm = _test_inputs(ntime=59)
+    full = full.assign_coords(time=np.arange("2019-01-01", "2019-03-01", dtype="datetime64[D]")) * 0.9
+    tm, stats = full.resample(time="MS").mean(), clip_stats(full)
+    for model in MODELS:
+        exact = withdrawal_from_stats(stats, dens_ds, nm, model=model)
+        fast  = monthly_withdrawals(tm, dens_ds, nm, offsets=learn_offsets(stats, tm), model=model)
+        assert all(np.allclose(fast[v].values, exact[v].values, rtol=1e-12) for v in exact), f"monthly {model}"
+        assert fast[f"{next(iter(nm))}_wd"].attrs["units"].endswith("month-1"), "monthly units"
+    print("✅ monthly self‑tests passed.")
+
+
+__all__ = [
+    "MONTHLY_RESOLUTION",
+    "open_monthly_means",
+    "learn_offsets",
+    "monthly_stats",
+    "monthly_withdrawals",
+    "is_monthly_file",
+]
+
+
+if __name__ == "__main__":
+    main()
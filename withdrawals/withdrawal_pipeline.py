@@ -0,0 +1,452 @@
+#!/usr/bin/env python3
+"""The workflow from download to figures as one dependency graph.
+
+The scripts of this repository are run by hand, in an order kept in
+people's heads. :data:`STAGES` declares each of them – command, working
+directory, the files it reads and writes, and the parameters that change
+its outputs – and :pyfunc:`run_pipeline` runs them as a DAG:
+
+* a stage depends on the stages that write one of its inputs (same path,
+  a file in an output directory, or overlapping globs) and on the stages
+  in ``after`` (order without a file between them);
+* independent stages run concurrently (``--jobs``), each logging to
+  ``<state dir>/logs/<stage>.log``;
+* a stage is rebuilt only when its key – command, parameters and the
+  fingerprints of its inputs (withdrawal_manifest.fingerprint_paths:
+  size + SHA‑256, cached by size and mtime) – differs from the last
+  successful run, or its outputs are missing or were changed since.
+
+The scripts themselves are inputs of their stage, so editing the
+withdrawal table reruns the yearly driver and what reads its files, but
+not the download or the regridding. The yearly driver keeps its own
+per‑year manifest, so a rerun recomputes only the years that changed.
+
+Files that no stage writes (the merged ``t2m_1980_2019.nc``, the density
+counts, the FAO maps copied into ``liv_density``) are sources: they must
+exist, and a change to them reruns what reads them.
+
+Usage
+-----
+python withdrawal_pipeline.py --list                # stages, edges and what is out of date
+python withdrawal_pipeline.py                       # run everything out of date
+python withdrawal_pipeline.py totals --jobs 4       # one target and what it needs
+python withdrawal_pipeline.py --dry-run --force regrid
+"""
+
+import argparse
+import fnmatch
+import glob
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Iterable, Mapping, NamedTuple, Optional, Sequence
+
+from water_withdrawal import coefficients_version
+from water_withdrawal_yearly import DENS_FILE, HOME, OUT_DIR, SCRATCH, T2M_FILE
+from withdrawal_manifest import fingerprint_paths
+
+ROOT       = Path(__file__).resolve().parent.parent      # this checkout
+GLWD       = HOME / "GLWD"                              # the checkout the job scripts point at
+STATE_FILE = SCRATCH / "pipeline" / "state.json"
+YEARS      = (1980, 2019)
+HARM_DIR   = SCRATCH / "liv_wd_yearly" / "Sabin" / "livestock"
+
+
+class Stage(NamedTuple):
+    """One script of the workflow and the files around it."""
+
+    name: str
+    cmd: Sequence[str]
+    cwd: Path = ROOT
+    inputs: Sequence[Path] = ()        # files, directories or globs read
+    outputs: Sequence[Path] = ()       # files, directories or globs written
+    params: Mapping = {}               # anything else that changes the outputs
+    after: Sequence[str] = ()          # stages to wait for without a file between them
+
+
+def _py(script: Path, *args) -> list:
+    return [sys.executable, "-u", str(script), *map(str, args)]
+
+
+def _convert(year: int, script: str, src: Path, dst: Path) -> Stage:
+    """GeoTIFF → 0.5° NetCDF with gdal (convert_liv*.sh)."""
+    return Stage(f"convert_{year}", ["bash", str(ROOT / script)], ROOT / Path(script).parent,
+                 inputs=[ROOT / script, src / "*Da.tif"], outputs=[dst / "*_0.5deg.nc"])
+
+
+def _rename(year: int) -> Stage:
+    """FAO Band1 → population_density, fao_<animal>_<year>.nc (rename_fao*.sh)."""
+    d = ROOT / "liv_density"
+    return Stage(f"rename_fao_{year}", ["bash", str(d / f"rename_fao{year}.sh")], d,
+                 inputs=[d / f"rename_fao{year}.sh", d / f"fao_density_{year}" / "*.nc"],
+                 outputs=[d / f"fao_density_renamed_{year}" / "fao_*.nc"])
+
+
+STAGES = [
+    Stage("download", _py(ROOT / "ERA5_temp" / "download_1971.py"), ROOT / "ERA5_temp",
+          inputs=[ROOT / "ERA5_temp" / "download_1971.py"],
+          outputs=[SCRATCH / "era5land_daily" / "era5land_t2m_dailymean_*.nc"]),
+    _convert(2010, "livestock_geotiff2010/convert_livestock.sh",
+             HOME / "livestock_geotiff", HOME / "livestock_netcdf"),
+    _convert(2015, "livestock_geotiff2015/convert_liv2015.sh",
+             GLWD / "livestock_geotiff2015" / "Da_tiffs2015", GLWD / "livestock_geotiff2015" / "liv_netcdf2015"),
+    _convert(2020, "livestock_geotiff2020/convert_liv2020.sh",
+             GLWD / "livestock_geotiff2020" / "Da_tiffs2020", GLWD / "livestock_geotiff2020" / "liv_netcdf2020"),
+    _rename(2010),
+    _rename(2015),
+    Stage("regrid", ["bash", str(ROOT / "liv_density" / "regrid.sh")], ROOT / "liv_density",
+          inputs=[ROOT / "liv_density" / "regrid.sh", ROOT / "liv_density" / "Liv_Pop_1980_2019.nc",
+                  ROOT / "liv_density" / "fao_density_renamed_2010" / "fao_cattle_2010.nc"],
+          outputs=[ROOT / "liv_density" / "Liv_Pop_1980_2019_regrid_con.nc"]),
+    Stage("yearly", _py(ROOT / "withdrawals" / "water_withdrawal_yearly.py", "--start", YEARS[0], "--end", YEARS[1]),
+          ROOT / "withdrawals",
+          inputs=[T2M_FILE, DENS_FILE, *sorted(p for p in (ROOT / "withdrawals").glob("*.py")
+                                               if p.name != Path(__file__).name)],
+          outputs=[OUT_DIR / "Liv_WD_*.nc"],
+          params=dict(years=YEARS, coefficients=coefficients_version()),
+          after=["download"]),
+    Stage("totals", _py(ROOT / "withdrawals_analysis" / "totglob.py", HARM_DIR, OUT_DIR,
+                        SCRATCH / "liv_wd_yearly" / "analysis" / "global_totals.png"),
+          inputs=[ROOT / "withdrawals_analysis" / "totglob.py", HARM_DIR / "withdrawal_*_????.nc",
+                  OUT_DIR / "Liv_WD_????.nc"],
+          outputs=[SCRATCH / "liv_wd_yearly" / "analysis" / "global_totals.png"]),
+    Stage("map_validation", _py(ROOT / "liv_density" / "map_validation.py"), ROOT / "liv_density",
+          inputs=[ROOT / "liv_density" / "map_validation.py",
+                  ROOT / "liv_density" / "Liv_Pop_1980_2019_regrid_con.nc",
+                  ROOT / "liv_density" / "fao_density_renamed_2010" / "fao_*.nc",
+                  ROOT / "liv_density" / "fao_density_renamed_2015" / "fao_*.nc"],
+          outputs=[ROOT / "liv_density" / "validation_summary.csv",
+                   ROOT / "liv_density" / "plots" / "*.png"]),
+    Stage("summary_validation", _py(ROOT / "validation" / "summary_validation.py", "--years", 2010, 2015, 2020,
+                                    "--root", SCRATCH / "fao_validation"),
+          inputs=[ROOT / "validation" / "summary_validation.py",
+                  SCRATCH / "fao_validation" / "plots*" / "validation_summary_*.csv"],
+          outputs=[SCRATCH / "fao_validation" / "plots*" / "*.png"]),
+]
+
+
+# ── graph ─────────────────────────────────────────────────────────────────
+
+def _overlaps(read: Path, written: Path) -> bool:
+    """True if *written* (file, directory or glob) covers *read*."""
+    r, w = str(read), str(written)
+    return (r == w or r.startswith(w.rstrip("/") + "/") or
+            fnmatch.fnmatchcase(r, w) or fnmatch.fnmatchcase(w, r))
+
+
+def dependencies(stages: Sequence[Stage]) -> dict:
+    """``{stage: [upstream stages]}`` from file overlaps and ``after``."""
+    names = {s.name for s in stages}
+    deps  = {}
+    for s in stages:
+        up = {o.name for o in stages if o is not s
+              for i in s.inputs for w in o.outputs if _overlaps(i, w)}
+        unknown = set(s.after) - names
+        if unknown:
+            raise ValueError(f"{s.name}: unknown stage(s) in after: {sorted(unknown)}")
+        deps[s.name] = sorted(up | set(s.after))
+    order, seen = [], set()
+
+    def visit(n: str, path: tuple) -> None:
+        if n in path:
+            raise ValueError(f"dependency cycle: {' → '.join(path + (n,))}")
+        if n not in seen:
+            for d in deps[n]:
+                visit(d, path + (n,))
+            seen.add(n)
+            order.append(n)
+
+    for s in stages:
+        visit(s.name, ())
+    return {n: deps[n] for n in order}            # topological order
+
+
+def with_upstream(deps: Mapping[str, list], targets: Iterable[str]) -> list:
+    """*targets* and everything they need, in topological order."""
+    need, todo = set(), list(targets)
+    while todo:
+        n = todo.pop()
+        if n not in deps:
+            raise ValueError(f"unknown stage '{n}'. Choose from {list(deps)}.")
+        if n not in need:
+            need.add(n)
+            todo += deps[n]
+    return [n for n in deps if n in need]
+
+
+# ── state ─────────────────────────────────────────────────────────────────
+
+def _expand(spec: Path) -> list:
+    """Files behind a file, directory or glob *spec*."""
+    spec = Path(spec)
+    if glob.has_magic(str(spec)):
+        return [Path(p) for p in sorted(glob.glob(str(spec))) if Path(p).is_file()]
+    if spec.is_dir():
+        return [p for p in sorted(spec.rglob("*")) if p.is_file()]
+    return [spec] if spec.exists() else []
+
+
+class PipelineState:
+    """Keys and output fingerprints of the last successful run of every stage."""
+
+    def __init__(self, path: Path = STATE_FILE):
+        self.path = Path(path)
+        try:
+            self.data = json.loads(self.path.read_text())
+        except FileNotFoundError:
+            self.data = {"stages": {}, "fingerprints": {}}
+
+    def fingerprint(self, specs: Iterable[Path]) -> dict:
+        """``{spec: {file: sha256}}`` of every spec."""
+        files = {str(spec): _expand(spec) for spec in specs}
+        found, seen = fingerprint_paths([f for fs in files.values() for f in fs], self.data["fingerprints"])
+        self.data["fingerprints"].update(seen)
+        return {spec: {str(f): found[str(f)]["sha256"] for f in fs} for spec, fs in files.items()}
+
+    def key(self, stage: Stage) -> str:
+        spec = dict(cmd=list(map(str, stage.cmd)), cwd=str(stage.cwd), params=stage.params,
+                    inputs=self.fingerprint(stage.inputs))
+        return hashlib.sha256(json.dumps(spec, sort_keys=True, default=str).encode()).hexdigest()
+
+    def stale_reason(self, stage: Stage) -> Optional[str]:
+        """Why *stage* has to run, or None if its outputs are up to date."""
+        rec = self.data["stages"].get(stage.name)
+        if rec is None:
+            return "never run"
+        if rec["key"] != self.key(stage):
+            return "inputs, command or parameters changed"
+        outputs = self.fingerprint(stage.outputs)
+        if any(not files for files in outputs.values()):
+            return "output missing"
+        if outputs != rec["outputs"]:
+            return "outputs changed since the last run"
+        return None
+
+    def record(self, stage: Stage, key: str) -> None:
+        self.data["stages"][stage.name] = dict(key=key, outputs=self.fingerprint(stage.outputs),
+                                               finished=time.strftime("%Y-%m-%dT%H:%M:%S"))
+        self.save()
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f".{self.path.name}.tmp")
+        tmp.write_text(json.dumps(self.data, indent=1, sort_keys=True))
+        os.replace(tmp, self.path)
+
+
+def missing_sources(stage: Stage, stages: Sequence[Stage]) -> list:
+    """Inputs of *stage* that do not exist and that no stage writes."""
+    return [str(i) for i in stage.inputs if not _expand(i) and
+            not any(_overlaps(i, w) for o in stages if o is not stage for w in o.outputs)]
+
+
+# ── runner ────────────────────────────────────────────────────────────────
+
+def _run_stage(stage: Stage, log_dir: Path) -> tuple:
+    log_dir.mkdir(parents=True, exist_ok=True)
+    log = log_dir / f"{stage.name}.log"
+    t0  = time.perf_counter()
+    with open(log, "w") as f:
+        rc = subprocess.run(list(map(str, stage.cmd)), cwd=stage.cwd, stdout=f,
+                            stderr=subprocess.STDOUT).returncode
+    return rc, time.perf_counter() - t0, log
+
+
+def run_pipeline(
+    stages: Sequence[Stage] = STAGES,
+    targets: Sequence[str] = (),
+    jobs: int = 1,
+    force: Sequence[str] = (),
+    dry_run: bool = False,
+    state: Optional[PipelineState] = None,
+) -> dict:
+    """Run the out‑of‑date stages among *targets* (default: all) and what they need.
+
+    Up to *jobs* stages run at once, each as soon as its upstream stages
+    have finished. *force* names stages to rebuild regardless. Returns
+    ``{stage: status}`` with status ``up to date``, ``done``, ``failed``,
+    ``skipped`` (an upstream stage failed) or ``would run`` (*dry_run*).
+    """
+    state  = state or PipelineState()
+    byname = {s.name: s for s in stages}
+    deps   = dependencies(stages)
+    order  = with_upstream(deps, targets or list(deps))
+    status: dict = {}
+
+    def decide(name: str) -> Optional[str]:
+        """Reason to run *name* now, or None; also settles skipped / up to date."""
+        up = [status[d] for d in deps[name] if d in status]
+        if any(s in ("failed", "skipped") for s in up):
+            status[name] = "skipped"
+            print(f"   ⏭  {name}: skipped (upstream failed)", flush=True)
+            return None
+        missing = missing_sources(byname[name], stages)
+        if missing:
+            status[name] = "failed"
+            print(f"   ⚠️  {name}: missing input(s) no stage writes: {', '.join(missing)}", flush=True)
+            return None
+        reason = ("forced" if name in force else
+                  "upstream would run" if dry_run and "would run" in up else
+                  state.stale_reason(byname[name]))
+        if reason is None:
+            status[name] = "up to date"
+            print(f"   ✔  {name}: up to date", flush=True)
+        return reason
+
+    print(f"🔗 pipeline: {len(order)} stage(s), {jobs} at a time", flush=True)
+    pending = list(order)
+    running: dict = {}
+    with ThreadPoolExecutor(max(jobs, 1)) as pool:
+        while pending or running:
+            ready = [n for n in pending if all(d in status for d in deps[n] if d in order)]
+            for name in ready:
+                if len(running) >= max(jobs, 1):
+                    break
+                pending.remove(name)
+                reason = decide(name)
+                if reason is None:
+                    continue
+                if dry_run:
+                    status[name] = "would run"
+                    print(f"   🔹 {name}: would run ({reason})", flush=True)
+                    continue
+                print(f"🔹 {name}: running ({reason})", flush=True)
+                key = state.key(byname[name])
+                running[pool.submit(_run_stage, byname[name], state.path.parent / "logs")] = (name, key)
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                name, key = running.pop(fut)
+                rc, seconds, log = fut.result()
+                if rc == 0:
+                    state.record(byname[name], key)       # main thread only
+                    status[name] = "done"
+                    print(f"   ✔  {name} done in {seconds:.0f} s", flush=True)
+                else:
+                    status[name] = "failed"
+                    print(f"   ⚠️  {name} failed (exit {rc}) – see {log}", flush=True)
+    state.save()
+    return status
+
+
+def describe(stages: Sequence[Stage] = STAGES, state: Optional[PipelineState] = None) -> None:
+    """Print every stage, its upstream stages and whether it is out of date."""
+    state = state or PipelineState()
+    deps  = dependencies(stages)
+    byname = {s.name: s for s in stages}
+    for name, up in deps.items():
+        missing = missing_sources(byname[name], stages)
+        reason  = (f"missing {', '.join(missing)}" if missing else
+                   state.stale_reason(byname[name]) or "up to date")
+        print(f"   {name:<20s} ← {', '.join(up) or '(sources)':<28s} {reason}", flush=True)
+
+
+def parse_args() -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="Run the livestock water-withdrawal workflow as a DAG")
+    p.add_argument("targets", nargs="*", help="stages to bring up to date (default: all)")
+    p.add_argument("--jobs", type=int, default=1, help="stages run at the same time")
+    p.add_argument("--force", nargs="+", default=[], metavar="STAGE",
+                   help="rebuild these stages even if they are up to date")
+    p.add_argument("--dry-run", action="store_true", help="show what would run, run nothing")
+    p.add_argument("--list", action="store_true", help="list stages, edges and their state")
+    p.add_argument("--state", type=Path, default=STATE_FILE,
+                   help=f"state file (default {STATE_FILE}); logs go next to it")
+    return p.parse_args()
+
+
+def main() -> None:
+    args  = parse_args()
+    state = PipelineState(args.state)
+    if args.list:
+        describe(STAGES, state)
+        return
+    status = run_pipeline(STAGES, args.targets, args.jobs, args.force, args.dry_run, state)
+    if any(s in ("failed", "skipped") for s in status.values()):
+        raise SystemExit(1)
+    print("🎉  pipeline up to date", flush=True)
+
+
+def _self_tests() -> None:  # pragma: no cover – light runtime checks
+    """Run order, reruns after a change and skips on small fake stages."""
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        runs = tmp / "runs.txt"
+
+        def step(name, inputs=(), output=None, after=(), fail=False):
+            """Stage that logs its name and writes its inputs, concatenated, to *output*."""
+            code = (f"import sys; from pathlib import Path; "
+                    f"open({str(runs)!r}, 'a').write({name!r} + '\\n'); "
+                    f"sys.exit(1) if {fail} else None; ")
+            if output:
+                code += (f"Path({str(tmp / output)!r}).write_text("
+                         f"''.join(Path(p).read_text() for p in {[str(tmp / i) for i in inputs]!r}))")
+            return Stage(name, [sys.executable, "-c", code], tmp, inputs=[tmp / i for i in inputs],
+                         outputs=[tmp / output] if output else [], after=after)
+
+        def run(stages, **kwargs):
+            runs.write_text("")
+            status = run_pipeline(stages, state=PipelineState(tmp / "state.json"), **kwargs)
+            return status, runs.read_text().split()
+
+        (tmp / "src1.txt").write_text("1")
+        (tmp / "src2.txt").write_text("2")
+        stages = [step("d", ["b.txt", "c.txt"], "d.txt"), step("b", ["a.txt"], "b.txt"),
+                  step("a", ["src1.txt"], "a.txt"), step("c", ["src2.txt"], "c.txt"),
+                  step("e", after=["a"])]
+        deps = dependencies(stages)
+        assert deps == {"a": [], "b": ["a"], "c": [], "d": ["b", "c"], "e": ["a"]}, deps
+        assert list(deps).index("a") < list(deps).index("b") < list(deps).index("d"), "topological order"
+        assert with_upstream(deps, ["b"]) == ["a", "b"], "upstream of b"
+        try:
+            dependencies([step("x", ["y.txt"], "x.txt"), step("y", ["x.txt"], "y.txt")])
+            raise AssertionError("cycle not found")
+        except ValueError:
+            pass
+
+        status, ran = run(stages, jobs=2)
+        assert set(status.values()) == {"done"} and sorted(ran) == list("abcde"), (status, ran)
+        assert ran.index("a") < ran.index("b") < ran.index("d") and ran.index("c") < ran.index("d"), ran
+        assert (tmp / "d.txt").read_text() == "12", "outputs"
+
+        status, ran = run(stages)
+        assert ran == [] and set(status.values()) == {"up to date"}, "second run"
+
+        (tmp / "src1.txt").write_text("one")              # an upstream change reruns what reads it
+        status, ran = run(stages, jobs=2)
+        assert sorted(ran) == ["a", "b", "d"], ran
+        assert status["c"] == status["e"] == "up to date" and (tmp / "d.txt").read_text() == "one2"
+
+        (tmp / "c.txt").unlink()                          # same output again: d stays up to date
+        status, ran = run(stages)
+        assert ran == ["c"] and status["d"] == "up to date", (status, ran)
+
+        status, ran = run(stages, targets=["b"], force=["a"], dry_run=True)
+        assert ran == [] and status == {"a": "would run", "b": "would run"}, status
+
+        stages[1] = step("b", ["a.txt"], "b.txt", fail=True)
+        status, ran = run(stages, force=["b"])
+        assert ran == ["b"] and status["b"] == "failed" and status["d"] == "skipped", status
+    print("✅ pipeline self‑tests passed.")
+
+
+__all__ = [
+    "Stage",
+    "STAGES",
+    "dependencies",
+    "with_upstream",
+    "PipelineState",
+    "run_pipeline",
+    "describe",
+]
+
+
+if __name__ == "__main__":
+    main()
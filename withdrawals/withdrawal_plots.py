@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""withdrawal_plots.py – plotting & notebook helpers for ``water_withdrawal``
+--------------------------------------------------------------------------
+Kept out of the core module so batch jobs and process‑pool workers never
+import Matplotlib. ``water_withdrawal.plot_withdrawal_curves`` still works:
+it loads this module on first use.
+
+* **Dotted‑line diagnostic plot** – quick visual sanity check.
+* **Headless‑safe backend** – falls back to ``Agg`` on Linux nodes with no
+  ``$DISPLAY`` (SLURM jobs), unless ``MPLBACKEND`` says otherwise.
+* **Stub for ``micropip``** so notebook imports never fail outside Pyodide.
+"""
+
+import os
+import sys
+import types
+
+import numpy as np  # type: ignore
+
+# ---------------------------------------------------------------------------
+# Optional dependency shim – keeps notebooks happy if ``micropip`` is missing
+# ---------------------------------------------------------------------------
+
+if "micropip" not in sys.modules:  # pragma: no cover – executed only if absent
+    micropip_stub = types.ModuleType("micropip")
+
+    def _unsupported(*_args, **_kwargs):  # noqa: D401, ANN001 – stub helper
+        """Raise helpful error guiding the user to install with pip."""
+        raise ModuleNotFoundError(
+            "The 'micropip' package is unavailable in this environment. "
+            "Install dependencies with pip (CPython) or load 'micropip' in Pyodide."
+        )
+
+    micropip_stub.install = _unsupported  # type: ignore[attr-defined]
+    sys.modules["micropip"] = micropip_stub
+
+# ---------------------------------------------------------------------------
+# Matplotlib – pick a display‑safe backend before pyplot is imported
+# ---------------------------------------------------------------------------
+
+import matplotlib
+
+if (sys.platform.startswith("linux") and not os.environ.get("DISPLAY")
+        and "MPLBACKEND" not in os.environ and "ipykernel" not in sys.modules):
+    matplotlib.use("Agg")
+
+import matplotlib.pyplot as plt
+
+from water_withdrawal import _MODEL_FNS, _check_model
+
+# ---------------------------------------------------------------------------
+# Diagnostic plot
+# ---------------------------------------------------------------------------
+
+def plot_withdrawal_curves(temperature_range: np.ndarray | None = None,
+                           model: str = "linear") -> None:  # noqa: D401
+    """Plot dotted lines of withdrawal vs temperature for every animal."""
+
+    if temperature_range is None:
+        temperature_range = np.linspace(15, 35, 400)
+
+    plt.figure(figsize=(7, 4))
+    for animal, fn in _MODEL_FNS[_check_model(model)].items():
+        plt.plot(
+            temperature_range,
+            fn(temperature_range),
+            linestyle=":",  # dotted
+            label=animal,
+        )
+
+    plt.xlabel(" Temperature (°C)")
+    plt.ylabel("Water withdrawal (L/head/day)")
+    plt.title("Livestock water use intensity vs temperature )")
+    plt.legend(ncol=2, fontsize="small")
+    plt.tight_layout()
+
+    # ensure ./plots exists
+    os.makedirs("plots2", exist_ok=True)
+    plt.savefig("plots2/my_result.png", dpi=300, bbox_inches="tight")
+    if matplotlib.get_backend().lower() != "agg":
+        plt.show()
+
+
+__all__ = ["plot_withdrawal_curves"]
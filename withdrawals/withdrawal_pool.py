@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""Years in parallel on one node: a process pool over shared density maps.
+
+The yearly driver walks its years one after another. With ``--workers N``
+the years go to N local processes instead:
+
+* the density maps of every year of the run (and the year after, for
+  ``--density linear``) are read once by the parent and published in one
+  ``multiprocessing.shared_memory`` block (:pyfunc:`share_dataset`);
+  workers map it as numpy views (:pyfunc:`attach_dataset`) – no copy,
+  no re‑read of the density file;
+* the coefficient tables are module constants of ``water_withdrawal``
+  (a few dozen floats), so each worker builds them once at import;
+* each worker opens t2m lazily, computes its year with ``run_year`` and
+  compresses it into a hidden ``.<name>.part`` file in the output
+  directory – compression is most of the run time, so it has to happen
+  in the workers, not in one writer;
+* the parent is the ordered writer: finished years are renamed into
+  place, logged and recorded in the run manifest strictly in year order, so an interrupted run leaves
+  the first years complete rather than a scatter (a year that fails is
+  reported and skipped; later ones still land).
+
+Workers are started with ``spawn``: HDF5 and dask thread pools do not
+survive ``fork``.
+"""
+
+import heapq
+import multiprocessing as mp
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+import numpy as np
+import xarray as xr
+
+from withdrawal_checkpoint import discard_blocks
+from withdrawal_manifest import RunManifest, part_path
+
+_WORKER: dict = {}                 # per-process state set by _init_worker
+
+
+# ── shared density maps ───────────────────────────────────────────────────
+
+def share_dataset(ds: xr.Dataset) -> tuple:
+    """Copy the data variables of *ds* into one shared block.
+
+    Returns ``(SharedMemory, spec)``; *spec* is small and picklable and
+    lets other processes rebuild the dataset with :pyfunc:`attach_dataset`.
+    The caller owns the block: ``close()`` and ``unlink()`` it when done.
+    """
+    ds     = ds.load()
+    layout = []
+    offset = 0
+    for name, da in ds.data_vars.items():
+        layout.append((name, da.dims, da.shape, da.dtype.str, offset, da.attrs))
+        offset += da.nbytes
+    shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    for name, dims, shape, dtype, start, _ in layout:
+        view = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=start)
+        view[...] = ds[name].values
+    coords = {k: (c.dims, c.values, c.attrs) for k, c in ds.coords.items()}
+    return shm, dict(name=shm.name, layout=layout, coords=coords, attrs=ds.attrs)
+
+
+def attach_dataset(spec: dict) -> tuple:
+    """``(SharedMemory, Dataset)`` of read‑only views on a shared block."""
+    shm  = shared_memory.SharedMemory(name=spec["name"])
+    data = {}
+    for name, dims, shape, dtype, start, attrs in spec["layout"]:
+        view = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=start)
+        view.flags.writeable = False
+        data[name] = xr.Variable(dims, view, attrs)
+    return shm, xr.Dataset(data, coords=spec["coords"], attrs=spec["attrs"])
+
+
+# ── workers ───────────────────────────────────────────────────────────────
+
+def _init_worker(spec: dict, t2m_all, threads: int, cache: int, backend: Optional[str],
+                 options: dict, manifest: Optional[RunManifest]) -> None:
+    from water_withdrawal_yearly import configure_threads
+    from withdrawal_kernels import set_backend
+    from withdrawal_memory import set_hdf5_cache
+
+    if backend:
+        set_backend(backend)
+    configure_threads(threads)
+    set_hdf5_cache(cache)
+    shm, dens = attach_dataset(spec)
+    _WORKER.update(shm=shm, dens=dens, t2m=t2m_all, options=options, manifest=manifest)
+
+
+def _run_worker_year(yr: int, part: Path, final: Path) -> tuple:
+    from water_withdrawal_yearly import run_year
+    from withdrawal_checkpoint import Checkpoint
+    from withdrawal_memory import peak_rss
+
+    # months are committed under the final name's entry, as in a sequential run
+    checkpoint = Checkpoint(_WORKER["manifest"], final) if _WORKER["manifest"] else None
+    run_year(yr, _WORKER["t2m"], _WORKER["dens"], part.parent, out_file=part, atomic=False,
+             checkpoint=checkpoint, **_WORKER["options"])
+    return yr, os.getpid(), peak_rss()
+
+
+def run_years_pool(
+    years: Iterable[int],
+    t2m_all: Optional[xr.DataArray],
+    dens_ds: xr.Dataset,
+    out_dir: Path,
+    workers: int,
+    threads: int = 1,
+    cache: int = 2**20,
+    backend: Optional[str] = None,
+    manifest: Optional[RunManifest] = None,
+    inputs: Optional[Callable[[int], list]] = None,
+    checkpoint: bool = False,
+    **options,
+) -> list:
+    """Run *years* on *workers* processes; return the files written, in order.
+
+    *dens_ds* must already hold only the years needed (it is loaded and
+    shared as a whole). *threads* and *cache* are the dask threads and
+    HDF5 chunk cache of each worker; *options* go to ``run_year``. Each
+    year is recorded in *manifest*, with the input files ``inputs(yr)``;
+    with *checkpoint* the workers commit each month there as well.
+    """
+    from water_withdrawal_yearly import output_name
+
+    years = list(years)
+    final = {yr: out_dir / output_name(yr, options.get("total_only", False)) for yr in years}
+    part  = {yr: part_path(f) for yr, f in final.items()}
+    if manifest is not None:
+        for yr in years:
+            manifest.start(final[yr], inputs(yr) if inputs else ())
+    shm, spec = share_dataset(dens_ds)
+    print(f"   🔗 density maps shared: {shm.size / 2**20:.0f} MB, {workers} workers "
+          f"× {threads} threads", flush=True)
+
+    written, ready, failed = [], [], set()
+    pending = list(years)                  # ordered; commit from the front
+    try:
+        with ProcessPoolExecutor(workers, mp_context=mp.get_context("spawn"),
+                                 initializer=_init_worker,
+                                 initargs=(spec, t2m_all, threads, cache, backend, options,
+                                           manifest if checkpoint else None)) as pool:
+            futures = {pool.submit(_run_worker_year, yr, part[yr], final[yr]): yr for yr in years}
+            for fut in as_completed(futures):
+                yr = futures[fut]
+                try:
+                    _, pid, rss = fut.result()
+                    heapq.heappush(ready, yr)
+                    print(f"   ⏱  {yr} done in worker {pid} (peak RSS {rss / 2**30:.2f} GB)", flush=True)
+                except Exception as exc:  # one bad year must not cost the others
+                    failed.add(yr)
+                    print(f"   ⚠️  {yr} failed: {exc!r}", flush=True)
+                    if manifest is not None:
+                        manifest.failed(final[yr], exc)
+                # ordered writer: move every finished year at the front into place
+                while pending and (pending[0] in failed or (ready and ready[0] == pending[0])):
+                    yr = pending.pop(0)
+                    if yr in failed:
+                        continue
+                    heapq.heappop(ready)
+                    os.replace(part[yr], final[yr])
+                    written.append(final[yr])
+                    if manifest is not None:
+                        manifest.done(final[yr])
+                    discard_blocks(final[yr])
+                    print(f"   ✔  {yr} written → {final[yr]}", flush=True)
+    finally:
+        for p in part.values():
+            p.unlink(missing_ok=True)
+        shm.close()
+        shm.unlink()
+    if failed:
+        raise RuntimeError(f"year(s) failed: {sorted(failed)}")
+    return written
+
+
+def _self_tests() -> None:  # pragma: no cover – light runtime checks
+    """Two workers write what one process computes; shared blocks go away, also on failure."""
+    import tempfile
+
+    from water_withdrawal import _test_inputs, withdrawals_by_gridcell
+    from water_withdrawal_yearly import NAME_MAP, density_for_year
+
+    def segments() -> set:
+        shm = Path("/dev/shm")
+        return set(os.listdir(shm)) if shm.is_dir() else set()
+
+    temp, dens_ds, _ = _test_inputs(ntime=40)
+    t2m  = xr.concat([temp, (temp + 5).assign_coords(time=temp.time + np.timedelta64(365, "D"))], "time")
+    dens = xr.concat([xr.Dataset({v: dens_ds[a] * (k + 1) for v, a in NAME_MAP.items()})
+                      for k in range(2)], "year")
+    dens = dens.assign_coords(year=np.array(["2019-01-01", "2020-01-01"], dtype="datetime64[ns]"))
+    before = segments()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        man = RunManifest(tmp, {}, "c0")
+        written = run_years_pool([2019, 2020], t2m, dens, tmp, workers=2, manifest=man)
+        assert [f.name for f in written] == ["Liv_WD_2019.nc", "Liv_WD_2020.nc"], written
+        for yr, path in zip((2019, 2020), written):
+            ref = withdrawals_by_gridcell(t2m.sel(time=str(yr)), density_for_year(dens, yr), NAME_MAP,
+                                          units="m3")
+            with xr.open_dataset(path) as out:
+                assert all(np.array_equal(out[v].values, ref[v].values, equal_nan=True)
+                           for v in ref), f"pool {yr} != in-process"
+            assert man.status(path) == "done", "manifest"
+
+        # a year without density fails in its worker; the others still land
+        (tmp / "failing").mkdir()
+        try:
+            run_years_pool([2019, 2020, 2021], t2m, dens, tmp / "failing", workers=2)
+            raise AssertionError("failed year not reported")
+        except RuntimeError as exc:
+            assert "2021" in str(exc), exc
+        assert sorted(p.name for p in (tmp / "failing").iterdir()) == ["Liv_WD_2019.nc", "Liv_WD_2020.nc"]
+    assert segments() <= before, f"shared memory left behind: {segments() - before}"
+    print("✅ pool self‑tests passed.")
+
+
+__all__ = [
+    "share_dataset",
+    "attach_dataset",
+    "run_years_pool",
+]
+
+
+if __name__ == "__main__":  # pragma: no cover
+    _self_tests()
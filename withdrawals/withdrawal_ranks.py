@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""Several ``srun`` tasks on one run: disjoint shares and a rank‑0 report.
+
+``secrun_wd_yearly.sh`` starts the yearly driver once per task. Each task
+finds its place with :pyfunc:`task_rank` – ``SLURM_PROCID`` /
+``SLURM_NTASKS``, else mpi4py when launched by ``mpirun`` – and takes every
+``size``‑th year (:pyfunc:`my_share`; round robin, so early and late
+years mix on every task), or every ``size``‑th tile of each year with
+``--hires``.
+
+No MPI is needed to report back: every task writes
+``<out_dir>/.ranks/rank_<r>.json`` when it is done (also when it fails),
+and rank 0 waits for all of them, prints one table and writes
+``completion_report.json`` (:pyfunc:`collect_reports`). Reports carry the
+job/step id, so files left by an earlier run are not counted.
+
+A task that is killed (out of memory, a node failure) never reports, and
+rank 0 must not hold the allocation until the time limit waiting for it.
+While it runs, each task stamps ``rank_<r>.alive`` every ``HEARTBEAT``
+seconds from a daemon thread (:pyfunc:`start_heartbeat`). The stamps stop
+with the process. Rank 0 waits only for tasks stamped within the last
+``STALE`` seconds, and never past ``--report-timeout`` (default: shortly
+before ``SLURM_JOB_END_TIME``).
+
+Tasks sharing a node also share its memory and cores;
+:pyfunc:`local_tasks` gives the count the driver divides them by.
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, Optional, Sequence
+
+REPORT_DIR  = ".ranks"
+REPORT_FILE = "completion_report.json"
+HEARTBEAT   = 30.0               # seconds between the alive stamps of a running task
+STALE       = 5 * HEARTBEAT      # a task silent for this long is taken as dead
+END_MARGIN  = 120.0              # rank 0 stops waiting this long before the time limit
+
+_MPI_SIZE_VARS = ("OMPI_COMM_WORLD_SIZE", "PMI_SIZE", "PMIX_SIZE")
+
+
+def task_rank() -> tuple:
+    """``(rank, size)`` of this process among the tasks of the job step."""
+    if "SLURM_PROCID" in os.environ and "SLURM_NTASKS" in os.environ:
+        return int(os.environ["SLURM_PROCID"]), int(os.environ["SLURM_NTASKS"])
+    if any(v in os.environ for v in _MPI_SIZE_VARS):
+        try:
+            from mpi4py import MPI
+        except ImportError:
+            print("   ⚠️  MPI launch without mpi4py – running as a single task", flush=True)
+        else:
+            return MPI.COMM_WORLD.Get_rank(), MPI.COMM_WORLD.Get_size()
+    return 0, 1
+
+
+def local_tasks() -> int:
+    """Tasks of this job step on this node (``SLURM_NTASKS_PER_NODE`` or
+    the first count of ``SLURM_TASKS_PER_NODE``, e.g. ``8(x2)``); 1 otherwise."""
+    if os.environ.get("SLURM_NTASKS_PER_NODE"):
+        return int(os.environ["SLURM_NTASKS_PER_NODE"])
+    per_node = os.environ.get("SLURM_TASKS_PER_NODE", "")
+    return int(per_node.split("(")[0].split(",")[0]) if per_node[:1].isdigit() else 1
+
+
+def my_share(items: Iterable, rank: int, size: int) -> list:
+    """Every *size*‑th item of *items*, starting at *rank*."""
+    return list(items)[rank::size]
+
+
+def _run_id() -> str:
+    return f"{os.environ.get('SLURM_JOB_ID', 'local')}.{os.environ.get('SLURM_STEP_ID', '0')}"
+
+
+def start_heartbeat(out_dir: Path, rank: int, every: float = HEARTBEAT) -> threading.Event:
+    """Stamp ``.ranks/rank_<r>.alive`` now and every *every* seconds after.
+
+    The stamps come from a daemon thread, so they stop when the process
+    dies. Set the returned event to stop them earlier.
+    """
+    path = Path(out_dir) / REPORT_DIR / f"rank_{rank:04d}.alive"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    run  = _run_id()
+    stop = threading.Event()
+    path.write_text(run)
+
+    def beat() -> None:
+        while not stop.wait(every):
+            try:
+                os.utime(path)             # rewriting the file would race with rank 0 reading it
+            except OSError:                # a heartbeat must never take the task down
+                pass
+
+    threading.Thread(target=beat, name=f"heartbeat-{rank}", daemon=True).start()
+    return stop
+
+
+def job_time_left() -> Optional[float]:
+    """Seconds to the job's time limit (``SLURM_JOB_END_TIME``), if SLURM says."""
+    end = os.environ.get("SLURM_JOB_END_TIME", "")
+    return float(end) - time.time() if end.isdigit() else None
+
+
+def write_rank_report(out_dir: Path, rank: int, size: int, years: Sequence[dict],
+                      seconds: float, peak_rss: int) -> Path:
+    """Record what this task did; *years* holds ``{"year", "status"}`` dicts."""
+    path = Path(out_dir) / REPORT_DIR / f"rank_{rank:04d}.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp  = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(dict(run=_run_id(), rank=rank, size=size, host=socket.gethostname(),
+                                   seconds=round(seconds, 1), peak_rss_gb=round(peak_rss / 2**30, 3),
+                                   years=list(years)), indent=1))
+    os.replace(tmp, path)                     # rank 0 never reads half a file
+    return path
+
+
+def _alive(folder: Path, rank: int, run: str, stale: float) -> bool:
+    """True if *rank* of *run* stamped its heartbeat within the last *stale* seconds."""
+    path = folder / f"rank_{rank:04d}.alive"
+    try:
+        return path.read_text() == run and time.time() - path.stat().st_mtime < stale
+    except OSError:
+        return False
+
+
+def collect_reports(out_dir: Path, size: int, timeout: Optional[float] = None,
+                    poll: float = 10.0, stale: float = STALE) -> dict:
+    """Rank 0: wait for the reports of all *size* tasks, combine and save them.
+
+    Waits only while every missing task is alive: its heartbeat is newer
+    than *stale* seconds (one that never stamped gets *stale* seconds from
+    the start of the wait). Never waits more than *timeout* seconds; the
+    default is the job's time left less ``END_MARGIN``, else no limit.
+    Tasks that never reported (killed, out of memory) are listed under
+    ``missing_ranks``.
+    """
+    folder = Path(out_dir) / REPORT_DIR
+    run    = _run_id()
+    if timeout is None and job_time_left() is not None:
+        timeout = max(job_time_left() - END_MARGIN, 0.0)
+    start  = time.monotonic()
+    found: dict = {}
+    while True:
+        for path in folder.glob("rank_*.json"):
+            try:
+                rep = json.loads(path.read_text())
+            except (OSError, ValueError):
+                continue
+            if rep.get("run") == run and rep.get("size") == size:
+                found[rep["rank"]] = rep
+        waited  = time.monotonic() - start
+        missing = [r for r in range(size) if r not in found]
+        if not missing or (timeout is not None and waited > timeout):
+            break
+        if not any(_alive(folder, r, run, stale) for r in missing) and waited > stale:
+            break
+        time.sleep(poll)
+
+    years  = sorted((y for rep in found.values() for y in rep["years"]), key=lambda y: y["year"])
+    report = dict(run=run, tasks=size, missing_ranks=sorted(set(range(size)) - set(found)),
+                  wall_seconds=max((rep["seconds"] for rep in found.values()), default=0.0),
+                  ranks=[found[r] for r in sorted(found)], years=years)
+    (Path(out_dir) / REPORT_FILE).write_text(json.dumps(report, indent=1))
+    return report
+
+
+def print_report(report: dict) -> None:
+    """Per‑rank table and the years that did not finish."""
+    print(f"📊 completion report ({report['tasks']} tasks, wall {report['wall_seconds']:.0f} s):",
+          flush=True)
+    for rep in report["ranks"]:
+        done = [y["year"] for y in rep["years"] if y["status"] == "done"]
+        print(f"   rank {rep['rank']:>3d} {rep['host']:<16s} {len(done):>3d}/{len(rep['years']):<3d} "
+              f"years  {rep['seconds']:8.0f} s  {rep['peak_rss_gb']:6.2f} GB", flush=True)
+    bad = [str(y["year"]) for y in report["years"] if y["status"] != "done"]
+    if report["missing_ranks"]:
+        print(f"   ⚠️  no report from rank(s) {report['missing_ranks']}", flush=True)
+    if bad:
+        print(f"   ⚠️  not finished: {', '.join(bad)}", flush=True)
+
+
+def report_ok(report: Optional[dict]) -> bool:
+    return bool(report) and not report["missing_ranks"] and \
+        all(y["status"] == "done" for y in report["years"])
+
+
+def _self_tests() -> None:  # pragma: no cover – light runtime checks
+    """Shares cover every year once; rank 0 stops waiting for dead or stale tasks."""
+    import tempfile
+
+    years = list(range(1980, 2020))
+    for size in (1, 2, 3, 4, 7, 8, 12, 40, 50):
+        shares = [my_share(years, r, size) for r in range(size)]
+        assert sorted(y for s in shares for y in s) == years, f"{size} tasks: a year missed or twice"
+        assert max(map(len, shares)) - min(map(len, shares)) <= 1, f"{size} tasks: uneven shares"
+
+    env = dict(os.environ)
+    try:
+        for key in ("SLURM_NTASKS_PER_NODE", "SLURM_TASKS_PER_NODE", "SLURM_JOB_END_TIME"):
+            os.environ.pop(key, None)
+        os.environ["SLURM_TASKS_PER_NODE"] = "8(x2),4"
+        assert local_tasks() == 8, "SLURM_TASKS_PER_NODE"
+        os.environ["SLURM_NTASKS_PER_NODE"] = "3"
+        assert local_tasks() == 3, "SLURM_NTASKS_PER_NODE"
+        assert job_time_left() is None
+        os.environ["SLURM_JOB_END_TIME"] = str(int(time.time()) + 600)
+        assert 590 < job_time_left() <= 600, "SLURM_JOB_END_TIME"
+        del os.environ["SLURM_JOB_END_TIME"]
+
+        os.environ.update(SLURM_JOB_ID="42", SLURM_STEP_ID="0")
+        done = [dict(year=1980, status="done")]
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            write_rank_report(tmp, 0, 2, done, 1.0, 2**30)
+            # an old run's report of rank 1 does not count; rank 1 never started
+            old = write_rank_report(tmp, 1, 2, [dict(year=1981, status="done")], 1.0, 2**30)
+            old.write_text(old.read_text().replace('"42.0"', '"41.0"'))
+            t   = time.monotonic()
+            rep = collect_reports(tmp, 2, poll=0.05, stale=0.3)
+            assert rep["missing_ranks"] == [1] and not report_ok(rep), "stale report counted"
+            assert time.monotonic() - t < 2, "waited for a task that never started"
+
+            # a live task is waited for until it reports, a failed year shows
+            stop = start_heartbeat(tmp, 1, every=0.05)
+            threading.Timer(0.6, write_rank_report,
+                            (tmp, 1, 2, [dict(year=1981, status="failed")], 1.0, 2**30)).start()
+            rep = collect_reports(tmp, 2, poll=0.05, stale=0.3)
+            assert rep["missing_ranks"] == [] and [y["year"] for y in rep["years"]] == [1980, 1981]
+            assert not report_ok(rep), "failed year not reported"
+            assert json.loads((tmp / REPORT_FILE).read_text()) == rep
+
+            # a task that dies is given up after *stale*; a hung one after *timeout*
+            (tmp / REPORT_DIR / "rank_0001.json").unlink()
+            stop.set()
+            t   = time.monotonic()
+            rep = collect_reports(tmp, 2, poll=0.05, stale=0.3)
+            assert rep["missing_ranks"] == [1] and time.monotonic() - t < 2, "dead task waited for"
+            stop = start_heartbeat(tmp, 1, every=0.05)
+            t   = time.monotonic()
+            rep = collect_reports(tmp, 2, timeout=0.5, poll=0.05, stale=0.3)
+            stop.set()
+            assert rep["missing_ranks"] == [1] and 0.5 < time.monotonic() - t < 2, "timeout"
+            write_rank_report(tmp, 1, 2, [dict(year=1981, status="done")], 1.0, 2**30)
+            assert report_ok(collect_reports(tmp, 2, poll=0.05))
+    finally:
+        os.environ.clear()
+        os.environ.update(env)
+    print("✅ ranks self‑tests passed.")
+
+
+__all__ = [
+    "task_rank",
+    "local_tasks",
+    "my_share",
+    "start_heartbeat",
+    "job_time_left",
+    "write_rank_report",
+    "collect_reports",
+    "print_report",
+    "report_ok",
+]
+
+
+if __name__ == "__main__":  # pragma: no cover
+    _self_tests()
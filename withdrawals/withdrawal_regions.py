@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""Regional runs: cut t2m and density to a box, mask or country list.
+
+A region is the smallest index window of the density grid that holds all
+of its cells, plus a boolean mask on that window. The yearly driver cuts
+the lazily opened t2m/d2m and density with :pyfunc:`clip_to_region`
+before anything is read, so only those hyperslabs leave the disk, and
+sets density to NaN outside the mask, so the compact outputs are NaN
+there as in the global files.
+
+Three ways to define one:
+
+* :pyfunc:`region_from_bbox` – ``W S E N`` in degrees (``W > E`` crosses
+  the date line);
+* :pyfunc:`region_from_mask` – a NetCDF file on the density grid whose
+  first variable is non‑zero inside;
+* :pyfunc:`region_from_iso` – ISO‑3 codes, rasterised from a country
+  shapefile (Natural Earth ``admin_0_countries``, the polygons used in
+  ``withdrawals_analysis/figs``) with geopandas/regionmask, which are
+  only imported for this.
+"""
+
+from pathlib import Path
+from typing import NamedTuple, Sequence, Union
+
+import numpy as np
+import xarray as xr
+
+ISO_COLUMNS = ("iso_a3", "ISO_A3", "ADM0_A3", "GID_0")   # tried in this order
+
+
+class Region(NamedTuple):
+    """Index window (``lat``/``lon``: slice or index array) and mask on it."""
+
+    name: str
+    lat: Union[slice, np.ndarray]
+    lon: Union[slice, np.ndarray]
+    mask: xr.DataArray
+
+    @property
+    def ncells(self) -> int:
+        return int(self.mask.sum())
+
+
+def _window(inside: np.ndarray) -> Union[slice, np.ndarray]:
+    """Slice over the True run of *inside*, or the indices if it is split."""
+    idx = np.flatnonzero(inside)
+    if not idx.size:
+        raise ValueError("region contains no grid cell")
+    if idx[-1] - idx[0] + 1 == idx.size:
+        return slice(int(idx[0]), int(idx[-1]) + 1)
+    return idx
+
+
+def _from_cells(name: str, grid: xr.Dataset, cells: np.ndarray) -> Region:
+    lat = _window(cells.any(axis=1))
+    lon = _window(cells.any(axis=0))
+    mask = xr.DataArray(cells, dims=("lat", "lon"),
+                        coords={"lat": grid.lat.values, "lon": grid.lon.values})
+    return Region(name, lat, lon, mask.isel(lat=lat, lon=lon))
+
+
+def region_from_bbox(grid: xr.Dataset, bbox: Sequence[float]) -> Region:
+    """Cells of *grid* whose centres lie in ``(W, S, E, N)``."""
+    west, south, east, north = bbox
+    lat = grid.lat.values
+    lon = (grid.lon.values + 180.0) % 360.0 - 180.0
+    w, e = (west + 180.0) % 360.0 - 180.0, (east + 180.0) % 360.0 - 180.0
+    in_lon = (lon >= w) & (lon <= e) if w <= e else (lon >= w) | (lon <= e)
+    in_lat = (lat >= south) & (lat <= north)
+    cells = in_lat[:, None] & in_lon[None, :]
+    return _from_cells("bbox " + " ".join(f"{v:g}" for v in bbox), grid, cells)
+
+
+def region_from_mask(grid: xr.Dataset, path: Path) -> Region:
+    """Cells where the first variable of the NetCDF *path* is non‑zero."""
+    with xr.open_dataset(path) as ds:
+        mask = ds[next(iter(ds.data_vars))].squeeze(drop=True)
+        if mask.shape != (grid.sizes["lat"], grid.sizes["lon"]):
+            raise ValueError(f"mask {mask.shape} is not on the density grid "
+                             f"{(grid.sizes['lat'], grid.sizes['lon'])}")
+        cells = (mask.fillna(0) != 0).transpose("lat", "lon").values
+    return _from_cells(Path(path).stem, grid, cells)
+
+
+def region_from_iso(grid: xr.Dataset, codes: Sequence[str], shapefile: Path) -> Region:
+    """Cells whose centres fall in the countries *codes* (ISO‑3) of *shapefile*."""
+    import geopandas as gpd
+    import regionmask
+
+    codes  = [c.upper() for c in codes]
+    world  = gpd.read_file(shapefile)
+    column = next((c for c in ISO_COLUMNS if c in world.columns), None)
+    if column is None:
+        raise KeyError(f"no ISO-3 column ({', '.join(ISO_COLUMNS)}) in {shapefile}")
+    world   = world[world[column].str.upper().isin(codes)].reset_index(drop=True)
+    missing = sorted(set(codes) - set(world[column].str.upper()))
+    if missing:
+        raise KeyError(f"ISO-3 code(s) not in {shapefile}: {missing}")
+    labels = regionmask.mask_geopandas(world, grid.lon.values, grid.lat.values)
+    cells  = labels.notnull().transpose("lat", "lon").values
+    return _from_cells(" ".join(codes), grid, cells)
+
+
+def clip_to_region(obj, region: Region, mask: bool = False):
+    """Cut *obj* (DataArray or Dataset on the density grid) to the window.
+
+    Lazy inputs stay lazy, so only the window is read. With *mask* cells
+    outside the region become NaN (use it on density, not on t2m).
+    """
+    out = obj.isel(lat=region.lat, lon=region.lon)
+    if mask:
+        out = out.where(xr.DataArray(region.mask.values, dims=("lat", "lon")))
+    return out
+
+
+def _self_tests() -> None:  # pragma: no cover – light runtime checks
+    """Box across the date line, NaN density outside the mask."""
+    world = xr.Dataset(coords={"lat": np.arange(85.0, -90.0, -10.0), "lon": np.arange(-175.0, 180.0, 10.0)})
+    box   = region_from_bbox(world, (150, -20, -160, 20))
+    assert box.ncells == 4 * 5 and list(box.lon) == [0, 1, 33, 34, 35], "date-line box"
+    cut   = clip_to_region(world.assign(d=(("lat", "lon"), np.ones((18, 36)))), box, mask=True)
+    assert int(cut["d"].count()) == box.ncells and cut.sizes["lon"] == 5, "region clip"
+    print("✅ region self‑tests passed.")
+
+
+__all__ = [
+    "Region",
+    "region_from_bbox",
+    "region_from_mask",
+    "region_from_iso",
+    "clip_to_region",
+]
+
+
+if __name__ == "__main__":  # pragma: no cover
+    _self_tests()
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""Batch driver: one density pass, many temperature scenarios.
+
+Running ``water_withdrawal_yearly.py`` once per climate model or SSP
+reopens the density file and re‑slices it for every scenario and year,
+and clips and multiplies every block of density once per scenario. Here
+the density maps of a year (and of the next year, for ``--density
+linear``) are read once into memory, and the scenarios' t2m are stacked
+on a ``scenario`` axis (:pyfunc:`stack_scenarios`) so each block of days
+and rows is evaluated for all of them in one kernel call against the
+same density block – the same broadcast the ensemble uses for its
+``member`` axis. ``xr.save_mfdataset`` then writes every scenario's
+slice of that block to its own file in one dask pass, so no block is
+computed twice.
+
+Each scenario is written to its own directory with the usual file names
+and ``manifest.json``, so the analysis scripts can be pointed at any of
+them and reruns skip what is still valid. Scenarios whose days differ
+in a year (a shorter file, another calendar) are stacked in separate
+passes. Chunks, threads and the HDF5 cache come from the driver's
+memory plan, with the block holding every scenario of the pass.
+
+Usage
+-----
+python withdrawal_scenarios.py --scenario ssp245=/path/t2m_ssp245.nc \\
+                               --scenario ssp585=/path/t2m_ssp585.nc --start 2030 --end 2060
+"""
+
+import argparse
+import os
+import time
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Dict, Iterable, Mapping, Optional
+
+import numpy as np
+import xarray as xr
+
+from water_withdrawal import MODELS, coefficients_version
+from water_withdrawal_yearly import (
+    CHUNKS,
+    DENS_FILE,
+    NAME_MAP,
+    SCRATCH,
+    compression,
+    configure_threads,
+    open_density,
+    output_name,
+    year_dataset,
+)
+from withdrawal_density import DENSITY_MODES
+from withdrawal_io import COMPUTE_DTYPE, PRECISIONS, output_encoding
+from withdrawal_kernels import default_threads
+from withdrawal_manifest import RunManifest, part_path
+from withdrawal_memory import BUDGET_FRACTION, memory_limit, plan_chunks, set_hdf5_cache
+
+OUT_ROOT = SCRATCH / "liv_wd_scenarios"
+
+
+def open_scenario(path: Path, chunks: Mapping[str, int] = CHUNKS) -> xr.DataArray:
+    """Daily t2m of one scenario (°C), lazily chunked like the yearly driver."""
+    t2m = xr.open_dataset(path)
+    if "valid_time" in t2m.dims:
+        t2m = t2m.rename({"valid_time": "time"})
+    t2m = t2m["t2m"]
+    if t2m.attrs.get("units") == "K":
+        t2m = (t2m - 273.15).assign_attrs(units="degC")
+    return t2m.chunk(dict(chunks))
+
+
+def parse_scenarios(specs) -> Dict[str, Path]:
+    """``NAME=PATH`` (or bare ``PATH``, named after the file stem) → {name: path}."""
+    out = {}
+    for spec in specs:
+        name, _, path = spec.rpartition("=")
+        path = Path(path)
+        out[name or path.stem] = path
+    if len(out) < len(specs):
+        raise ValueError("scenario names must be unique")
+    return out
+
+
+def stack_scenarios(scenarios: Mapping[str, xr.DataArray]) -> list:
+    """``[(names, t2m(time, scenario, lat, lon))]``, one entry per distinct set of days.
+
+    Scenarios with the same days are stacked in one array (chunked like
+    the first, whole ``scenario`` axis per block); the grid coordinates
+    of the first are kept.
+    """
+    groups: dict = {}
+    for name, t2m in scenarios.items():
+        groups.setdefault(t2m.time.values.tobytes(), []).append(name)
+    out = []
+    for names in groups.values():
+        first = scenarios[names[0]]
+        t2m   = xr.concat([scenarios[n] for n in names], dim="scenario",
+                          join="override", coords="minimal", compat="override")
+        t2m   = t2m.assign_coords(scenario=names).transpose("time", "scenario", ...)
+        if first.chunks:
+            t2m = t2m.chunk({"scenario": -1, **dict(zip(first.dims, first.chunks))})
+        out.append((names, t2m))
+    return out
+
+
+def _write_scenarios(ds_year: xr.Dataset, files: Mapping[str, Path], precision: str,
+                     bounds: Optional[dict], disk: Optional[dict], shuffle: bool) -> None:
+    """Write each scenario's slice of *ds_year* to ``files[name]`` in one dask pass."""
+    parts = []
+    for name in files:
+        ds  = ds_year.sel(scenario=name, drop=True)
+        enc = output_encoding(ds, precision, bounds, complevel=compression["complevel"],
+                              shuffle=shuffle, chunksizes=disk)
+        for v, e in enc.items():
+            ds[v].encoding = e
+        parts.append(ds)
+    targets = [part_path(f) for f in files.values()]
+    try:
+        xr.save_mfdataset(parts, targets)
+    except BaseException:
+        for t in targets:
+            t.unlink(missing_ok=True)
+        raise
+    for t, f in zip(targets, files.values()):
+        os.replace(t, f)
+
+
+def run_scenarios(scenarios: Mapping[str, xr.DataArray], dens_ds: xr.Dataset,
+                  start: int, end: int, out_root: Path = OUT_ROOT,
+                  inputs: Optional[Mapping[str, Iterable[Path]]] = None,
+                  verify: bool = False, force: bool = False,
+                  total_only: bool = False, precision: str = "float64",
+                  shuffle: bool = True, **options) -> dict:
+    """Write every scenario for *start*–*end*; return cell‑days/s per scenario.
+
+    *options* are passed on to ``year_dataset`` (model, density …). Grids
+    must match the density grid. Each output is recorded in its
+    scenario's manifest with the files ``inputs[name]``; outputs still
+    valid there are skipped.
+    """
+    for name, t2m in scenarios.items():
+        if (t2m.sizes["lat"], t2m.sizes["lon"]) != (dens_ds.sizes["lat"], dens_ds.sizes["lon"]):
+            raise ValueError(f"scenario '{name}' is not on the density grid")
+        (out_root / name).mkdir(parents=True, exist_ok=True)
+    inputs    = inputs or {}
+    recorded  = dict(options, total_only=total_only, precision=precision, shuffle=shuffle)
+    manifests = {name: RunManifest(out_root / name, recorded, coefficients_version(),
+                                   verify=verify, force=force) for name in scenarios}
+
+    cells = {name: 0 for name in scenarios}
+    spent = {name: 0.0 for name in scenarios}
+    for yr in range(start, end + 1):
+        print(f"🔹 Year {yr}", flush=True)
+        files = {name: out_root / name / output_name(yr, total_only) for name in scenarios}
+        todo  = {}
+        for name, t2m_all in scenarios.items():
+            t2m = t2m_all.sel(time=slice(f"{yr}-01-01", f"{yr}-12-31"))
+            if not t2m.sizes["time"]:
+                print(f"   ⚠️  {name}: no {yr} data – skipped", flush=True)
+            elif manifests[name].is_valid(files[name], inputs.get(name, ())):
+                print(f"   ⏭  {name}: up to date", flush=True)
+            else:
+                todo[name] = t2m
+        if not todo:
+            continue
+        # yr (+ yr+1 for --density linear), read once for all scenarios
+        dens = dens_ds.sel(year=slice(str(yr), str(yr + 1))).load()
+        for names, t2m in stack_scenarios(todo):
+            t0 = time.perf_counter()
+            ds_year, bounds, disk = year_dataset(yr, t2m, dens, total_only=total_only,
+                                                 precision=precision, **options)
+            with ExitStack() as stack:
+                for name in names:
+                    stack.enter_context(manifests[name].recording(files[name], inputs.get(name, ())))
+                _write_scenarios(ds_year, {n: files[n] for n in names}, precision, bounds, disk,
+                                 shuffle)
+            dt = time.perf_counter() - t0
+            n  = t2m.sizes["time"] * t2m.sizes["lat"] * t2m.sizes["lon"]
+            for name in names:
+                cells[name] += n
+                spent[name] += dt
+            print(f"   ⏱  {', '.join(names)}: {dt:.1f} s, "
+                  f"{len(names) * n / dt / 1e6:.2f} M cell-days/s", flush=True)
+
+    rates = {name: cells[name] / spent[name] if spent[name] else 0.0 for name in scenarios}
+    print("📊 throughput (M cell-days/s, scenarios of one pass share its time):", flush=True)
+    for name, rate in rates.items():
+        print(f"   {name:<20s} {rate / 1e6:8.2f}   ({spent[name]:.0f} s)", flush=True)
+    return rates
+
+
+# ── driver ────────────────────────────────────────────────────────────────
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="Livestock withdrawals for many temperature scenarios")
+    p.add_argument("--scenario", action="append", required=True, metavar="NAME=PATH",
+                   help="daily t2m file of one scenario (repeatable)")
+    p.add_argument("--start", type=int, default=2019, help="first year (inclusive)")
+    p.add_argument("--end",   type=int, default=2019, help="last year (inclusive)")
+    p.add_argument("--out-root", type=Path, default=OUT_ROOT,
+                   help="one sub-directory per scenario is written here")
+    p.add_argument("--total-only", action="store_true", help="write only total_wd")
+    p.add_argument("--model", choices=MODELS, default="linear")
+    p.add_argument("--density", choices=DENSITY_MODES, default="step")
+    p.add_argument("--precision", choices=PRECISIONS, default="float64")
+    p.add_argument("--threads", type=int, default=None,
+                   help="dask threads (default: $SLURM_CPUS_PER_TASK, else every core, "
+                        "fewer if memory is short)")
+    p.add_argument("--mem-budget", type=float, default=None, metavar="GB",
+                   help="memory to plan for (default: 80%% of the SLURM/cgroup limit)")
+    p.add_argument("--verify", action="store_true",
+                   help="re-hash finished outputs against the manifest before skipping them")
+    p.add_argument("--force", action="store_true",
+                   help="recompute every output, whatever the manifest says")
+    args = p.parse_args()
+
+    paths   = parse_scenarios(args.scenario)
+    dens_ds = open_density()
+    present = sum(v in dens_ds for v in NAME_MAP)
+    nvars   = 1 if args.total_only else present
+    first   = xr.open_dataset(next(iter(paths.values())))["t2m"]
+    # one block holds every scenario: their inputs, outputs and HDF5 caches
+    plan    = plan_chunks(
+        {d: dens_ds.sizes[d] for d in ("lat", "lon")}, nvars * len(paths),
+        args.threads or default_threads(), CHUNKS,
+        budget=args.mem_budget * 2**30 if args.mem_budget else memory_limit() * BUDGET_FRACTION,
+        fixed_threads=args.threads is not None,
+        nspecies=present, n_inputs=len(paths), in_itemsize=first.dtype.itemsize,
+        out_itemsize=np.dtype(COMPUTE_DTYPE[args.precision]).itemsize,
+        density_maps=2 if args.density == "linear" else 1)
+    print(f"⚙️  {plan.describe()}", flush=True)
+    configure_threads(plan.threads)
+    set_hdf5_cache(plan.cache)
+
+    scenarios = {name: open_scenario(path, plan.chunks) for name, path in paths.items()}
+    run_scenarios(scenarios, dens_ds, args.start, args.end, args.out_root,
+                  inputs={name: [path, DENS_FILE] for name, path in paths.items()},
+                  verify=args.verify, force=args.force,
+                  total_only=args.total_only, model=args.model,
+                  density=args.density, precision=args.precision)
+    print("🎉  All scenarios done:", args.out_root)
+
+
+def _self_tests() -> None:  # pragma: no cover – light runtime checks
+    """Each scenario of a stacked pass equals a run of its t2m alone."""
+    import tempfile
+
+    from water_withdrawal import _test_inputs
+    from water_withdrawal_yearly import run_year
+
+    temp, dens_ds, _ = _test_inputs(ntime=40)
+    dens = xr.concat([xr.Dataset({v: dens_ds[a] * (k + 1) for v, a in NAME_MAP.items()})
+                      for k in range(2)], "year")
+    dens = dens.assign_coords(year=np.array(["2019-01-01", "2020-01-01"], dtype="datetime64[ns]"))
+    scenarios = {"base": temp, "warm": temp + 4, "cold": temp - 6,
+                 "short": (temp + 1).isel(time=slice(5, None))}       # other days: own pass
+    scenarios = {name: t2m.chunk(time=16, lat=3) for name, t2m in scenarios.items()}
+    assert [names for names, _ in stack_scenarios(scenarios)] == [["base", "warm", "cold"], ["short"]]
+    configure_threads(2)
+
+    for options in (dict(), dict(total_only=True, density="linear", precision="int16")):
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            run_scenarios(scenarios, dens, 2019, 2019, tmp / "stacked", **options)
+            for name, t2m in scenarios.items():
+                (tmp / "single" / name).mkdir(parents=True)
+                ref = run_year(2019, t2m, dens, tmp / "single" / name, **options)
+                out = tmp / "stacked" / name / ref.name
+                with xr.open_dataset(out) as a, xr.open_dataset(ref) as b:
+                    assert a.identical(b), f"{name} {options}: stacked != single run"
+                assert RunManifest(tmp / "stacked" / name, {}, "").status(out) == "done", "manifest"
+            stamp = {p: p.stat().st_mtime_ns for p in (tmp / "stacked").glob("*/*.nc")}
+            run_scenarios(scenarios, dens, 2019, 2019, tmp / "stacked", **options)
+            assert stamp == {p: p.stat().st_mtime_ns for p in stamp}, "rerun rewrote valid outputs"
+    print("✅ scenarios self‑tests passed.")
+
+
+__all__ = [
+    "open_scenario",
+    "parse_scenarios",
+    "stack_scenarios",
+    "run_scenarios",
+]
+
+
+if __name__ == "__main__":
+    main()
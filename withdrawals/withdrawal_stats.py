@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""Monthly sufficient statistics of t2m – re‑cost coefficients without t2m.
+
+Every factor curve is ``base + Σ_k slope_k·(clip(T, x_k, x_k+1) − x_k)``,
+so a cell's withdrawal summed over any set of days D is
+
+    dens · ( |D|·base + Σ_k slope_k · Σ_{d∈D} (clip(T_d, x_k, x_k+1) − x_k) )
+
+Per cell and month it is enough to keep the number of valid days and one
+clipped sum per segment between 15, 25 and 35 °C. The linear model uses
+their sum (= clip(T, 15, 35) − 15); the piecewise model uses both.
+:pyfunc:`withdrawal_from_stats` rebuilds monthly or annual maps from any
+coefficient table in seconds; only :pyfunc:`clip_stats` touches the
+daily data, once.
+
+Results equal the monthly sums of the daily pipeline up to float
+rounding (~1e‑12 relative in float64; the daily files round factors to
+the t2m dtype first).
+
+Usage
+-----
+python withdrawal_stats.py --start 1980 --end 2019      # one file per year
+"""
+
+import argparse
+from pathlib import Path
+from typing import Mapping, Optional
+
+import numpy as np
+import xarray as xr
+
+from water_withdrawal import (
+    _ANCHORS,
+    _KNOTS,
+    _UNITS,
+    _check_model,
+    _coefficient_stack,
+    _present_species,
+)
+
+STATS_KNOTS = _ANCHORS                      # segments 15–25 and 25–35 °C
+
+FREQS = {"month": "MS", "year": "YS"}
+
+
+# ── precompute ────────────────────────────────────────────────────────────
+
+def clip_stats(temperature: xr.DataArray) -> xr.Dataset:
+    """Per‑month ``ndays`` and ``clip_sum`` (segment, …) of daily *temperature*.
+
+    ``clip_sum[k] = Σ_days (clip(T, x_k, x_k+1) − x_k)`` over the
+    :data:`STATS_KNOTS` segments; NaN days are left out of both, as a
+    NaN‑skipping monthly sum of the daily maps would do.
+    """
+    valid = temperature.notnull()
+    segs  = [
+        (temperature.clip(lo, hi) - lo).astype("float64")
+        .resample(time=FREQS["month"]).sum()
+        for lo, hi in zip(STATS_KNOTS[:-1], STATS_KNOTS[1:])
+    ]
+    ndays = valid.resample(time=FREQS["month"]).sum().astype("int16")
+    clip_sum = xr.concat(segs, dim="segment").transpose("time", "segment", ...)
+
+    return xr.Dataset(
+        {
+            "ndays": ndays.assign_attrs(long_name="valid days in month"),
+            "clip_sum": clip_sum.assign_attrs(
+                units="degC day",
+                long_name="monthly sum of clip(T, x_k, x_k+1) - x_k",
+                knots=list(STATS_KNOTS),
+            ),
+        }
+    )
+
+
+def write_year_stats(yr: int, t2m_all: xr.DataArray, out_dir: Path) -> Path:
+    """Compute and write the statistics of one year; return the path."""
+    t2m      = t2m_all.sel(time=slice(f"{yr}-01-01", f"{yr}-12-31"))
+    stats    = clip_stats(t2m)
+    out_file = out_dir / f"T_clip_stats_{yr}.nc"
+    stats.to_netcdf(out_file, encoding={v: dict(zlib=True, complevel=4) for v in stats})
+    print(f"   ✔  written → {out_file}", flush=True)
+    return out_file
+
+
+def open_stats(stats_dir: Path, start: int = 1980, end: int = 2019) -> xr.Dataset:
+    """Open the yearly statistics files of *start*–*end* as one dataset."""
+    files = [Path(stats_dir) / f"T_clip_stats_{yr}.nc" for yr in range(start, end + 1)]
+    missing = [f.name for f in files if not f.exists()]
+    if missing:
+        raise FileNotFoundError(f"missing statistics files: {missing}")
+    return xr.open_mfdataset(files, combine="by_coords")
+
+
+# ── rebuild ───────────────────────────────────────────────────────────────
+
+def _model_segments(clip_sum: xr.DataArray, knots: tuple) -> list:
+    """Merge the stored 15–25 / 25–35 sums into the segments of *knots*."""
+    stored = list(zip(STATS_KNOTS[:-1], STATS_KNOTS[1:]))
+    merged = []
+    for lo, hi in zip(knots[:-1], knots[1:]):
+        idx = [j for j, (a, b) in enumerate(stored) if lo <= a and b <= hi]
+        merged.append(clip_sum.isel(segment=idx).sum("segment"))
+    return merged
+
+
+def _density_by_time(dens: xr.DataArray, time: xr.DataArray) -> xr.DataArray:
+    """Density of each step's calendar year (1‑Jan maps on a ``year`` axis)."""
+    if "year" not in dens.dims:
+        return dens
+    years = dens.year.dt.year if np.issubdtype(dens.year.dtype, np.datetime64) else dens.year
+    return (dens.assign_coords(year=years.values)
+                .sel(year=time.dt.year)
+                .drop_vars("year"))
+
+
+def withdrawal_from_stats(
+    stats: xr.Dataset,
+    density_ds: xr.Dataset,
+    name_map: Mapping[str, str],
+    table: Optional[Mapping[str, np.ndarray]] = None,
+    model: str = "linear",
+    units: str = "m3",
+    freq: str = "month",
+) -> xr.Dataset:
+    """``<animal>_wd`` withdrawal totals per month or year from *stats*.
+
+    *table* maps animal → values at 15/25/35 °C (default: the current
+    ``_WITHDRAWAL_DATA``), so revised coefficients are costed without
+    rereading t2m. *density_ds* may carry a ``year`` axis (as opened by
+    the yearly driver; each month takes its year's map) or be static.
+    Cells without a valid day come out as 0, not NaN.
+    """
+    if units not in _UNITS:
+        raise ValueError(f"Unknown units '{units}'. Choose from {list(_UNITS)}.")
+    if freq not in FREQS:
+        raise ValueError(f"Unknown freq '{freq}'. Choose from {list(FREQS)}.")
+    divisor, units_attr = _UNITS[units]
+
+    model   = _check_model(model)
+    present = _present_species(density_ds, name_map)
+    base, slopes, knots = _coefficient_stack(present.values(), model, table)
+    segs    = _model_segments(stats["clip_sum"], _KNOTS[model])
+    ndays   = stats["ndays"]
+
+    ds = xr.Dataset()
+    for i, (var, animal) in enumerate(present.items()):
+        per_head = ndays * base[i] + sum(slopes[i, k] * s for k, s in enumerate(segs))
+        wd = (_density_by_time(density_ds[var], stats.time) * per_head / divisor).transpose("time", ...)
+        if freq == "year":
+            wd = wd.resample(time=FREQS["year"]).sum(min_count=1)
+        wd.attrs = dict(units=units_attr.replace("day-1", f"{freq}-1"),
+                        long_name=f"{animal} drinking-water withdrawal")
+        ds[f"{animal}_wd"] = wd
+    return ds
+
+
+# ── driver ────────────────────────────────────────────────────────────────
+
+def main() -> None:
+    from water_withdrawal_yearly import SCRATCH, open_temperature
+
+    p = argparse.ArgumentParser(description="Monthly clip(T) statistics for fast re-costing")
+    p.add_argument("--start", type=int, default=1980, help="first year (inclusive)")
+    p.add_argument("--end",   type=int, default=2019, help="last year (inclusive)")
+    p.add_argument("--out-dir", type=Path, default=SCRATCH / "liv_wd_stats",
+                   help="output directory")
+    args = p.parse_args()
+    args.out_dir.mkdir(exist_ok=True)
+
+    t2m_all = open_temperature()
+    for yr in range(args.start, args.end + 1):
+        print(f"🔹 Year {yr}", flush=True)
+        write_year_stats(yr, t2m_all, args.out_dir)
+    print("🎉  All files done:", args.out_dir)
+
+
+def _self_tests() -> None:  # pragma: no cover – light runtime checks
+    """Monthly statistics rebuild the daily sums for any coefficient table."""
+    from water_withdrawal import MODELS, _WITHDRAWAL_DATA, _test_inputs, withdrawals_by_gridcell
+
+    temp, dens_ds, nm = _test_inputs()
+    stats = clip_stats(temp)
+    table = {a: v * 1.5 for a, v in _WITHDRAWAL_DATA.items()}
+    for model in MODELS:
+        daily = withdrawals_by_gridcell(temp, dens_ds, nm, units="m3", model=model).resample(time="MS").sum()
+        fast  = withdrawal_from_stats(stats, dens_ds, nm, table=table, model=model)
+        assert all(np.allclose(fast[v].values, 1.5 * daily[v].values, rtol=1e-12) for v in daily), f"stats {model}"
+    print("✅ stats self‑tests passed.")
+
+
+__all__ = [
+    "STATS_KNOTS",
+    "clip_stats",
+    "write_year_stats",
+    "open_stats",
+    "withdrawal_from_stats",
+]
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""0.1° withdrawals: density split onto the native ERA5‑Land grid, in tiles.
+
+The density file holds head *counts* per 0.5° FAO cell (conservatively
+regridded, see ``liv_density/regrid.sh``). On a finer grid each count is
+split evenly between the fine cells whose centres fall inside the coarse
+cell, so grid totals are unchanged:
+
+    dens_fine(i, j) = dens_coarse(I(i), J(j)) / n(I, J)
+
+With a land mask (ERA5‑Land is NaN over sea) ``n`` counts only land
+centres, so no heads are parked on cells without a temperature; coarse
+cells with no land centre at all fall back to every centre.
+
+Only the two index vectors ``I``, ``J`` and the ``n`` map (coarse size)
+are global; :pyfunc:`disaggregate` builds the fine maps of one tile at a
+time, and :pyfunc:`tile_slices` walks the grid in lat/lon blocks. Each
+tile is written as its own file; :pyfunc:`open_tiles` reassembles them.
+"""
+
+from pathlib import Path
+from typing import Iterator, Mapping, Optional
+
+import numpy as np
+import xarray as xr
+
+TILE = {"lat": 361, "lon": 720}     # 0.1° cells per tile → 5 × 5 tiles globally
+
+
+# ── grid mapping ──────────────────────────────────────────────────────────
+
+def coarse_index(fine: np.ndarray, coarse: np.ndarray, period: Optional[float] = None) -> np.ndarray:
+    """Index of the (regular) *coarse* cell containing each *fine* centre.
+
+    *coarse* may be descending (latitudes north → south). With *period*
+    (360 for ascending longitudes) fine values are wrapped onto the coarse
+    range, so 0…360 and −180…180 grids can be mixed.
+    """
+    coarse = np.asarray(coarse, dtype="float64")
+    step   = coarse[1] - coarse[0]
+    offset = np.asarray(fine, dtype="float64") - (coarse[0] - step / 2)
+    if period is not None:
+        offset = np.mod(offset, period)
+    # centres on the outer edge (±90°) belong to the first/last cell
+    return np.clip(np.floor(offset / step).astype("int64"), 0, coarse.size - 1)
+
+
+def fine_counts(ilat: np.ndarray, ilon: np.ndarray, shape: tuple,
+                mask: Optional[np.ndarray] = None) -> np.ndarray:
+    """Fine centres per coarse cell, ``n(I, J)``, land‑only where *mask* is given."""
+    every = np.outer(np.bincount(ilat, minlength=shape[0]),
+                     np.bincount(ilon, minlength=shape[1]))
+    if mask is None:
+        return every
+    flat = (ilat[:, None] * shape[1] + ilon[None, :]).ravel()
+    land = np.bincount(flat, weights=np.asarray(mask, dtype="float64").ravel(),
+                       minlength=shape[0] * shape[1]).reshape(shape)
+    return np.where(land > 0, land, every)
+
+
+def disaggregate(dens_ds: xr.Dataset, lat: xr.DataArray, lon: xr.DataArray,
+                 ilat: np.ndarray, ilon: np.ndarray, counts: np.ndarray) -> xr.Dataset:
+    """Fine‑grid density of the cells (*lat*, *lon*) with coarse indices (*ilat*, *ilon*)."""
+    n    = xr.DataArray(counts[np.ix_(ilat, ilon)], dims=("lat", "lon"))
+    fine = dens_ds.isel(lat=xr.DataArray(ilat, dims="lat"),
+                        lon=xr.DataArray(ilon, dims="lon")) / n
+    return fine.assign_coords(lat=lat.values, lon=lon.values)
+
+
+def tile_slices(sizes: Mapping[str, int], tile: Mapping[str, int] = TILE) -> Iterator[tuple]:
+    """``(lat_slice, lon_slice)`` blocks covering a grid of *sizes*."""
+    for i in range(0, sizes["lat"], tile["lat"]):
+        for j in range(0, sizes["lon"], tile["lon"]):
+            yield slice(i, i + tile["lat"]), slice(j, j + tile["lon"])
+
+
+# ── tiled output store ────────────────────────────────────────────────────
+
+def tile_name(lat_slice: slice, lon_slice: slice) -> str:
+    return f"tile_lat{lat_slice.start:05d}_lon{lon_slice.start:05d}.nc"
+
+
+def open_tiles(tile_dir: Path, **kwargs) -> xr.Dataset:
+    """Lazily reassemble one year's tile files into a single dataset."""
+    files = sorted(Path(tile_dir).glob("tile_lat*_lon*.nc"))
+    if not files:
+        raise FileNotFoundError(f"no tile files in {tile_dir}")
+    return xr.open_mfdataset(files, combine="by_coords", **kwargs)
+
+
+def _self_tests() -> None:  # pragma: no cover – light runtime checks
+    """Land cells share each coarse count; tiles match the whole grid."""
+    rng    = np.random.default_rng(0)
+    coarse = xr.Dataset({"a": (("lat", "lon"), rng.uniform(0, 100, (3, 4)))},
+                        coords={"lat": [1.0, 0.0, -1.0], "lon": [-1.5, -0.5, 0.5, 1.5]})
+    flat   = xr.DataArray(np.round(np.arange(1.45, -1.5, -0.1), 2), dims="lat")
+    flon   = xr.DataArray(np.round(np.mod(np.arange(-1.95, 2.0, 0.1), 360), 2), dims="lon")
+    il, jl = coarse_index(flat.values, coarse.lat.values), coarse_index(flon.values, coarse.lon.values, 360)
+    land   = rng.random((flat.size, flon.size)) < 0.5
+    counts = fine_counts(il, jl, (3, 4), mask=land)
+    whole  = disaggregate(coarse, flat, flon, il, jl, counts)
+    assert np.isclose(float(whole["a"].where(land).sum()), float(coarse["a"].sum()), rtol=1e-12), "split total"
+    for la, lo in tile_slices({"lat": flat.size, "lon": flon.size}, {"lat": 7, "lon": 9}):
+        part = disaggregate(coarse, flat[la], flon[lo], il[la], jl[lo], counts)
+        assert np.array_equal(part["a"].values, whole["a"].values[la, lo]), "tile split"
+    print("✅ tile self‑tests passed.")
+
+
+__all__ = [
+    "TILE",
+    "coarse_index",
+    "fine_counts",
+    "disaggregate",
+    "tile_slices",
+    "tile_name",
+    "open_tiles",
+]
+
+
+if __name__ == "__main__":  # pragma: no cover
+    _self_tests()
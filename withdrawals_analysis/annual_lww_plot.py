@@ -29,7 +29,7 @@ for f in sorted(DATA_DIR.glob(PATTERN)):
         annual_total = sum(
             ds[var]
             .sum(dim=["lat", "lon"])   # spatial sum
-            .sum(dim="time")           # sum over 365/366 days
+            .sum(dim="time")           # sum over 365/366 days (or 12 months, 1971–1979)
             for var in wd_vars
         ).compute()
 
@@ -37,12 +37,11 @@ for f in sorted(DATA_DIR.glob(PATTERN)):
         if not wd_vars:
             raise ValueError(f"No *_wd variables in {f.name}")
 
-        # days-per-timestep (xarray decodes ‘time’ automatically)
-        days_in_month = ds["time"].dt.days_in_month
-
-        # m³ day⁻¹  →  m³ month⁻¹ ; then sum over space & species
+        # each step holds the m³ withdrawn over it (a day, or a whole month
+        # for the 1971–1979 backfill): sum the steps of each month, then
+        # over space & species
         monthly_tot = sum(
-            (ds[var] * days_in_month)          # per cell, per month
+            ds[var].resample(time="MS").sum()  # per cell, per month
             .sum(dim=["lat", "lon"])           # global
             for var in wd_vars
         ).compute()                            # bring result into memory